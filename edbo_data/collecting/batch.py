@@ -0,0 +1,204 @@
+"""Collect the data for many sites, one configuration file per site.
+
+The sites (tenants) are collected concurrently with an upper limit on how
+many are in flight. The requests of a tenant run in worker threads, SMHI
+forecasts are downloaded once per grid point and shared by all tenants at
+that point, and the merge can optionally run in a process pool. A tenant
+that fails is logged and does not stop the others. The result of each
+tenant is written to <output_dir>/<tenant>.json.
+
+The configuration file of each tenant is read into a SiteConfig of its
+own, as MyConfig reads the file named by an environment variable, which
+the tenants would share.
+
+Each tenant keeps its rate limits, circuit breakers and last good data in
+its own directory, the state_dir of its configuration file or
+<state dir>/sites/<tenant>. The limits of Tibber and Netatmo are per
+account, so tenants must not share them.
+"""
+
+import asyncio
+import configparser
+import json
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Awaitable
+
+from python_support.configuration import MyConfig  # type: ignore
+
+from ..fetching.fetch_all import FetchAll, merge_sources
+from ..fetching.registry import BUILTIN_SOURCES
+from ..state import state_dir
+
+
+def find_configs(paths: list[str]) -> list[Path]:
+    """Expand directories to the configuration files in them.
+
+    Args:
+        paths (list[str]): Configuration files and directories.
+
+    Returns:
+        list[Path]: The configuration files, the file stem names the tenant.
+    """
+    configs: list[Path] = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            configs.extend(
+                sorted(p for p in path.iterdir() if p.is_file() and p.name[0] != ".")
+            )
+        else:
+            configs.append(path)
+    return configs
+
+
+class SiteConfig:
+    """The configuration of a tenant, read from its file.
+
+    Like with MyConfig, each value is an attribute named by its section and
+    key in lower case, e.g. tibber_token for token in the [TIBBER] section.
+    """
+
+    def __init__(self, path: Path) -> None:
+        """Initialize SiteConfig.
+
+        Args:
+            path (Path): The configuration file.
+        """
+        parser = configparser.ConfigParser(interpolation=None)
+        with open(path) as f:
+            parser.read_file(f)
+        for section in parser.sections():
+            for key, value in parser.items(section):
+                setattr(self, f"{section.lower()}_{key.lower()}", value)
+
+
+def tenant_state_dir(tenant: str, config: MyConfig) -> Path:
+    """Return the state directory of a tenant, creating it if needed."""
+    if getattr(config, "general_state_dir", ""):
+        return state_dir(config)
+    path = state_dir() / "sites" / tenant
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+class BatchCollector:
+    """Collect the data for several configurations at once."""
+
+    def __init__(
+        self,
+        config_paths: list[Path],
+        output_dir: Path,
+        workers: int = 8,
+        merge_processes: int = 0,
+        logger: logging.Logger | None = None,
+    ) -> None:
+        """Initialize BatchCollector.
+
+        Args:
+            config_paths (list[Path]): One configuration file per tenant.
+            output_dir (Path): Where the result of each tenant is written.
+            workers (int): The maximum number of tenants collected at once.
+            merge_processes (int): Size of the process pool used to merge
+                the data, zero merges in this process.
+        """
+        self._config_paths = config_paths
+        self._output_dir = output_dir
+        self._workers = workers
+        self._merge_processes = merge_processes
+        self._log = logger if logger is not None else logging.getLogger(__name__)
+
+    def run(self) -> dict[str, str | None]:
+        """Collect all tenants.
+
+        Returns:
+            dict[str, str | None]: The error per tenant, None if it succeeded.
+        """
+        self._output_dir.mkdir(parents=True, exist_ok=True)
+        configs = {path.stem: SiteConfig(path) for path in self._config_paths}
+        return asyncio.run(self._run(configs))
+
+    async def _run(self, configs: dict[str, MyConfig]) -> dict[str, str | None]:
+        semaphore = asyncio.Semaphore(self._workers)
+        smhi_downloads: dict[tuple[float, float], asyncio.Future[Any]] = {}
+        executor = (
+            ProcessPoolExecutor(self._merge_processes)
+            if self._merge_processes > 0
+            else None
+        )
+        try:
+            errors = await asyncio.gather(
+                *(
+                    self._collect(tenant, config, semaphore, smhi_downloads, executor)
+                    for tenant, config in configs.items()
+                )
+            )
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        return dict(zip(configs, errors))
+
+    async def _collect(
+        self,
+        tenant: str,
+        config: MyConfig,
+        semaphore: asyncio.Semaphore,
+        smhi_downloads: dict[tuple[float, float], asyncio.Future[Any]],
+        executor: ProcessPoolExecutor | None,
+    ) -> str | None:
+        async with semaphore:
+            self._log.info(f"Collecting {tenant}")
+            try:
+                fetch_all = FetchAll(
+                    config, self._log, directory=tenant_state_dir(tenant, config)
+                )
+                names = [spec.name for spec in fetch_all.sources]
+                builtin = [name for name in names if name in BUILTIN_SOURCES]
+                downloads: list[Awaitable[dict[str, Any]]] = [
+                    asyncio.to_thread(fetch_all.fetch_source, name)
+                    for name in builtin
+                    if name != "smhi"
+                ]
+                if "smhi" in builtin:
+                    builtin.remove("smhi")
+                    builtin.append("smhi")
+                    grid_point = (
+                        round(float(config.map_latitude), 2),
+                        round(float(config.map_longitude), 2),
+                    )
+                    if grid_point not in smhi_downloads:
+                        # Through the rate limit and circuit breaker of the
+                        # first tenant at the grid point
+                        smhi_downloads[grid_point] = asyncio.ensure_future(
+                            asyncio.to_thread(fetch_all.fetch_source, "smhi")
+                        )
+                    downloads.append(smhi_downloads[grid_point])
+                fetched = await asyncio.gather(*downloads)
+                sources = dict(zip(builtin, fetched))
+                # Plugin sources may depend on other sources, fetch them in order
+                for name in names:
+                    if name not in sources:
+                        sources[name] = await asyncio.to_thread(
+                            fetch_all.fetch_source, name, sources
+                        )
+                sections = {spec.name: spec.section for spec in fetch_all.sources}
+                if executor is not None:
+                    loop = asyncio.get_running_loop()
+                    all_data = await loop.run_in_executor(
+                        executor, merge_sources, sources, None, sections
+                    )
+                else:
+                    all_data = merge_sources(sources, self._log, sections)
+                self._write(tenant, all_data)
+            except Exception as e:
+                self._log.error(f"Failed to collect {tenant}: {e}")
+                return str(e)
+        self._log.info(f"Collected {tenant}")
+        return None
+
+    def _write(self, tenant: str, all_data: dict[str, Any]) -> None:
+        path = self._output_dir / f"{tenant}.json"
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(all_data, default=str))
+        os.replace(tmp_path, path)
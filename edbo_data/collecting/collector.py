@@ -0,0 +1,196 @@
+"""Keep the data from all sources up to date.
+
+The collector runs until it is stopped. It only polls a source when the
+PollScheduler says that new data can exist and writes the merged data to a
+JSON snapshot file every time something has changed. The snapshot includes
+the derived metrics, see derived. The numeric values are also published in
+a memory-mapped file, see shared_snapshot, and added to the history, which
+is compacted once an hour. Every new forecast run is added to the history
+too. If an MQTT broker is configured the changed values are published to
+it, see mqtt. Between the polls it sleeps.
+"""
+
+import json
+import logging
+import math
+import os
+import time
+from pathlib import Path
+from typing import Any
+
+from python_support.configuration import MyConfig  # type: ignore
+
+from ..fetching.fetch_all import FetchAll
+from ..series.forecast_series import ForecastSeries
+from ..state import state_dir
+from ..storage.history import DAY, HOUR, HistoryStore, history_path
+from .derived import derived_metrics
+from .mqtt import mqtt_publisher
+from .scheduler import PollScheduler
+from .shared_snapshot import SnapshotWriter, samples
+
+SNAPSHOT_FILE = "snapshot.json"
+SHARED_SNAPSHOT_FILE = "snapshot.bin"
+
+# Hours of each forecast run kept in the history
+FORECAST_HOURS = 25
+
+
+class Collector:
+    """Poll the sources on their own cadence and keep a snapshot file."""
+
+    def __init__(
+        self,
+        config: MyConfig,
+        logger: logging.Logger | None = None,
+        scheduler: PollScheduler | None = None,
+        snapshot_path: Path | None = None,
+    ) -> None:
+        """Initialize Collector.
+
+        Args:
+            config (MyConfig): The configuration.
+            logger (logging.Logger | None): Logger to use.
+            scheduler (PollScheduler | None): Defaults to a scheduler with the
+                cadences of the enabled sources.
+            snapshot_path (Path | None): Where to write the snapshot. Defaults
+                to snapshot.json in the state directory.
+        """
+        self._log = logger if logger is not None else logging.getLogger(__name__)
+        self._fetch_all = FetchAll(config, self._log)
+        if scheduler is None:
+            scheduler = PollScheduler(
+                {spec.name: spec.cadence for spec in self._fetch_all.sources}
+            )
+        self._scheduler = scheduler
+        self._sources: dict[str, dict[str, Any]] = {}
+        if snapshot_path is None:
+            snapshot_path = state_dir(config) / SNAPSHOT_FILE
+        self.snapshot_path = snapshot_path
+        self._shared_snapshot = SnapshotWriter(
+            snapshot_path.with_name(SHARED_SNAPSHOT_FILE)
+        )
+        self._history = HistoryStore(history_path(config))
+        retention_days = getattr(config, "history_raw_retention_days", "") or 30
+        self._raw_retention = float(retention_days) * DAY
+        self._compacted_at = 0.0
+        self._derived_metrics = derived_metrics(config)
+        self._mqtt = mqtt_publisher(config, self._log)
+
+    def run(self) -> None:
+        """Poll the sources until interrupted."""
+        while True:
+            self.poll()
+            delay = self._scheduler.seconds_until_next(time.time())
+            self._log.debug(f"Sleeping {delay:.0f} s until the next poll")
+            time.sleep(delay)
+
+    def poll(self, now: float | None = None) -> bool:
+        """Poll the sources that are due.
+
+        Args:
+            now (float | None): The current time (epoch), defaults to now.
+
+        Returns:
+            bool: True if the snapshot was updated.
+        """
+        if now is None:
+            now = time.time()
+        updated = False
+        new_sources = []
+        for name in self._scheduler.due(now):
+            token = self._probe(name)
+            if token is not None and self._scheduler.is_unchanged(name, token):
+                self._log.debug(f"No new data from {name}, skipping the fetch")
+                self._scheduler.record(name, token, now)
+                continue
+            try:
+                data = self._fetch_all.fetch_source(name, self._sources)
+            except Exception as e:
+                self._log.error(f"Polling {name} failed: {e}")
+                self._scheduler.record_failure(name, now)
+                continue
+            if self._scheduler.record(name, token if token is not None else data, now):
+                self._log.info(f"New data from {name}")
+                self._sources[name] = data
+                new_sources.append(name)
+                updated = True
+        if "smhi" in new_sources:
+            self._history.add_forecast(
+                int(now), _forecast_run(self._sources["smhi"], now)
+            )
+        if now - self._compacted_at >= HOUR:
+            self._compact(now)
+        enabled = self._scheduler.names
+        if not updated or any(name not in self._sources for name in enabled):
+            return False
+        all_data = self._fetch_all.merge(self._sources)
+        all_data["derived"] = self._derived_metrics.update(all_data, now)
+        self._write_snapshot(all_data)
+        self._history.add_samples(samples(all_data, now))
+        if "smhi" in self._sources:
+            self._history.add_samples(_forecast_samples(self._sources["smhi"]))
+        return True
+
+    def _compact(self, now: float) -> None:
+        try:
+            self._history.compact(now, self._raw_retention)
+        except Exception as e:
+            self._log.error(f"Compacting the history failed: {e}")
+        self._compacted_at = now
+
+    def _probe(self, name: str) -> str | None:
+        """Cheap check for new data, for sources that support it."""
+        if name != "smhi":
+            return None
+        try:
+            return self._fetch_all.get_smhi_approved_time()
+        except Exception as e:
+            self._log.warning(f"Failed to check SMHI approved time: {e}")
+            return None
+
+    def _write_snapshot(self, all_data: dict[str, Any]) -> None:
+        tmp_path = self.snapshot_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(all_data, default=str))
+        os.replace(tmp_path, self.snapshot_path)
+        forecast = None
+        if "smhi" in self._sources:
+            forecast = ForecastSeries.from_conditions(
+                self._sources["smhi"]["forecast_hour"]
+            )
+        self._shared_snapshot.publish(all_data, forecast)
+        self._log.debug(f"Snapshot written to {self.snapshot_path}")
+        if self._mqtt is not None:
+            try:
+                self._mqtt.publish(all_data)
+            except Exception as e:
+                self._log.error(f"Publishing to MQTT failed: {e}")
+
+
+def _forecast_run(
+    smhi_data: dict[str, Any], now: float
+) -> list[tuple[str, int, float]]:
+    """The next FORECAST_HOURS of the hourly forecast as it is known now."""
+    forecast = ForecastSeries.from_conditions(smhi_data["forecast_hour"])
+    return [
+        (parameter, timestamp, value)
+        for parameter, values in forecast.values.items()
+        for timestamp, value in zip(forecast.timestamps, values)
+        if now - HOUR <= timestamp < now + FORECAST_HOURS * HOUR
+        and not math.isnan(value)
+    ]
+
+
+def _forecast_samples(smhi_data: dict[str, Any]) -> list[tuple[str, int, float]]:
+    """The hourly forecast as forecast.<parameter> samples at the valid times.
+
+    Newer forecast runs replace the samples of the earlier ones, so these
+    are not the forecast known at the time, see _forecast_run().
+    """
+    forecast = ForecastSeries.from_conditions(smhi_data["forecast_hour"])
+    return [
+        (f"forecast.{parameter}", timestamp, value)
+        for parameter, values in forecast.values.items()
+        for timestamp, value in zip(forecast.timestamps, values)
+        if not math.isnan(value)
+    ]
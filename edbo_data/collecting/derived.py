@@ -0,0 +1,312 @@
+"""Metrics derived from the collected data, updated with every snapshot.
+
+- Heating degree-hours: the time integral of how much the outdoor
+  temperature is below the base temperature, e.g. 10 degree-hours for five
+  hours at 2 degrees below it.
+- Rolling means of the outdoor and indoor temperature and the price, and
+  rolling sums of the consumption, the cost and the degree-hours.
+- Cost per kWh, and kWh and cost per degree-hour. The consumption from
+  Tibber arrives some hours late, so these compare it with the
+  degree-hours of the same hours.
+
+Every metric is kept as a rolling aggregate in hourly buckets, so adding a
+sample does not depend on the length of the history. The windows cover the
+last 24 hours and 7 days in whole hours, the current hour included. The
+state is saved in a JSON file and picked up again after a restart.
+"""
+
+import json
+import math
+import os
+from pathlib import Path
+from typing import Any
+
+from python_support.configuration import MyConfig  # type: ignore
+
+from ..state import state_dir
+from ..storage.history import HOUR
+from .values import consumption_time, lookup
+
+BASE_TEMPERATURE = 17.0
+DERIVED_METRICS_FILE = "derived_metrics.json"
+
+# Name and length of the windows
+WINDOWS = {"24h": 24 * HOUR, "7d": 7 * 24 * HOUR}
+
+# Longer gaps between outdoor samples are not counted as degree-hours
+MAX_GAP = 3 * HOUR
+
+# Netatmo reports missing values as -999
+_MISSING = -999.0
+
+# Name of the rolling aggregate and the path to the value in the FetchAll data
+_MEANS: dict[str, tuple[str, ...]] = {
+    "outdoor_temperature": ("outdoor", "current", "temperature"),
+    "indoor_temperature": ("indoor", "temperature"),
+    "price": ("energy", "current_price", "total"),
+}
+# Rolling sums, the heating_ ones only cover the hours with consumption
+_SUMS = (
+    "degree_hours",
+    "consumption",
+    "cost",
+    "heating_consumption",
+    "heating_cost",
+    "heating_degree_hours",
+)
+
+
+def derived_metrics(config: MyConfig) -> "DerivedMetrics":
+    """Return the derived metrics kept in the state directory.
+
+    The base temperature is ``base_temperature`` in the ``[METRICS]``
+    section of the configuration file.
+    """
+    base_temperature = getattr(config, "metrics_base_temperature", "")
+    return DerivedMetrics(
+        state_dir(config) / DERIVED_METRICS_FILE,
+        float(base_temperature or BASE_TEMPERATURE),
+    )
+
+
+class RollingWindow:
+    """Sum and count of the values in a window, kept in buckets."""
+
+    def __init__(self, window: int, bucket: int = HOUR) -> None:
+        """Initialize RollingWindow.
+
+        Args:
+            window (int): Length of the window in seconds.
+            bucket (int): Length of a bucket in seconds.
+        """
+        self._bucket = bucket
+        self._sums = [0.0] * (window // bucket)
+        self._counts = [0] * (window // bucket)
+        self._head = 0
+        self.sum = 0.0
+        self.count = 0
+
+    def advance(self, now: float) -> None:
+        """Move the window to now, dropping the buckets that fell out of it."""
+        head = int(now) // self._bucket
+        if head <= self._head:
+            return
+        size = len(self._sums)
+        for bucket in range(max(self._head + 1, head - size + 1), head + 1):
+            index = bucket % size
+            self.sum -= self._sums[index]
+            self.count -= self._counts[index]
+            self._sums[index] = 0.0
+            self._counts[index] = 0
+        self._head = head
+        if self.count == 0:
+            # Do not let rounding errors pile up
+            self.sum = 0.0
+
+    def add(self, timestamp: float, value: float) -> None:
+        """Add a value, values older than the window are ignored."""
+        bucket = int(timestamp) // self._bucket
+        self.advance(timestamp)
+        if bucket <= self._head - len(self._sums):
+            return
+        index = bucket % len(self._sums)
+        self._sums[index] += value
+        self._counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+    def bucket_sum(self, timestamp: float) -> float:
+        """Return the sum of the bucket of timestamp, 0 if outside the window."""
+        bucket = int(timestamp) // self._bucket
+        if bucket > self._head or bucket <= self._head - len(self._sums):
+            return 0.0
+        return self._sums[bucket % len(self._sums)]
+
+    @property
+    def mean(self) -> float | None:
+        return self.sum / self.count if self.count else None
+
+    def to_state(self) -> dict[str, Any]:
+        return {"head": self._head, "sums": self._sums, "counts": self._counts}
+
+    def load_state(self, state: dict[str, Any]) -> None:
+        if len(state["sums"]) != len(self._sums):
+            return
+        self._head = state["head"]
+        self._sums = [float(value) for value in state["sums"]]
+        self._counts = [int(value) for value in state["counts"]]
+        self.sum = math.fsum(self._sums)
+        self.count = sum(self._counts)
+
+
+class DerivedMetrics:
+    """Keep the derived metrics up to date from FetchAll data."""
+
+    def __init__(
+        self, path: Path | None, base_temperature: float = BASE_TEMPERATURE
+    ) -> None:
+        """Initialize DerivedMetrics, loading the saved state if any.
+
+        Args:
+            path (Path | None): The file that holds the state, None to only
+                keep it in memory.
+            base_temperature (float): Outdoor temperature (Celsius) below
+                which the house is heated.
+        """
+        self._path = path
+        self._base_temperature = base_temperature
+        self._windows = {
+            (name, window): RollingWindow(length)
+            for name in (*_MEANS, *_SUMS)
+            for window, length in WINDOWS.items()
+        }
+        # The last outdoor sample (time, temperature)
+        self._outdoor: tuple[float, float] | None = None
+        self._degree_hours = 0.0
+        # Start of the newest consumption hour that was added
+        self._consumption_until = 0
+        self._load()
+
+    def update(self, all_data: dict[str, Any], now: float) -> dict[str, Any]:
+        """Add the values in the FetchAll data and save the state, if kept.
+
+        Args:
+            all_data (dict[str, Any]): The data returned by FetchAll.
+            now (float): When the data was fetched (epoch).
+
+        Returns:
+            dict[str, Any]: The metrics, see metrics().
+        """
+        for name, path in _MEANS.items():
+            value = _value(all_data, path)
+            if not math.isnan(value):
+                self._add(name, now, value)
+        self._add_outdoor(now, _value(all_data, _MEANS["outdoor_temperature"]))
+        consumption = all_data.get("energy", {}).get("consumption", {})
+        self._add_consumption(consumption)
+        if self._path is not None:
+            self.save()
+        return self.metrics(now)
+
+    def metrics(self, now: float) -> dict[str, Any]:
+        """Return the metrics at now, None where there is no data.
+
+        Returns:
+            dict[str, Any]: base_temperature and degree_hours_total, and per
+                window the means, sums and ratios.
+        """
+        for rolling in self._windows.values():
+            rolling.advance(now)
+        metrics: dict[str, Any] = {
+            "base_temperature": self._base_temperature,
+            "degree_hours_total": round(self._degree_hours, 3),
+        }
+        for window in WINDOWS:
+            values: dict[str, Any] = {}
+            for name in _MEANS:
+                values[f"{name}_mean"] = _rounded(self._windows[name, window].mean)
+            sums = {name: self._windows[name, window].sum for name in _SUMS}
+            values["degree_hours"] = round(sums["degree_hours"], 3)
+            values["consumption"] = round(sums["consumption"], 3)
+            values["cost"] = round(sums["cost"], 3)
+            values["cost_per_kwh"] = _ratio(sums["cost"], sums["consumption"])
+            values["kwh_per_degree_hour"] = _ratio(
+                sums["heating_consumption"], sums["heating_degree_hours"]
+            )
+            values["cost_per_degree_hour"] = _ratio(
+                sums["heating_cost"], sums["heating_degree_hours"]
+            )
+            metrics[window] = values
+        return metrics
+
+    def save(self) -> None:
+        assert self._path is not None
+        state = {
+            "base_temperature": self._base_temperature,
+            "outdoor": self._outdoor,
+            "degree_hours": self._degree_hours,
+            "consumption_until": self._consumption_until,
+            "windows": {
+                f"{name}.{window}": rolling.to_state()
+                for (name, window), rolling in self._windows.items()
+            },
+        }
+        tmp_path = self._path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(state))
+        os.replace(tmp_path, self._path)
+
+    def _load(self) -> None:
+        if self._path is None:
+            return
+        try:
+            state = json.loads(self._path.read_text())
+        except (OSError, ValueError):
+            return
+        if state.get("base_temperature") != self._base_temperature:
+            # The degree-hours were counted against another base, start over
+            return
+        if state["outdoor"]:
+            self._outdoor = (state["outdoor"][0], state["outdoor"][1])
+        self._degree_hours = state["degree_hours"]
+        self._consumption_until = state["consumption_until"]
+        for (name, window), rolling in self._windows.items():
+            if f"{name}.{window}" in state["windows"]:
+                rolling.load_state(state["windows"][f"{name}.{window}"])
+
+    def _add(self, name: str, timestamp: float, value: float) -> None:
+        for window in WINDOWS:
+            self._windows[name, window].add(timestamp, value)
+
+    def _add_outdoor(self, now: float, temperature: float) -> None:
+        if math.isnan(temperature):
+            return
+        if self._outdoor is not None:
+            previous_time, previous_temperature = self._outdoor
+            if now <= previous_time:
+                return
+            if now - previous_time <= MAX_GAP:
+                # Trapezoid rule, attributed to the hour of the new sample
+                mean = (previous_temperature + temperature) / 2
+                hours = (now - previous_time) / HOUR
+                degree_hours = max(0.0, self._base_temperature - mean) * hours
+                self._degree_hours += degree_hours
+                self._add("degree_hours", now, degree_hours)
+        self._outdoor = (now, temperature)
+
+    def _add_consumption(self, consumption: dict[str, Any]) -> None:
+        # Only the hours newer than the ones already added, Tibber returns
+        # the hours in order so the older ones are not parsed
+        entries = []
+        for date_str, entry in reversed(consumption.items()):
+            timestamp = consumption_time(date_str)
+            if timestamp <= self._consumption_until:
+                break
+            entries.append((timestamp, entry))
+        for timestamp, entry in sorted(entries, key=lambda e: e[0]):
+            kwh = lookup(entry, ("consumption",))
+            cost = lookup(entry, ("cost",))
+            if math.isnan(kwh):
+                continue
+            self._add("consumption", timestamp, kwh)
+            if not math.isnan(cost):
+                self._add("cost", timestamp, cost)
+            self._consumption_until = timestamp
+            # The degree-hours are only kept for a week
+            degree_hours = self._windows["degree_hours", "7d"].bucket_sum(timestamp)
+            if degree_hours > 0 and not math.isnan(cost):
+                self._add("heating_consumption", timestamp, kwh)
+                self._add("heating_cost", timestamp, cost)
+                self._add("heating_degree_hours", timestamp, degree_hours)
+
+
+def _value(all_data: dict[str, Any], path: tuple[str, ...]) -> float:
+    value = lookup(all_data, path)
+    return math.nan if value == _MISSING else value
+
+
+def _rounded(value: float | None) -> float | None:
+    return None if value is None else round(value, 3)
+
+
+def _ratio(numerator: float, denominator: float) -> float | None:
+    return round(numerator / denominator, 4) if denominator > 0 else None
@@ -0,0 +1,202 @@
+"""Publish the snapshots to an MQTT broker.
+
+Home automation can subscribe to the values instead of running edbo-data
+and parsing its output. Each value of the FetchAll data is a retained
+message on its own topic below the topic prefix, e.g.
+``edbo_data/indoor/co2`` or ``edbo_data/derived/24h/degree_hours``, so a
+new subscriber gets the latest values at once. Series like the prices,
+the consumption and the forecasts are published as JSON documents, e.g.
+``edbo_data/energy/prices``.
+
+The publisher keeps one connection to the broker, which paho reconnects in
+the background. All the values of a snapshot are published together, and
+only those that changed since the last snapshot. A value that is no
+longer in the snapshot is cleared with an empty retained message. After a
+reconnect every value is published again, as the broker may have lost
+them.
+``<prefix>/status`` is ``online``, and ``offline`` (the last will) when the
+connection is lost.
+
+paho-mqtt is an optional dependency, ``pip install edbo_data[mqtt]``.
+"""
+
+import json
+import logging
+import threading
+from typing import Any
+
+from python_support.configuration import MyConfig  # type: ignore
+
+TOPIC_PREFIX = "edbo_data"
+
+# Sections published as one JSON document instead of a topic per value
+JSON_SECTIONS = {
+    ("energy", "prices"),
+    ("energy", "consumption"),
+    ("outdoor", "forecast"),
+    ("outdoor", "forecast_24h"),
+}
+
+
+def _paho() -> Any:
+    try:
+        import paho.mqtt.client as mqtt  # type: ignore
+    except ImportError as e:
+        raise ImportError(
+            "Publishing to MQTT needs paho-mqtt, install it with: "
+            "pip install edbo_data[mqtt]"
+        ) from e
+    return mqtt
+
+
+def _topic_part(key: Any) -> str:
+    # Wildcards and separators are not allowed in the levels of a topic
+    return str(key).replace("/", "_").replace("+", "_").replace("#", "_")
+
+
+def _payload(value: Any) -> str:
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, default=str)
+
+
+def topics(all_data: dict[str, Any], prefix: str = TOPIC_PREFIX) -> dict[str, str]:
+    """Return the topics and payloads of the FetchAll data.
+
+    Args:
+        all_data (dict[str, Any]): The data returned by FetchAll.
+        prefix (str): The first level of the topics.
+
+    Returns:
+        dict[str, str]: The payload of each topic.
+    """
+    messages: dict[str, str] = {}
+
+    def add(path: tuple[str, ...], value: Any) -> None:
+        if isinstance(value, dict) and path not in JSON_SECTIONS:
+            for key, item in value.items():
+                add((*path, _topic_part(key)), item)
+        else:
+            messages["/".join((prefix, *path))] = _payload(value)
+
+    for key, value in all_data.items():
+        add((_topic_part(key),), value)
+    return messages
+
+
+class MqttPublisher:
+    """Publish the changed values of each snapshot as retained messages."""
+
+    def __init__(
+        self,
+        host: str,
+        port: int = 1883,
+        prefix: str = TOPIC_PREFIX,
+        username: str | None = None,
+        password: str | None = None,
+        logger: logging.Logger | None = None,
+        client: Any = None,
+    ) -> None:
+        """Initialize MqttPublisher and start connecting to the broker.
+
+        Args:
+            host (str): The broker.
+            port (int): The port of the broker.
+            prefix (str): The first level of the topics.
+            username (str | None): User name at the broker, if any.
+            password (str | None): Password at the broker, if any.
+            logger (logging.Logger | None): Logger to use.
+            client (Any): A paho Client or a stand-in, created if not given.
+        """
+        self._log = logger if logger is not None else logging.getLogger(__name__)
+        self._prefix = prefix
+        self._status_topic = f"{prefix}/status"
+        # Payload of each topic as last published
+        self._published: dict[str, str] = {}
+        self._lock = threading.Lock()
+        if client is None:
+            mqtt = _paho()
+            if hasattr(mqtt, "CallbackAPIVersion"):
+                # paho-mqtt 2
+                client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION1)
+            else:
+                client = mqtt.Client()
+        self._client = client
+        if username:
+            client.username_pw_set(username, password)
+        client.will_set(self._status_topic, "offline", retain=True)
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        client.connect_async(host, port)
+        client.loop_start()
+
+    def publish(self, all_data: dict[str, Any]) -> int:
+        """Publish the values that changed since the last snapshot.
+
+        The topics of the values that are gone are cleared.
+
+        Args:
+            all_data (dict[str, Any]): The data returned by FetchAll.
+
+        Returns:
+            int: The number of messages published.
+        """
+        messages = topics(all_data, self._prefix)
+        with self._lock:
+            changed = {
+                topic: payload
+                for topic, payload in messages.items()
+                if self._published.get(topic) != payload
+            }
+            # An empty retained message removes the retained value
+            changed.update(
+                {
+                    topic: ""
+                    for topic, payload in self._published.items()
+                    if payload and topic not in messages
+                }
+            )
+            for topic, payload in changed.items():
+                # Dropped while disconnected, _on_connect sends them again
+                self._client.publish(topic, payload, retain=True)
+            self._published.update(changed)
+        self._log.debug(f"Published {len(changed)} of {len(messages)} MQTT topics")
+        return len(changed)
+
+    def close(self) -> None:
+        self._client.publish(self._status_topic, "offline", retain=True)
+        self._client.disconnect()
+        self._client.loop_stop()
+
+    def _on_connect(self, client: Any, userdata: Any, flags: Any, rc: int) -> None:
+        if rc != 0:
+            self._log.warning(f"Connecting to the MQTT broker failed: {rc}")
+            return
+        self._log.info("Connected to the MQTT broker")
+        client.publish(self._status_topic, "online", retain=True)
+        with self._lock:
+            # The broker may have lost the retained values, send them again
+            republish = dict(self._published)
+        for topic, payload in republish.items():
+            client.publish(topic, payload, retain=True)
+
+    def _on_disconnect(self, client: Any, userdata: Any, rc: int) -> None:
+        if rc != 0:
+            self._log.warning(f"Lost the connection to the MQTT broker: {rc}")
+
+
+def mqtt_publisher(
+    config: MyConfig, logger: logging.Logger | None = None
+) -> MqttPublisher | None:
+    """Return a publisher for the ``[MQTT]`` section, None without a host."""
+    host = getattr(config, "mqtt_host", "")
+    if not host:
+        return None
+    return MqttPublisher(
+        host,
+        int(getattr(config, "mqtt_port", "") or 1883),
+        getattr(config, "mqtt_topic_prefix", "") or TOPIC_PREFIX,
+        getattr(config, "mqtt_username", "") or None,
+        getattr(config, "mqtt_password", "") or None,
+        logger,
+    )
@@ -0,0 +1,387 @@
+"""Replay the history through the merge, the derived metrics and controllers.
+
+Strategies, e.g. for heating or charging, are tried out by replaying
+months of collected data as if it was live. At each step the stored values
+are put back into the shape of the source data and go through
+merge_sources() and DerivedMetrics, as in the collector, and the FetchAll
+data is given to a controller, a function of (time, all_data).
+
+At a step the values of the step before it are known: each stored series
+is resampled to the step and the value of the bucket that ended last is
+used, for at most max_age. The consumption of an hour is known when the
+hour has ended, the prices of the next day from 13:00. The hourly
+forecast is the latest forecast run that was fetched at or before the
+step. Histories from before the runs were kept only have the last forecast
+of each hour, which is used with a warning, as it was not known yet at
+the step.
+
+The history of a range is read with one query per series into arrays
+(Timeline), which a controller can also use as it is. Stepping through it
+only slices the arrays. Long ranges can be split by date over a pool of
+processes. Each process starts warmup before its range, so that the
+rolling metrics are the same as in a single run. Controllers that keep
+state of their own see each range separately.
+"""
+
+import bisect
+import logging
+import math
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+from ..fetching.fetch_all import merge_sources
+from ..series.forecast_series import PARAMETERS
+from ..storage.history import DAY, HOUR, Aggregate, HistoryStore
+from .collector import FORECAST_HOURS
+from .derived import BASE_TEMPERATURE, DerivedMetrics
+from .shared_snapshot import SCALARS
+
+# Where the stored scalars go in the source data, by their FetchAll section
+_SOURCE_PATHS = {
+    "indoor": ("netatmo", "indoor"),
+    "outdoor": ("smhi", "current"),
+    "energy": ("tibber", "info", "current_price_info"),
+}
+
+# Hours of consumption in each snapshot, as fetched from Tibber
+CONSUMPTION_HOURS = 48
+
+# Local hour when the prices of the next day are published
+NEXT_DAY_PRICES_HOUR = 13
+
+Controller = Callable[[int, dict[str, Any]], Any]
+
+
+@dataclass
+class Timeline:
+    """The stored history of a range, resampled to the steps."""
+
+    steps: "array[int]"
+    # The value of each stored scalar at each step, NaN when unknown
+    values: dict[str, "array[float]"]
+    # Start and price of each hourly price slot
+    price_times: "array[int]"
+    prices: "array[float]"
+    # Start, kWh and cost of each hour
+    consumption_times: "array[int]"
+    consumption: "array[float]"
+    cost: "array[float]"
+    # When each forecast run was fetched, and where its hours start in
+    # forecast_times, with the end of the last run at the end
+    forecast_issued: "array[int]"
+    forecast_offsets: "array[int]"
+    # Valid time and parameters of the hourly forecast, run after run
+    forecast_times: "array[int]"
+    forecast: dict[str, "array[float]"]
+
+
+class Replay:
+    """Feed the history back through the code paths of the collector."""
+
+    def __init__(
+        self,
+        history: Path,
+        step: int = HOUR,
+        max_age: int = 3 * HOUR,
+        base_temperature: float = BASE_TEMPERATURE,
+        logger: logging.Logger | None = None,
+    ) -> None:
+        """Initialize Replay.
+
+        Args:
+            history (Path): The history database.
+            step (int): Seconds between the steps.
+            max_age (int): Seconds that a stored value is used after it was
+                sampled.
+            base_temperature (float): For the heating degree-hours.
+            logger (logging.Logger | None): Logger to use.
+        """
+        self._log = logger if logger is not None else logging.getLogger(__name__)
+        self._history = history
+        self._step = step
+        self._max_age = max_age
+        self._base_temperature = base_temperature
+
+    def timeline(self, start: int, end: int) -> Timeline:
+        """Read the history of the steps in [start, end).
+
+        Args:
+            start (int): The first step (epoch), rounded up to a whole step.
+            end (int): End of the range (epoch).
+
+        Returns:
+            Timeline: The history resampled to the steps.
+        """
+        step = self._step
+        steps = array("q", range(-(-start // step) * step, end, step))
+        store = HistoryStore(self._history)
+        try:
+            values = {
+                name: self._as_of(
+                    store.aggregates(name, start - self._max_age, end, step), steps
+                )
+                for name, path in SCALARS.items()
+                if path[0] in _SOURCE_PATHS
+            }
+            # The prices of the next day are known before it starts, after
+            # 13:00 up to the midnight after it
+            prices = store.aggregates("energy.prices", start - DAY, end + 2 * DAY, HOUR)
+            hours = store.aggregates(
+                "energy.consumption", start - CONSUMPTION_HOURS * HOUR, end, HOUR
+            )
+            costs = store.aggregates(
+                "energy.cost", start - CONSUMPTION_HOURS * HOUR, end, HOUR
+            )
+            consumption = {a.start: [a.sum, math.nan] for a in hours}
+            for a in costs:
+                consumption.setdefault(a.start, [math.nan, math.nan])[1] = a.sum
+            # Hours missing from the samples are taken from the backfill
+            backfill = store.consumption(
+                "HOURLY", start - CONSUMPTION_HOURS * HOUR, end
+            )
+            for hour, kwh, cost in backfill:
+                if hour not in consumption and kwh is not None:
+                    consumption[hour] = [kwh, math.nan if cost is None else cost]
+            runs = store.forecasts(start, end)
+            if not runs:
+                runs = self._last_forecast(store, start, end)
+        finally:
+            store.close()
+        # The parameters of each hour of each run, in order
+        by_run: dict[int, dict[int, dict[str, float]]] = {}
+        for issued, parameter, valid, value in runs:
+            by_run.setdefault(issued, {}).setdefault(valid, {})[parameter] = value
+        forecast_issued = array("q", by_run)
+        forecast_offsets = array("q")
+        forecast_times = array("q")
+        forecast = {parameter: array("d") for parameter in PARAMETERS}
+        for run_hours in by_run.values():
+            forecast_offsets.append(len(forecast_times))
+            for valid, parameters in run_hours.items():
+                forecast_times.append(valid)
+                for parameter, column in forecast.items():
+                    column.append(parameters.get(parameter, math.nan))
+        forecast_offsets.append(len(forecast_times))
+        consumption_times = sorted(consumption)
+        return Timeline(
+            steps=steps,
+            values=values,
+            price_times=array("q", (a.start for a in prices)),
+            prices=array("d", (a.mean for a in prices)),
+            consumption_times=array("q", consumption_times),
+            consumption=array("d", (consumption[t][0] for t in consumption_times)),
+            cost=array("d", (consumption[t][1] for t in consumption_times)),
+            forecast_issued=forecast_issued,
+            forecast_offsets=forecast_offsets,
+            forecast_times=forecast_times,
+            forecast=forecast,
+        )
+
+    def _last_forecast(
+        self, store: HistoryStore, start: int, end: int
+    ) -> list[tuple[int, str, int, float]]:
+        """The last stored forecast of each hour, as one run issued at 0."""
+        self._log.warning(
+            "No forecast runs in the history, replaying the last forecast of "
+            "each hour, which was not known yet at the steps"
+        )
+        return sorted(
+            (
+                (0, parameter, a.start, a.mean)
+                for parameter in PARAMETERS
+                for a in store.aggregates(
+                    f"forecast.{parameter}", start, end + DAY, HOUR
+                )
+            ),
+            key=lambda row: row[2],
+        )
+
+    def _as_of(
+        self, aggregates: list[Aggregate], steps: "array[int]"
+    ) -> "array[float]":
+        """The mean of the last bucket that ended at or before each step."""
+        result = array("d", [math.nan]) * len(steps)
+        index = 0
+        ended = None
+        value = math.nan
+        for i, step_time in enumerate(steps):
+            while (
+                index < len(aggregates)
+                and aggregates[index].start + self._step <= step_time
+            ):
+                ended = aggregates[index].start + self._step
+                value = aggregates[index].mean
+                index += 1
+            if ended is not None and step_time - ended < self._max_age:
+                result[i] = value
+        return result
+
+    def snapshots(
+        self, timeline: Timeline, start: int | None = None
+    ) -> Iterator[tuple[int, dict[str, Any]]]:
+        """Yield the time and the FetchAll data of each step.
+
+        Args:
+            timeline (Timeline): From timeline().
+            start (int | None): Only yield the steps from this time, the
+                steps before it only update the derived metrics.
+
+        Yields:
+            tuple[int, dict[str, Any]]: The time of the step and the merged
+                data, with the derived metrics.
+        """
+        metrics = DerivedMetrics(None, self._base_temperature)
+        scalars = [
+            (name.rsplit(".", 1)[1], _SOURCE_PATHS[SCALARS[name][0]], values)
+            for name, values in timeline.values.items()
+        ]
+        # The source data of the slots, hours and forecast times is made once
+        # and shared by the steps, merge_sources() does not change it
+        price_keys = [_local_iso(t) for t in timeline.price_times]
+        consumption_entries = [
+            {"from": _local_iso(t), "consumption": kwh, "cost": cost}
+            for t, kwh, cost in zip(
+                timeline.consumption_times, timeline.consumption, timeline.cost
+            )
+        ]
+        conditions = [
+            _conditions(t, timeline.forecast, i)
+            for i, t in enumerate(timeline.forecast_times)
+        ]
+        for i, step_time in enumerate(timeline.steps):
+            sources: dict[str, dict[str, Any]] = {}
+            for key, path, values in scalars:
+                value = values[i]
+                if math.isnan(value):
+                    continue
+                section = sources.setdefault(path[0], {})
+                for part in path[1:]:
+                    section = section.setdefault(part, {})
+                section[key] = value
+            if "smhi" in sources:
+                sources["smhi"]["current"]["valid_time"] = datetime.fromtimestamp(
+                    step_time, timezone.utc
+                )
+            run = bisect.bisect_right(timeline.forecast_issued, step_time) - 1
+            if run >= 0:
+                run_end = timeline.forecast_offsets[run + 1]
+                first = bisect.bisect_left(
+                    timeline.forecast_times,
+                    step_time,
+                    timeline.forecast_offsets[run],
+                    run_end,
+                )
+                if first < run_end:
+                    sources.setdefault("smhi", {})["forecast_hour"] = conditions[
+                        first : min(run_end, first + FORECAST_HOURS)
+                    ]
+            end = bisect.bisect_right(timeline.consumption_times, step_time - HOUR)
+            if end > 0:
+                begin = max(0, end - CONSUMPTION_HOURS)
+                sources.setdefault("tibber", {})["consumption"] = consumption_entries[
+                    begin:end
+                ]
+            day_start, known_until = _known_prices(step_time)
+            begin = bisect.bisect_left(timeline.price_times, day_start)
+            end = bisect.bisect_left(timeline.price_times, known_until)
+            if end > begin:
+                sources["tibber_prices"] = dict(
+                    zip(price_keys[begin:end], timeline.prices[begin:end])
+                )
+            all_data = merge_sources(sources, self._log)
+            all_data["derived"] = metrics.update(all_data, step_time)
+            if start is None or step_time >= start:
+                yield step_time, all_data
+
+    def run(
+        self,
+        controller: Controller,
+        start: int,
+        end: int,
+        workers: int = 1,
+        warmup: int = 7 * DAY,
+    ) -> list[tuple[int, Any]]:
+        """Replay [start, end) and call the controller at each step.
+
+        Args:
+            controller (Controller): Called with the time and the FetchAll
+                data of each step. With more than one worker it has to be a
+                module level function, so that it can be pickled.
+            start (int): Start of the range (epoch).
+            end (int): End of the range (epoch).
+            workers (int): Processes to split the range over, by day.
+            warmup (int): Seconds replayed before each range, without calling
+                the controller, to fill the rolling metrics.
+
+        Returns:
+            list[tuple[int, Any]]: The time and result of each step.
+        """
+        started = time.perf_counter()
+        days = max(1, -(-(end - start) // DAY))
+        per_worker = -(-days // max(1, workers)) * DAY
+        ranges = [
+            (range_start, min(end, range_start + per_worker))
+            for range_start in range(start, end, per_worker)
+        ]
+        if len(ranges) == 1:
+            results = self._run_range(controller, start, end, warmup)
+        else:
+            with ProcessPoolExecutor(len(ranges)) as executor:
+                futures = [
+                    executor.submit(
+                        self._run_range, controller, range_start, range_end, warmup
+                    )
+                    for range_start, range_end in ranges
+                ]
+                results = [result for f in futures for result in f.result()]
+        self._log.info(
+            f"Replayed {len(results)} steps in {time.perf_counter() - started:.2f} s"
+        )
+        return results
+
+    def _run_range(
+        self, controller: Controller, start: int, end: int, warmup: int
+    ) -> list[tuple[int, Any]]:
+        timeline = self.timeline(start - warmup, end)
+        return [
+            (step_time, controller(step_time, all_data))
+            for step_time, all_data in self.snapshots(timeline, start)
+        ]
+
+
+def _local_iso(timestamp: int) -> str:
+    return datetime.fromtimestamp(timestamp).astimezone().isoformat()
+
+
+def _known_prices(timestamp: int) -> tuple[int, int]:
+    """The range of the price slots that Tibber has published at timestamp."""
+    now = datetime.fromtimestamp(timestamp)
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    days = 2 if now.hour >= NEXT_DAY_PRICES_HOUR else 1
+    day_start = int(midnight.timestamp())
+    # Whole days, also across changes of daylight saving time
+    next_midnight = datetime.fromtimestamp(day_start + days * DAY + 2 * HOUR)
+    known_until = next_midnight.replace(hour=0, minute=0, second=0, microsecond=0)
+    return day_start, int(known_until.timestamp())
+
+
+def _conditions(
+    timestamp: int, forecast: dict[str, "array[float]"], index: int
+) -> dict[str, Any]:
+    """The stored forecast of one hour as FetchSMHI conditions."""
+    conditions: dict[str, Any] = {
+        parameter: None if math.isnan(values[index]) else values[index]
+        for parameter, values in forecast.items()
+    }
+    conditions["valid_time"] = datetime.fromtimestamp(timestamp, timezone.utc)
+    # Only the parameters are stored
+    conditions["temperature_min"] = conditions["temperature"]
+    conditions["temperature_max"] = conditions["temperature"]
+    conditions["symbol_string"] = ""
+    conditions["precipitation_string"] = ""
+    return conditions
@@ -0,0 +1,188 @@
+"""Decide when each data source should be polled.
+
+The sources publish new data at very different rates. Netatmo stations
+upload about every 10 minutes, Tibber publishes the prices for the next day
+once a day around 13:00 and SMHI approves a new forecast run a few times a
+day. Each source is given a cadence that knows when new data can exist and
+the scheduler backs off when a poll did not return anything new.
+"""
+
+import hashlib
+import json
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime, time, timedelta
+from typing import Any
+from zoneinfo import ZoneInfo
+
+
+class Cadence(ABC):
+    """When to poll a source next."""
+
+    @abstractmethod
+    def next_poll(self, now: float, changed: bool, misses: int) -> float:
+        """Return the time of the next poll.
+
+        Args:
+            now (float): The time of the poll that was just made (epoch).
+            changed (bool): True if the poll returned new data.
+            misses (int): The number of polls in a row without new data.
+
+        Returns:
+            float: The time of the next poll (epoch).
+        """
+
+
+@dataclass(frozen=True)
+class IntervalCadence(Cadence):
+    """New data can show up at any time, roughly every interval seconds."""
+
+    interval: float
+    max_interval: float
+    backoff: float = 2.0
+
+    def next_poll(self, now: float, changed: bool, misses: int) -> float:
+        if changed:
+            return now + self.interval
+        return now + min(self.interval * self.backoff**misses, self.max_interval)
+
+
+@dataclass(frozen=True)
+class AlignedCadence(Cadence):
+    """New data shows up at fixed boundaries, e.g. at the start of every hour.
+
+    The offset gives the upstream some time to publish after the boundary.
+    """
+
+    period: float
+    offset: float = 0.0
+    retry: float = 300.0
+    backoff: float = 2.0
+
+    def next_poll(self, now: float, changed: bool, misses: int) -> float:
+        boundary = (now - self.offset) // self.period * self.period
+        boundary += self.period + self.offset
+        if changed:
+            return boundary
+        return min(now + self.retry * self.backoff ** (misses - 1), boundary)
+
+
+@dataclass(frozen=True)
+class DailyCadence(Cadence):
+    """New data is published once a day around a known local time."""
+
+    publish: time
+    timezone: str = "Europe/Stockholm"
+    retry: float = 600.0
+    max_retry: float = 3600.0
+    backoff: float = 2.0
+
+    def next_poll(self, now: float, changed: bool, misses: int) -> float:
+        local = datetime.fromtimestamp(now, ZoneInfo(self.timezone))
+        publish_today = local.replace(
+            hour=self.publish.hour,
+            minute=self.publish.minute,
+            second=0,
+            microsecond=0,
+        )
+        if local < publish_today:
+            return publish_today.timestamp()
+        if changed:
+            return (publish_today + timedelta(days=1)).timestamp()
+        delay = min(self.retry * self.backoff ** (misses - 1), self.max_retry)
+        return now + delay
+
+
+DEFAULT_CADENCES: dict[str, Cadence] = {
+    "netatmo": IntervalCadence(interval=600, max_interval=1800),
+    "tibber": AlignedCadence(period=3600, offset=120),
+    "tibber_prices": DailyCadence(publish=time(13, 0)),
+    "smhi": IntervalCadence(interval=1800, max_interval=7200),
+}
+
+
+def fingerprint(data: Any) -> str:
+    """Return a short hash of JSON-like data, used to detect changes."""
+    encoded = json.dumps(data, sort_keys=True, default=str).encode()
+    return hashlib.sha1(encoded).hexdigest()
+
+
+@dataclass
+class _SourceState:
+    cadence: Cadence
+    next_poll: float = 0.0
+    fingerprint: str | None = None
+    misses: int = 0
+    failures: int = 0
+
+
+class PollScheduler:
+    """Keep track of when each source is due to be polled."""
+
+    def __init__(
+        self,
+        cadences: dict[str, Cadence] | None = None,
+        retry_after_failure: float = 60.0,
+        max_retry_after_failure: float = 1800.0,
+    ) -> None:
+        """Initialize PollScheduler.
+
+        Args:
+            cadences (dict[str, Cadence] | None): Cadence per source name.
+                Defaults to DEFAULT_CADENCES.
+            retry_after_failure (float): Seconds to wait after a failed poll.
+                Doubled for each failure in a row.
+            max_retry_after_failure (float): Upper limit of the wait after
+                failed polls.
+        """
+        if cadences is None:
+            cadences = DEFAULT_CADENCES
+        self._sources = {
+            name: _SourceState(cadence) for name, cadence in cadences.items()
+        }
+        self._retry_after_failure = retry_after_failure
+        self._max_retry_after_failure = max_retry_after_failure
+
+    @property
+    def names(self) -> list[str]:
+        return list(self._sources)
+
+    def due(self, now: float) -> list[str]:
+        """Return the names of the sources that should be polled now."""
+        return [name for name, s in self._sources.items() if s.next_poll <= now]
+
+    def seconds_until_next(self, now: float) -> float:
+        """Return the number of seconds until the next source is due."""
+        next_poll = min(s.next_poll for s in self._sources.values())
+        return max(0.0, next_poll - now)
+
+    def is_unchanged(self, name: str, data: Any) -> bool:
+        """Check if data is the same as what the source returned last time."""
+        return self._sources[name].fingerprint == fingerprint(data)
+
+    def record(self, name: str, data: Any, now: float) -> bool:
+        """Record the result of a poll and schedule the next one.
+
+        Args:
+            name (str): The source that was polled.
+            data (Any): What the poll returned.
+            now (float): The time of the poll (epoch).
+
+        Returns:
+            bool: True if the data differs from the previous poll.
+        """
+        state = self._sources[name]
+        new_fingerprint = fingerprint(data)
+        changed = new_fingerprint != state.fingerprint
+        state.fingerprint = new_fingerprint
+        state.failures = 0
+        state.misses = 0 if changed else state.misses + 1
+        state.next_poll = state.cadence.next_poll(now, changed, state.misses)
+        return changed
+
+    def record_failure(self, name: str, now: float) -> None:
+        """Record a failed poll, it is retried with an exponential backoff."""
+        state = self._sources[name]
+        delay = self._retry_after_failure * 2**state.failures
+        state.failures += 1
+        state.next_poll = now + min(delay, self._max_retry_after_failure)
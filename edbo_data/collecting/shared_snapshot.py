@@ -0,0 +1,290 @@
+"""Publish the latest numbers in a memory-mapped file.
+
+Local programs that only need a few numbers, like the current price or the
+indoor CO2, can read them from the file without starting edbo-data or
+parsing JSON. The series hold the prices, the consumption and the hourly
+outdoor temperature forecast.
+
+The file has a fixed binary layout (little-endian)::
+
+    header   magic "EDBO", layout version (u32), sequence (u64),
+             written at (f64, epoch), price slot length (u32, seconds,
+             0 without prices), 4 bytes padding
+    scalars  one f64 per name in SCALARS, NaN when missing
+    series   per name in SERIES: count (u32), 4 bytes padding,
+             timestamps (i64[capacity], epoch) and values (f64[capacity])
+
+The sequence number works as a seqlock. The writer makes it odd before it
+changes the file and even again when done. A reader retries if the
+sequence was odd or changed while it was reading.
+"""
+
+import bisect
+import math
+import mmap
+import os
+import struct
+import time
+from pathlib import Path
+from typing import Any, Callable, TypeVar
+
+from ..series.forecast_series import ForecastSeries
+from ..series.price_series import PriceSeries
+from .values import consumption_time, lookup
+
+T = TypeVar("T")
+
+MAGIC = b"EDBO"
+LAYOUT_VERSION = 4
+
+# Name in the file and the path to the value in the FetchAll data
+SCALARS: dict[str, tuple[str, ...]] = {
+    "indoor.temperature": ("indoor", "temperature"),
+    "indoor.co2": ("indoor", "co2"),
+    "indoor.humidity": ("indoor", "humidity"),
+    "indoor.pressure": ("indoor", "pressure"),
+    "indoor.noise": ("indoor", "noise"),
+    "outdoor.temperature": ("outdoor", "current", "temperature"),
+    "outdoor.humidity": ("outdoor", "current", "humidity"),
+    "outdoor.wind_speed": ("outdoor", "current", "wind_speed"),
+    "energy.current_price.total": ("energy", "current_price", "total"),
+    "energy.current_price.energy": ("energy", "current_price", "energy"),
+    "energy.current_price.tax": ("energy", "current_price", "tax"),
+    "derived.degree_hours_24h": ("derived", "24h", "degree_hours"),
+    "derived.outdoor_temperature_mean_24h": (
+        "derived",
+        "24h",
+        "outdoor_temperature_mean",
+    ),
+    "derived.price_mean_24h": ("derived", "24h", "price_mean"),
+    "derived.cost_per_kwh_7d": ("derived", "7d", "cost_per_kwh"),
+    "derived.kwh_per_degree_hour_7d": ("derived", "7d", "kwh_per_degree_hour"),
+    "derived.cost_per_degree_hour_7d": ("derived", "7d", "cost_per_degree_hour"),
+}
+
+# Name of the series and the maximum number of entries. Two days of prices
+# with 15 minute resolution, a month of hourly consumption and the next two
+# days of the hourly forecast.
+SERIES: dict[str, int] = {
+    "energy.prices": 2 * 24 * 4,
+    "energy.consumption": 31 * 24,
+    "energy.cost": 31 * 24,
+    "forecast.temperature": 2 * 24,
+}
+
+_HEADER = struct.Struct("<4sIQdI4x")
+_SEQUENCE_OFFSET = 8
+_SCALARS = struct.Struct(f"<{len(SCALARS)}d")
+_SCALARS_OFFSET = _HEADER.size
+_COUNT = struct.Struct("<I4x")
+
+
+def _series_offsets() -> tuple[dict[str, int], int]:
+    offsets = {}
+    offset = _SCALARS_OFFSET + _SCALARS.size
+    for name, capacity in SERIES.items():
+        offsets[name] = offset
+        offset += _COUNT.size + 16 * capacity
+    return offsets, offset
+
+
+_SERIES_OFFSETS, FILE_SIZE = _series_offsets()
+_SCALAR_INDEX = {name: index for index, name in enumerate(SCALARS)}
+
+
+def _prices(all_data: dict[str, Any]) -> PriceSeries:
+    return PriceSeries.from_price_info(all_data.get("energy", {}).get("prices", {}))
+
+
+def _series(
+    all_data: dict[str, Any],
+    prices: PriceSeries | None = None,
+    forecast: ForecastSeries | None = None,
+) -> dict[str, list[tuple[int, float]]]:
+    energy = all_data.get("energy", {})
+    if prices is None:
+        prices = _prices(all_data)
+    consumption = []
+    cost = []
+    for date_str, entry in energy.get("consumption", {}).items():
+        timestamp = consumption_time(date_str)
+        consumption.append((timestamp, lookup(entry, ("consumption",))))
+        cost.append((timestamp, lookup(entry, ("cost",))))
+    temperatures = []
+    if forecast is not None:
+        # The nearest hours, the other series keep the latest entries
+        temperatures = list(zip(forecast.timestamps, forecast.values["temperature"]))[
+            : SERIES["forecast.temperature"]
+        ]
+    return {
+        "energy.prices": list(prices.items()),
+        "energy.consumption": sorted(consumption),
+        "energy.cost": sorted(cost),
+        "forecast.temperature": temperatures,
+    }
+
+
+def samples(all_data: dict[str, Any], now: float) -> list[tuple[str, int, float]]:
+    """Return the numbers in FetchAll data as (series, time, value) samples.
+
+    The scalars are sampled at now, the series entries at their own times.
+    Missing values are left out. The forecast is not part of FetchAll data,
+    the collector adds it to the history with every new forecast run.
+    """
+    rows = [(name, int(now), lookup(all_data, path)) for name, path in SCALARS.items()]
+    for name, entries in _series(all_data).items():
+        rows.extend((name, timestamp, value) for timestamp, value in entries)
+    return [row for row in rows if not math.isnan(row[2])]
+
+
+class SnapshotWriter:
+    """Write FetchAll data to the shared snapshot file."""
+
+    def __init__(self, path: Path) -> None:
+        """Initialize SnapshotWriter, creating the file if needed.
+
+        Args:
+            path (Path): The shared snapshot file.
+        """
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size != FILE_SIZE:
+                os.ftruncate(fd, FILE_SIZE)
+            self._mm = mmap.mmap(fd, FILE_SIZE)
+        finally:
+            os.close(fd)
+        magic, version, sequence, *_ = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != LAYOUT_VERSION:
+            sequence = 0
+        # Never leave a half written file marked as complete
+        self._sequence = sequence + (sequence & 1)
+
+    def publish(
+        self, all_data: dict[str, Any], forecast: ForecastSeries | None = None
+    ) -> None:
+        """Write the data from FetchAll to the file.
+
+        Args:
+            all_data (dict[str, Any]): The data returned by FetchAll.
+            forecast (ForecastSeries | None): The hourly forecast, the
+                forecast series are left empty without it.
+        """
+        prices = _prices(all_data)
+        series = _series(all_data, prices, forecast)
+        resolution = prices.resolution if len(prices) else 0
+        scalars = [lookup(all_data, path) for path in SCALARS.values()]
+
+        self._sequence += 1
+        struct.pack_into("<Q", self._mm, _SEQUENCE_OFFSET, self._sequence)
+        _SCALARS.pack_into(self._mm, _SCALARS_OFFSET, *scalars)
+        for name, capacity in SERIES.items():
+            entries = series[name][-capacity:]
+            offset = _SERIES_OFFSETS[name]
+            _COUNT.pack_into(self._mm, offset, len(entries))
+            offset += _COUNT.size
+            struct.pack_into(
+                f"<{len(entries)}q", self._mm, offset, *(t for t, _ in entries)
+            )
+            offset += 8 * capacity
+            struct.pack_into(
+                f"<{len(entries)}d", self._mm, offset, *(v for _, v in entries)
+            )
+        self._sequence += 1
+        _HEADER.pack_into(
+            self._mm,
+            0,
+            MAGIC,
+            LAYOUT_VERSION,
+            self._sequence,
+            time.time(),
+            resolution,
+        )
+
+    def close(self) -> None:
+        self._mm.close()
+
+
+class SnapshotReader:
+    """Read values from the shared snapshot file."""
+
+    def __init__(self, path: Path, max_retries: int = 1000) -> None:
+        """Initialize SnapshotReader.
+
+        Args:
+            path (Path): The shared snapshot file.
+            max_retries (int): How many times to retry a read that raced with
+                the writer.
+        """
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), FILE_SIZE, access=mmap.ACCESS_READ)
+        magic, version, *_ = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != LAYOUT_VERSION:
+            self._mm.close()
+            raise ValueError(
+                f"{path} is not a snapshot file of version {LAYOUT_VERSION}"
+            )
+        self._max_retries = max_retries
+
+    def written_at(self) -> float:
+        """Return when the snapshot was written (epoch)."""
+        written_at: float = self._consistent(
+            lambda: _HEADER.unpack_from(self._mm, 0)[3]
+        )
+        return written_at
+
+    def scalar(self, name: str) -> float:
+        """Return one of the values in SCALARS, NaN if it is missing."""
+        offset = _SCALARS_OFFSET + 8 * _SCALAR_INDEX[name]
+        value: float = self._consistent(
+            lambda: struct.unpack_from("<d", self._mm, offset)[0]
+        )
+        return value
+
+    def scalars(self) -> dict[str, float]:
+        """Return all the values in SCALARS."""
+        values = self._consistent(
+            lambda: _SCALARS.unpack_from(self._mm, _SCALARS_OFFSET)
+        )
+        return dict(zip(SCALARS, values))
+
+    def series(self, name: str) -> tuple[tuple[int, ...], tuple[float, ...]]:
+        """Return the timestamps and values of one of the SERIES."""
+        return self._consistent(lambda: self._read_series(name))
+
+    def current_price(self, now: float | None = None) -> float:
+        """Return the price for the current time, NaN if it is not known."""
+        if now is None:
+            now = time.time()
+
+        def read() -> tuple[int, tuple[int, ...], tuple[float, ...]]:
+            resolution = _HEADER.unpack_from(self._mm, 0)[4]
+            return resolution, *self._read_series("energy.prices")
+
+        resolution, timestamps, values = self._consistent(read)
+        index = bisect.bisect_right(timestamps, now) - 1
+        if index < 0 or now >= timestamps[index] + resolution:
+            return math.nan
+        return values[index]
+
+    def close(self) -> None:
+        self._mm.close()
+
+    def _read_series(self, name: str) -> tuple[tuple[int, ...], tuple[float, ...]]:
+        capacity = SERIES[name]
+        offset = _SERIES_OFFSETS[name]
+        (count,) = _COUNT.unpack_from(self._mm, offset)
+        count = min(count, capacity)
+        timestamps = struct.unpack_from(f"<{count}q", self._mm, offset + 8)
+        values = struct.unpack_from(f"<{count}d", self._mm, offset + 8 + 8 * capacity)
+        return timestamps, values
+
+    def _consistent(self, read: Callable[[], T]) -> T:
+        for _ in range(self._max_retries):
+            (before,) = struct.unpack_from("<Q", self._mm, _SEQUENCE_OFFSET)
+            if before & 1:
+                continue
+            result = read()
+            (after,) = struct.unpack_from("<Q", self._mm, _SEQUENCE_OFFSET)
+            if before == after:
+                return result
+        raise TimeoutError("The snapshot is being written, try again")
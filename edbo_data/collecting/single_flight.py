@@ -0,0 +1,117 @@
+"""Share one fetch between processes that ask for the data at the same time.
+
+The first process takes a lock and fetches the data, the result is written
+to a file. Processes that arrive while the fetch is running wait for the
+lock and then reuse the result instead of fetching the data again.
+
+A result can also be reused for a while (max_age) and after that be served
+stale while a background process fetches new data
+(stale_while_revalidate).
+
+The result is pickled, like the last good data, so that the datetime
+objects in it come back as datetimes.
+"""
+
+import fcntl
+import logging
+import os
+import pickle
+import time
+from pathlib import Path
+from typing import Any, Callable, TextIO
+
+
+class SingleFlight:
+    """Coalesce concurrent fetches of the same data into one."""
+
+    def __init__(
+        self,
+        path: Path,
+        max_age: float = 0.0,
+        stale_while_revalidate: float = 0.0,
+        logger: logging.Logger | None = None,
+    ) -> None:
+        """Initialize SingleFlight.
+
+        Args:
+            path (Path): The file the shared result is written to. A lock
+                file is created next to it.
+            max_age (float): Seconds a result is reused without fetching.
+            stale_while_revalidate (float): Seconds after max_age during
+                which the old result is returned while new data is fetched
+                in the background.
+        """
+        self._path = path
+        self._lock_path = path.with_suffix(".lock")
+        self._max_age = max_age
+        self._stale_while_revalidate = stale_while_revalidate
+        self._log = logger if logger is not None else logging.getLogger(__name__)
+
+    def get(self, fetch: Callable[[], dict[str, Any]]) -> dict[str, Any]:
+        """Return the data, calling fetch only if no usable result exists.
+
+        Args:
+            fetch (Callable[[], dict[str, Any]]): Fetches the data.
+
+        Returns:
+            dict[str, Any]: The fetched or shared data.
+        """
+        start = time.time()
+        cached = self._read()
+        if cached is not None:
+            written_at, data = cached
+            age = start - written_at
+            if age <= self._max_age:
+                self._log.debug(f"Reusing data fetched {age:.0f} s ago")
+                return data
+            if age <= self._max_age + self._stale_while_revalidate:
+                self._log.debug(f"Serving data fetched {age:.0f} s ago, refreshing")
+                self._revalidate_in_background(fetch)
+                return data
+
+        with open(self._lock_path, "a") as lock:
+            self._lock(lock)
+            # Somebody else may have fetched the data while we waited
+            cached = self._read()
+            if cached is not None and cached[0] >= start:
+                self._log.debug("Reusing data fetched by another process")
+                return cached[1]
+            data = fetch()
+            self._write(data)
+            return data
+
+    def _lock(self, lock: TextIO) -> None:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._log.debug("Another process is fetching, waiting for it")
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+    def _revalidate_in_background(self, fetch: Callable[[], dict[str, Any]]) -> None:
+        if os.fork() != 0:
+            return
+        # In the child process, only one process refreshes at a time
+        exit_code = 0
+        try:
+            with open(self._lock_path, "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self._write(fetch())
+        except BlockingIOError:
+            pass
+        except Exception as e:
+            self._log.error(f"Background refresh failed: {e}")
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+
+    def _read(self) -> tuple[float, dict[str, Any]] | None:
+        try:
+            written_at, data = pickle.loads(self._path.read_bytes())
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            return None
+        return float(written_at), data
+
+    def _write(self, data: dict[str, Any]) -> None:
+        tmp_path = self._path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_bytes(pickle.dumps((time.time(), data)))
+        os.replace(tmp_path, self._path)
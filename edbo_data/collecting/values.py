@@ -0,0 +1,35 @@
+"""Read numbers and times from FetchAll data."""
+
+import math
+from datetime import datetime
+from typing import Any
+
+
+def lookup(all_data: dict[str, Any], path: tuple[str, ...]) -> float:
+    """Return the number at path in the FetchAll data, NaN if it is missing.
+
+    Args:
+        all_data (dict[str, Any]): The data returned by FetchAll, or a part
+            of it.
+        path (tuple[str, ...]): The keys, e.g. ("indoor", "co2").
+
+    Returns:
+        float: The value, NaN if a key is missing or it is not a number.
+    """
+    value: Any = all_data
+    for key in path:
+        if not isinstance(value, dict) or key not in value:
+            return math.nan
+        value = value[key]
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def consumption_time(date_str: str) -> int:
+    """Return the epoch time of a key in energy.consumption.
+
+    The keys are local time without an offset, e.g. "2025-01-17 13:00:00".
+    """
+    return int(datetime.fromisoformat(date_str).timestamp())
@@ -6,24 +6,46 @@ For all available options, run the script with the --help flag.
 """
 
 import argparse
+import csv
+import importlib
 import json
 import logging
 import sys
-from datetime import datetime, timezone
+import time
+from datetime import datetime
 from importlib.metadata import version
+from pathlib import Path
 from typing import Any, cast
 
-from dateutil.parser import parse as parse_datetime  # type: ignore
 from python_support.configuration import MyConfig  # type: ignore
 from python_support.logging import MyLogger  # type: ignore
 from rich import box  # type: ignore
 from rich.console import Console  # type: ignore
 from rich.table import Table  # type: ignore
 
+from .collecting.batch import BatchCollector, find_configs
+from .collecting.collector import Collector
+from .collecting.derived import BASE_TEMPERATURE, WINDOWS, derived_metrics
+from .collecting.replay import Replay
+from .collecting.scheduler import fingerprint
+from .collecting.single_flight import SingleFlight
 from .fetching.fetch_all import FetchAll
-from .fetching.fetch_netatmo import FetchNetatmo
-from .fetching.fetch_smhi import FetchSMHI
-from .fetching.fetch_tibber import FetchTibber
+from .fetching.rate_limit import RateLimiter
+from .fetching.registry import discover, enabled_sources
+from .profiling import MODES, profile, span
+from .series.price_series import PriceSeries
+from .state import state_dir
+from .storage.backfill import ConsumptionBackfill
+from .storage.export import ParquetExporter
+from .storage.history import DAY, HistoryStore, history_path
+from .storage.query import (
+    AGGREGATIONS,
+    TIBBER_SERIES,
+    parse_duration,
+    parse_time,
+    query,
+    rows,
+)
 
 LOGGER_NAME = "EDBO_DATA"
 
@@ -77,8 +99,217 @@ def main() -> None:
         action="store_true",
         help="Fetch data from all sources, prints to console as a JSON string",
     )
+    parser.add_argument(
+        "--list_sources",
+        action="store_true",
+        help="List the available data sources and if they are enabled",
+    )
+    parser.add_argument(
+        "--max_age",
+        type=float,
+        default=0.0,
+        help=(
+            "Seconds that data fetched by another run is reused, concurrent "
+            "runs always share one fetch"
+        ),
+    )
+    parser.add_argument(
+        "--stale_while_revalidate",
+        type=float,
+        default=0.0,
+        help=(
+            "Seconds after max_age that old data is returned while new data is "
+            "fetched in the background"
+        ),
+    )
+    parser.add_argument(
+        "--sections",
+        metavar="PATHS",
+        help=(
+            "Comma separated output sections to fetch, e.g. "
+            "indoor,energy.current_price. Only the sources needed for them "
+            "are called"
+        ),
+    )
+    parser.add_argument(
+        "--latency_budget",
+        type=float,
+        metavar="SECONDS",
+        help=(
+            "Return within this many seconds, sources that are slower get "
+            "their last good data and are listed in stale_sources"
+        ),
+    )
+    parser.add_argument(
+        "--backfill_tibber",
+        metavar="YYYY-MM-DD",
+        help=(
+            "Backfill the history with hourly, daily and monthly consumption "
+            "and cost from Tibber since the given date"
+        ),
+    )
+    parser.add_argument(
+        "--compact_history",
+        action="store_true",
+        help=(
+            "Roll up the stored samples into hourly and daily aggregates and "
+            "delete samples older than the retention time"
+        ),
+    )
+    parser.add_argument(
+        "--batch",
+        nargs="+",
+        metavar="PATH",
+        help=(
+            "Collect data for many sites, given as configuration files or "
+            "directories of configuration files, one file per site"
+        ),
+    )
+    parser.add_argument(
+        "--batch_output",
+        metavar="DIR",
+        help="Where to write <site>.json in batch mode, defaults to the state dir",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="The maximum number of sites collected at once in batch mode",
+    )
+    parser.add_argument(
+        "--merge_processes",
+        type=int,
+        default=0,
+        help="Merge the data of the sites in a pool of this many processes",
+    )
+    parser.add_argument(
+        "-c",
+        "--collect",
+        action="store_true",
+        help=(
+            "Keep running and poll each source when new data can be available, "
+            "the latest data is written to a JSON snapshot file"
+        ),
+    )
+    parser.add_argument(
+        "--profile",
+        choices=MODES,
+        help=(
+            "Profile the run, 'sample' writes collapsed stacks for a flame "
+            "graph and 'deterministic' writes cProfile statistics of all "
+            "threads. A table of the time spent in each stage is printed when "
+            "done. The imports at startup are not included, use python -X "
+            "importtime for them"
+        ),
+    )
+    parser.add_argument(
+        "--profile_output",
+        metavar="PATH",
+        help=(
+            "Where to write the profile, defaults to edbo_data.collapsed or "
+            "edbo_data.pstats"
+        ),
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    history_parser = subparsers.add_parser(
+        "history",
+        help="Query the history of the collected data",
+        description=(
+            "Query a series of the history, e.g. 'history indoor.co2 --since 7d' "
+            "or 'history tibber.cost --since 2025-03-01 --until 2025-04-01 "
+            "--resample 1d --agg sum'. Resampled buckets are aligned in UTC."
+        ),
+    )
+    history_parser.add_argument(
+        "series", nargs="?", help="The series to query, leave out to list them"
+    )
+    history_parser.add_argument(
+        "--since",
+        default="1d",
+        help="ISO date/time or a duration back from now, e.g. 7d. Default 1d",
+    )
+    history_parser.add_argument(
+        "--until", help="ISO date/time or a duration back from now. Default now"
+    )
+    history_parser.add_argument(
+        "--resample",
+        default="raw",
+        help="Bucket size, e.g. 15m, 1h, 1d, 1w, or raw for every sample",
+    )
+    history_parser.add_argument(
+        "--agg",
+        default="mean",
+        help=f"Comma separated aggregations: {', '.join(AGGREGATIONS)}",
+    )
+    history_parser.add_argument(
+        "--format", choices=["table", "csv", "json"], default="table"
+    )
+    export_parser = subparsers.add_parser(
+        "export",
+        help="Export the history as Parquet files (needs pyarrow)",
+        description=(
+            "Write the history as Parquet datasets partitioned by source and "
+            "month, see edbo_data.storage.export"
+        ),
+    )
+    export_parser.add_argument("directory", help="Where to write the datasets")
+    export_parser.add_argument(
+        "--since",
+        help="ISO date/time or a duration back from now, e.g. 30d. Default all",
+    )
+    subparsers.add_parser(
+        "metrics",
+        help="Show the derived metrics kept up to date by --collect",
+        description=(
+            "Show the heating degree-hours, the rolling means and sums and the "
+            "cost per kWh and per degree-hour, see "
+            "edbo_data.collecting.derived"
+        ),
+    )
+    replay_parser = subparsers.add_parser(
+        "replay",
+        help="Replay the history through the merge and a controller",
+        description=(
+            "Replay the collected history as if it was live, see "
+            "edbo_data.collecting.replay. Each step is given to the controller "
+            "and its results are printed as JSON lines. Without a controller "
+            "the derived metrics at the end are printed."
+        ),
+    )
+    replay_parser.add_argument(
+        "--since",
+        default="30d",
+        help="ISO date/time or a duration back from now, e.g. 30d. Default 30d",
+    )
+    replay_parser.add_argument(
+        "--until", help="ISO date/time or a duration back from now. Default now"
+    )
+    replay_parser.add_argument(
+        "--step", default="1h", help="Time between the steps, e.g. 15m or 1h"
+    )
+    replay_parser.add_argument(
+        "--controller",
+        metavar="MODULE:FUNCTION",
+        help="Function called with the time and the data of each step",
+    )
+    replay_parser.add_argument(
+        "--replay_workers",
+        type=int,
+        default=1,
+        help="Processes to split the range over, by day",
+    )
     args = parser.parse_args()
 
+    if args.profile:
+        suffix = "collapsed" if args.profile == "sample" else "pstats"
+        output = Path(args.profile_output or f"edbo_data.{suffix}")
+        profile(lambda: run(args), args.profile, output)
+    else:
+        run(args)
+
+
+def run(args: argparse.Namespace) -> None:
+    """Execute the data fetching routine selected by the arguments."""
     if args.version:
         package_version = version("edbo_data")
         print(f"Installed version of asset predictor: {package_version}")
@@ -90,7 +321,8 @@ def main() -> None:
             raise ValueError("Invalid log level: %s" % args.loglevel)
         level = numeric_level
 
-    config = MyConfig("ED_CONFIG")
+    with span("config"):
+        config = MyConfig("ED_CONFIG")
     if config.general_log_with_timestamp == "true":
         add_timestamp = True
     else:
@@ -99,7 +331,24 @@ def main() -> None:
         level, LOGGER_NAME, config.general_log_file
     )
 
-    if args.fetch_smhi:
+    sections = None
+    if args.sections:
+        sections = [s.strip() for s in args.sections.split(",") if s.strip()]
+
+    # The fetchers are imported where they are used, so that only the
+    # libraries of the sources in use are loaded.
+    if args.command == "history":
+        print_history(config, args)
+    elif args.command == "export":
+        export_history(config, Path(args.directory), args.since)
+    elif args.command == "replay":
+        replay_history(config, args)
+    elif args.command == "metrics":
+        metrics = derived_metrics(config).metrics(time.time())
+        print_derived(Console(), metrics)
+    elif args.fetch_smhi:
+        from .fetching.fetch_smhi import FetchSMHI
+
         fetch_smhi = FetchSMHI(config.map_latitude, config.map_longitude)
         current = fetch_smhi.get_current_conditions()
         log.info(f"Current conditions: {fetch_smhi.forecast_to_conditions(current)}")
@@ -119,10 +368,14 @@ def main() -> None:
                 f"{conditions['symbol_string']}"
             )
     elif args.fetch_netatmo:
+        from .fetching.fetch_netatmo import FetchNetatmo
+
         fetch_netatmo = FetchNetatmo()
         data = fetch_netatmo.get_data()
         log.info(f"Netatmo data: {data}")
     elif args.fetch_tibber:
+        from .fetching.fetch_tibber import FetchTibber
+
         fetcher = FetchTibber(config.tibber_token)
         data = fetcher.get_data()
         print("Account Name:", data["account_name"])
@@ -137,21 +390,206 @@ def main() -> None:
         print("Price info:", price_info)
     elif args.fetch_all:
         try:
-            fetch_all = FetchAll(config, log)
-            all_data = fetch_all.get_data()
+            all_data = fetch_shared(
+                config,
+                args.max_age,
+                args.stale_while_revalidate,
+                args.latency_budget,
+                sections,
+            )
         except Exception as e:
             log.error(f"Error fetching data: {e}")
             sys.exit(1)
-        print(json.dumps(all_data))
+        with span("render"):
+            print(json.dumps(all_data))
+    elif args.list_sources:
+        list_sources(config)
+    elif args.batch:
+        if args.batch_output:
+            output_dir = Path(args.batch_output)
+        else:
+            output_dir = state_dir(config) / "batch"
+        batch = BatchCollector(
+            find_configs(args.batch),
+            output_dir,
+            args.workers,
+            args.merge_processes,
+            log,
+        )
+        errors = batch.run()
+        if any(errors.values()):
+            sys.exit(1)
+    elif args.compact_history:
+        compact_history(config)
+    elif args.backfill_tibber:
+        backfill_tibber(config, datetime.fromisoformat(args.backfill_tibber))
+    elif args.collect:
+        collector = Collector(config, log)
+        log.info(f"Collecting data to {collector.snapshot_path}")
+        try:
+            collector.run()
+        except KeyboardInterrupt:
+            log.info("Collector stopped")
     else:
         log.debug("Fetching data from all sources")
-        present_all_data(config)
+        present_all_data(
+            config,
+            args.max_age,
+            args.stale_while_revalidate,
+            args.latency_budget,
+            sections,
+        )
+
+
+def list_sources(config: MyConfig) -> None:
+    enabled = {spec.name for spec in enabled_sources(config)}
+    for spec in discover().values():
+        state = "enabled" if spec.name in enabled else "disabled"
+        depends = ""
+        if spec.depends_on:
+            depends = f", depends on {', '.join(spec.depends_on)}"
+        print(f"{spec.name}: {spec.section} ({state}, cost {spec.cost:g}{depends})")
+
+
+def backfill_tibber(config: MyConfig, start: datetime) -> None:
+    """Backfill the consumption history, can be resumed if interrupted."""
+    from .fetching.fetch_tibber import FetchTibber
+
+    fetch_tibber = FetchTibber(config.tibber_token, logger=log)
+    rate_limiter = RateLimiter(state_dir(config) / "rate_limits", logger=log)
+    store = HistoryStore(history_path(config))
+    try:
+        ConsumptionBackfill(fetch_tibber, store, rate_limiter, logger=log).run(start)
+    finally:
+        store.close()
+
+
+def compact_history(config: MyConfig) -> None:
+    """Compact the history, the collector also does this once an hour."""
+    retention_days = getattr(config, "history_raw_retention_days", "") or 30
+    store = HistoryStore(history_path(config))
+    try:
+        store.compact(raw_retention=float(retention_days) * DAY)
+    finally:
+        store.close()
+
+
+def print_history(config: MyConfig, args: argparse.Namespace) -> None:
+    store = HistoryStore(history_path(config))
+    try:
+        if args.series is None:
+            for name in [*store.series_names(), *TIBBER_SERIES]:
+                print(name)
+            return
+        functions = [name.strip() for name in args.agg.split(",")]
+        unknown = [name for name in functions if name not in AGGREGATIONS]
+        if unknown:
+            raise ValueError(f"Unknown aggregation: {', '.join(unknown)}")
+        now = time.time()
+        start = parse_time(args.since, now)
+        end = parse_time(args.until, now) if args.until else int(now) + 1
+        aggregates = query(
+            store, args.series, start, end, parse_duration(args.resample)
+        )
+    finally:
+        store.close()
+    result = rows(aggregates, functions)
+    if args.format == "json":
+        print(json.dumps(result))
+    elif args.format == "csv":
+        writer = csv.DictWriter(sys.stdout, fieldnames=["time", *functions])
+        writer.writeheader()
+        writer.writerows(result)
+    else:
+        table = Table(
+            title=args.series,
+            box=box.SIMPLE_HEAVY,
+            show_lines=False,
+            title_style="bold magenta",
+        )
+        table.add_column("Time", style="bold green")
+        for name in functions:
+            table.add_column(name.capitalize(), style="cyan", justify="right")
+        for row in result:
+            table.add_row(row["time"], *(f"{row[name]:g}" for name in functions))
+        Console().print(table)
+
+
+def export_history(config: MyConfig, directory: Path, since: str | None) -> None:
+    store = HistoryStore(history_path(config))
+    try:
+        start = parse_time(since) if since else 0
+        written = ParquetExporter(store, directory).export(start)
+    except ImportError as e:
+        log.error(str(e))
+        sys.exit(1)
+    finally:
+        store.close()
+    log.info(f"Wrote {len(written)} Parquet files to {directory}")
+
+
+def replay_history(config: MyConfig, args: argparse.Namespace) -> None:
+    now = time.time()
+    start = parse_time(args.since, now)
+    end = parse_time(args.until, now) if args.until else int(now) + 1
+    base_temperature = getattr(config, "metrics_base_temperature", "")
+    replay = Replay(
+        history_path(config),
+        parse_duration(args.step),
+        base_temperature=float(base_temperature or BASE_TEMPERATURE),
+        logger=log,
+    )
+    if args.controller is None:
+        last: dict[str, Any] = {}
 
+        def controller(timestamp: int, all_data: dict[str, Any]) -> None:
+            last.update(all_data)
 
-def present_all_data(config: MyConfig) -> None:
-    fetch_all = FetchAll(config)
-    all_data = fetch_all.get_data()
-    pretty_print_data(all_data)
+        # A local function can not be sent to other processes
+        replay.run(controller, start, end)
+        if "derived" in last:
+            print_derived(Console(), last["derived"])
+        return
+    module_name, _, function_name = args.controller.partition(":")
+    function = getattr(importlib.import_module(module_name), function_name)
+    for timestamp, result in replay.run(function, start, end, args.replay_workers):
+        time_str = datetime.fromtimestamp(timestamp).isoformat()
+        print(json.dumps({"time": time_str, "result": result}, default=str))
+
+
+def fetch_shared(
+    config: MyConfig,
+    max_age: float = 0.0,
+    stale_while_revalidate: float = 0.0,
+    latency_budget: float | None = None,
+    sections: list[str] | None = None,
+) -> dict[str, Any]:
+    """Fetch data from all sources, sharing the fetch with concurrent runs.
+
+    Runs asking for the same sections share a fetch.
+    """
+    fetch_all = FetchAll(config, log, latency_budget=latency_budget, sections=sections)
+    name = "fetch_all"
+    if sections is not None:
+        name += "-" + fingerprint(sorted(sections))[:12]
+    single_flight = SingleFlight(
+        state_dir(config) / f"{name}.pickle", max_age, stale_while_revalidate, log
+    )
+    return single_flight.get(fetch_all.get_data)
+
+
+def present_all_data(
+    config: MyConfig,
+    max_age: float = 0.0,
+    stale_while_revalidate: float = 0.0,
+    latency_budget: float | None = None,
+    sections: list[str] | None = None,
+) -> None:
+    all_data = fetch_shared(
+        config, max_age, stale_while_revalidate, latency_budget, sections
+    )
+    with span("render"):
+        pretty_print_data(all_data)
 
 
 def pretty_print_data(all_data: dict[str, Any]) -> None:
@@ -313,10 +751,21 @@ def pretty_print_data(all_data: dict[str, Any]) -> None:
 
         console.print(energy_price_table)
 
-    # Check if we have energy consumption data
-    if "energy" not in all_data or "consumption" not in all_data["energy"]:
-        return
+    energy = all_data.get("energy", {})
+    if "consumption" in energy:
+        print_consumption(console, energy["consumption"])
+
+    # ------------------------------
+    # 4) Energy Data - Future Price
+    # ------------------------------
+    if "prices" in energy:
+        print_future_prices(console, energy["prices"])
 
+    if "derived" in all_data:
+        print_derived(console, all_data["derived"])
+
+
+def print_consumption(console: Console, consumption_data: dict[str, Any]) -> None:
     # 1) Aggregate the hourly data by date
     #    We'll do a "consumption-weighted" average of unitPrice.
     aggregated: dict[str, dict[str, float]] = {}
@@ -326,7 +775,7 @@ def pretty_print_data(all_data: dict[str, Any]) -> None:
     #    "price_times_consumption": float  # for computing weighted average
     # }
 
-    for dt_str, cdata in all_data["energy"]["consumption"].items():
+    for dt_str, cdata in consumption_data.items():
         # dt_str looks like "2025-01-17 21:00:00"
         date_only = dt_str[:10]  # "2025-01-17"
         try:
@@ -382,28 +831,39 @@ def pretty_print_data(all_data: dict[str, Any]) -> None:
 
     console.print(consumption_table)
 
-    # ------------------------------
-    # 4) Energy Data - Future Price
-    # ------------------------------
-    # Collect all entries that are strictly in the future.
-    # We'll parse the datetime string, convert to UTC, then compare with "now" in UTC.
-    now_utc = datetime.now(timezone.utc)
-    future_entries = []
 
-    for dt_str, price_value in all_data["energy"]["prices"].items():
-        dt_parsed = parse_datetime(dt_str)  # dt will have a tz from the string
-        dt_utc = dt_parsed.astimezone(timezone.utc)
-        if dt_utc > now_utc:
-            future_entries.append((dt_utc, price_value))
+def print_derived(console: Console, metrics: dict[str, Any]) -> None:
+    table = Table(
+        title="Derived Metrics",
+        caption=(
+            f"{metrics['degree_hours_total']:g} degree-hours below "
+            f"{metrics['base_temperature']:g} °C in total"
+        ),
+        box=box.SIMPLE_HEAVY,
+        show_lines=False,
+        title_style="bold magenta",
+    )
+    table.add_column("Metric", style="bold green")
+    for window in WINDOWS:
+        table.add_column(window, style="cyan", justify="right")
+    for name in metrics[next(iter(WINDOWS))]:
+        values = [metrics[window][name] for window in WINDOWS]
+        table.add_row(
+            name, *("-" if value is None else f"{value:g}" for value in values)
+        )
+    console.print(table)
+
+
+def print_future_prices(console: Console, price_info: dict[str, Any]) -> None:
+    # Collect all entries that are strictly in the future.
+    prices = PriceSeries.from_price_info(price_info)
+    future_prices = prices.future(time.time())
 
     # If no future prices exist, optionally show a message or exit.
-    if not future_entries:
+    if not len(future_prices):
         console.print("[bold red]No future prices available.[/bold red]")
         return
 
-    # Sort the entries chronologically
-    future_entries.sort(key=lambda x: x[0])
-
     # Build the Rich table
     price_table = Table(
         title="Energy - Future Price Info",
@@ -414,10 +874,9 @@ def pretty_print_data(all_data: dict[str, Any]) -> None:
     price_table.add_column("Time (Local)", style="bold green", no_wrap=True)
     price_table.add_column("Price [SEK/kWh]", justify="right")
 
-    for dt_utc, price_value in future_entries:
-        # Convert UTC time to local time (omit `.astimezone()` if
-        # you want to stay in UTC)
-        dt_local = dt_utc.astimezone()
+    for timestamp, price_value in future_prices.items():
+        # Convert the epoch time to local time
+        dt_local = datetime.fromtimestamp(timestamp)
         # Format just hours, minutes, seconds (24-hour format)
         time_str = dt_local.strftime("%H:%M:%S")
         # Price with two decimal digits
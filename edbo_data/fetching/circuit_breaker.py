@@ -0,0 +1,140 @@
+"""Stop calling an upstream that is down.
+
+Each source, and each account at a source, has a circuit breaker with its
+state in a file, so that the state is kept between runs and shared by all
+edbo_data processes. After a number of failures in a row the breaker opens
+and calls fail at once with CircuitOpenError instead of waiting for the
+upstream to time out. When the reset timeout has passed, a single call is
+let through to check if the upstream is back (half open). If it succeeds
+the breaker closes, otherwise it opens again with a doubled reset timeout.
+"""
+
+import fcntl
+import json
+import time
+from pathlib import Path
+from typing import Any, Callable, TypeVar
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """The upstream is considered down and was not called."""
+
+
+class CircuitBreaker:
+    """A circuit breaker kept in a file and shared between processes."""
+
+    def __init__(
+        self,
+        path: Path,
+        failure_threshold: int = 3,
+        reset_timeout: float = 300.0,
+        max_reset_timeout: float = 3600.0,
+    ) -> None:
+        """Initialize CircuitBreaker.
+
+        Args:
+            path (Path): The file that holds the state of the breaker.
+            failure_threshold (int): Failures in a row that open the breaker.
+            reset_timeout (float): Seconds until the first call is let through
+                after the breaker opened.
+            max_reset_timeout (float): Upper limit of the reset timeout, which
+                is doubled each time a half open call fails.
+        """
+        self._path = path
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._max_reset_timeout = max_reset_timeout
+
+    @property
+    def state(self) -> str:
+        """CLOSED, OPEN or HALF_OPEN."""
+        state: str = self._update(lambda s: s)["state"]
+        return state
+
+    def call(self, func: Callable[[], T]) -> T:
+        """Call func unless the breaker is open.
+
+        Raises:
+            CircuitOpenError: If the breaker is open.
+        """
+        self.before_call()
+        try:
+            result = func()
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def before_call(self) -> None:
+        """Check if a call may be made, raise CircuitOpenError if not."""
+        now = time.time()
+        allowed = False
+
+        def update(state: dict[str, Any]) -> dict[str, Any]:
+            nonlocal allowed
+            if state["state"] == CLOSED:
+                allowed = True
+            elif now >= state["retry_at"]:
+                # Let one call through, the others wait for its outcome
+                allowed = True
+                state["state"] = HALF_OPEN
+                state["retry_at"] = now + self._reset_timeout
+            return state
+
+        state = self._update(update)
+        if not allowed:
+            raise CircuitOpenError(
+                f"Circuit open after {state['failures']} failures, next try in "
+                f"{state['retry_at'] - now:.0f} s"
+            )
+
+    def record_success(self) -> None:
+        self._update(lambda state: self._initial())
+
+    def record_failure(self) -> None:
+        now = time.time()
+
+        def update(state: dict[str, Any]) -> dict[str, Any]:
+            state["failures"] += 1
+            if state["state"] == HALF_OPEN:
+                state["reset_timeout"] = min(
+                    state["reset_timeout"] * 2, self._max_reset_timeout
+                )
+            elif state["failures"] < self._failure_threshold:
+                return state
+            state["state"] = OPEN
+            state["retry_at"] = now + state["reset_timeout"]
+            return state
+
+        self._update(update)
+
+    def _initial(self) -> dict[str, Any]:
+        return {
+            "state": CLOSED,
+            "failures": 0,
+            "retry_at": 0.0,
+            "reset_timeout": self._reset_timeout,
+        }
+
+    def _update(
+        self, update: Callable[[dict[str, Any]], dict[str, Any]]
+    ) -> dict[str, Any]:
+        with open(self._path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                state: dict[str, Any] = json.loads(f.read())
+            except ValueError:
+                state = self._initial()
+            new_state = update(state)
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(new_state))
+        return new_state
@@ -1,151 +1,530 @@
 """Fetch data from all sources."""
 
+import hashlib
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Any, cast
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, cast
 
 from python_support.configuration import MyConfig  # type: ignore
 
-from .fetch_netatmo import FetchNetatmo
-from .fetch_smhi import FetchSMHI
-from .fetch_tibber import FetchTibber
+from ..profiling import span
+from ..state import state_dir
+from .circuit_breaker import CircuitBreaker, CircuitOpenError
+from .last_good import LastGoodStore
+from .latency import LatencyBudget, LatencyTracker
+from .rate_limit import RateLimiter
+from .registry import (
+    BUILTIN_SOURCES,
+    Source,
+    SourceSpec,
+    enabled_sources,
+    select_sources,
+    wanted,
+)
+
+if TYPE_CHECKING:
+    from .fetch_netatmo import FetchNetatmo
+    from .fetch_smhi import FetchSMHI
+    from .fetch_tibber import FetchTibber
+
+# The built-in upstream sources. Tibber is split in two since the price list
+# is published once a day while the current price and the consumption change
+# every hour.
+SOURCES = tuple(BUILTIN_SOURCES)
 
 
 class FetchAll:
-    def __init__(self, config: MyConfig, logger: logging.Logger | None = None) -> None:
+    def __init__(
+        self,
+        config: MyConfig,
+        logger: logging.Logger | None = None,
+        rate_limiter: RateLimiter | None = None,
+        latency_budget: float | None = None,
+        sections: list[str] | None = None,
+        directory: Path | None = None,
+    ) -> None:
+        """Initialize FetchAll.
+
+        Args:
+            config (MyConfig): The configuration.
+            logger (logging.Logger | None): Logger to use.
+            rate_limiter (RateLimiter | None): Defaults to a limiter with its
+                state in the state directory.
+            latency_budget (float | None): Seconds that get_data() may take.
+                Sources that are too slow get their last good data, which is
+                listed in stale_sources. None waits for every source.
+            sections (list[str] | None): The output paths to fetch, e.g.
+                energy.prices. Only the upstream requests needed for them
+                are made and get_data() only returns them. None fetches all.
+            directory (Path | None): Where the rate limits, circuit breakers
+                and last good data are kept. Defaults to the state directory.
+        """
+        if directory is None:
+            directory = state_dir(config)
         self._config = config
         self._log = logger if logger is not None else logging.getLogger(__name__)
+        if rate_limiter is None:
+            rate_limiter = RateLimiter(directory / "rate_limits", logger=self._log)
+        self._limiter = rate_limiter
+        self._sections = sections
+        self._specs = {
+            spec.name: spec
+            for spec in select_sources(enabled_sources(config), sections)
+        }
+        self._plugins: dict[str, Source] = {}
+        self._netatmo: "FetchNetatmo | None" = None
+        self._tibber: "FetchTibber | None" = None
+        self._smhi: "FetchSMHI | None" = None
+        self._last_good = LastGoodStore(directory / "last_good")
+        self._breaker_dir = directory / "circuit_breakers"
+        self._breaker_dir.mkdir(exist_ok=True)
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._budget: LatencyBudget | None = None
+        if latency_budget is not None:
+            self._budget = LatencyBudget(
+                latency_budget,
+                LatencyTracker(directory / "latency.json"),
+                logger=self._log,
+            )
+
+    @property
+    def sources(self) -> list[SourceSpec]:
+        """The enabled sources, each after the sources it depends on."""
+        return list(self._specs.values())
 
     def get_data(self) -> dict[str, Any]:
-        # Fetch Netatmo data
+        """Fetch all enabled sources and merge the data.
+
+        Sources that do not depend on each other are fetched concurrently.
+        With a latency budget each wave of sources gets an equal share of
+        the time that is left. A source that fails or is too slow gets its
+        last good data, listed in stale_sources. Without last good data it
+        is left out and listed in unavailable_sources, as are the sources
+        that depend on it.
+
+        Returns:
+            dict[str, Any]: The combined data from all sources.
+        """
+        sources: dict[str, dict[str, Any]] = {}
+        stale: set[str] = set()
+        unavailable: set[str] = set()
+        waves = self._waves()
+        started = time.time()
+        with ThreadPoolExecutor(max_workers=max(1, len(self._specs))) as pool:
+            for number, wave in enumerate(waves):
+                for spec in wave:
+                    if any(name in unavailable for name in spec.depends_on):
+                        self._log.error(f"Skipping {spec.name}, a dependency failed")
+                        unavailable.add(spec.name)
+                names = [spec.name for spec in wave if spec.name not in unavailable]
+                if self._budget is not None:
+                    remaining = self._budget.budget - (time.time() - started)
+                    deadline = time.time() + remaining / (len(waves) - number)
+                    calls = {name: self._fetch_call(name, sources) for name in names}
+                    results, errors = self._budget.run(calls, deadline)
+                else:
+                    futures = {
+                        name: pool.submit(self.fetch_source, name, sources)
+                        for name in names
+                    }
+                    results, errors = {}, {}
+                    for name, future in futures.items():
+                        try:
+                            results[name] = future.result()
+                        except Exception as e:
+                            errors[name] = e
+                if self._sections is None:
+                    # Partial or empty data must not replace complete data
+                    for name, data in results.items():
+                        if data:
+                            self._last_good.save(self._account(name), data)
+                sources.update(results)
+                for name, error in errors.items():
+                    last_good = self._last_good.load(self._account(name))
+                    if last_good is None:
+                        self._log.error(f"No data from {name}: {error}")
+                        unavailable.add(name)
+                        continue
+                    saved_at, sources[name] = last_good
+                    stale.add(name)
+                    self._log.warning(
+                        f"Using data from {time.time() - saved_at:.0f} s ago for "
+                        f"{name}: {error}"
+                    )
+        all_data = self.merge(sources)
+        if self._sections is not None:
+            all_data = select_sections(all_data, self._sections)
+        if stale:
+            all_data["stale_sources"] = sorted(stale)
+        if unavailable:
+            all_data["unavailable_sources"] = sorted(unavailable)
+        return all_data
+
+    def _waves(self) -> list[list[SourceSpec]]:
+        # Group the sources so that each group only depends on earlier groups
+        waves: list[list[SourceSpec]] = []
+        done: set[str] = set()
+        pending = self.sources
+        while pending:
+            ready = [
+                spec for spec in pending if all(n in done for n in spec.depends_on)
+            ]
+            waves.append(ready)
+            done.update(spec.name for spec in ready)
+            pending = [spec for spec in pending if spec.name not in done]
+        return waves
+
+    def _fetch_call(
+        self, name: str, dependencies: dict[str, dict[str, Any]]
+    ) -> Callable[[], dict[str, Any]]:
+        return lambda: self.fetch_source(name, dict(dependencies))
+
+    def fetch_source(
+        self, name: str, dependencies: dict[str, dict[str, Any]] | None = None
+    ) -> dict[str, Any]:
+        """Fetch the raw data of a single source.
+
+        Args:
+            name (str): The name of an enabled source.
+            dependencies (dict | None): The data of the sources that the
+                source depends on.
+
+        Returns:
+            dict[str, Any]: The source data, ready to be passed to merge().
+        """
+        if name not in self._specs and name not in BUILTIN_SOURCES:
+            raise ValueError(f"Unknown source: {name}")
+        breaker = self._breaker(name)
         try:
-            netatmo_data: dict[str, Any] = FetchNetatmo(self._log).get_data()
+            breaker.before_call()
+        except CircuitOpenError as e:
+            self._log.warning(f"Not fetching {name}: {e}")
+            raise e
+        try:
+            with span(f"fetch {name}"):
+                match name:
+                    case "netatmo":
+                        data = self.fetch_netatmo()
+                    case "tibber":
+                        data = self.fetch_tibber()
+                    case "tibber_prices":
+                        data = self.fetch_tibber_prices()
+                    case "smhi":
+                        data = self.fetch_smhi()
+                    case _:
+                        spec = self._specs[name]
+                        data = self._fetch_plugin(spec, dependencies or {})
         except Exception as e:
-            self._log.error(f"Failed to fetch Netatmo data: {e}")
+            breaker.record_failure()
             raise e
+        breaker.record_success()
+        return data
+
+    def _breaker(self, name: str) -> CircuitBreaker:
+        if name not in self._breakers:
+            # Bad credentials must not open the breaker for other accounts
+            path = self._breaker_dir / f"{self._account(name)}.json"
+            self._breakers[name] = CircuitBreaker(path)
+        return self._breakers[name]
 
-        # Fetch Tibber data
-        tibber_token = self._config.tibber_token
-        if not tibber_token:
-            raise ValueError("TIBBER_TOKEN must be set")
-        fetch_tibber = FetchTibber(token=tibber_token, logger=self._log)
+    def _account(self, name: str) -> str:
+        """The source name and a hash of the credential, to keep accounts apart."""
+        credential = self._credential(name)
+        if not credential:
+            return name
+        digest = hashlib.sha256(credential.encode()).hexdigest()
+        return f"{name}-{digest[:12]}"
+
+    def _credential(self, name: str) -> str:
+        if name in ("tibber", "tibber_prices"):
+            return str(getattr(self._config, "tibber_token", "") or "")
+        if name == "netatmo":
+            credentials = getattr(self._config, "netatmo_credentials", "")
+            return str(Path(credentials or "~/.netatmo.credentials").expanduser())
+        return ""
+
+    def _fetch_plugin(
+        self, spec: SourceSpec, dependencies: dict[str, dict[str, Any]]
+    ) -> dict[str, Any]:
         try:
-            tibber_data: dict[str, Any] = fetch_tibber.get_data()
+            if spec.name not in self._plugins:
+                self._plugins[spec.name] = spec.load(self._config, self._log)
+            plugin = self._plugins[spec.name]
+            data: dict[str, Any] = self._limiter.call(
+                spec.rate_limit or spec.name,
+                lambda: plugin.fetch(dependencies),
+                cost=spec.cost,
+            )
         except Exception as e:
-            self._log.error(f"Failed to fetch Tibber data: {e}")
+            self._log.error(f"Failed to fetch {spec.name} data: {e}")
             raise e
+        return data
+
+    def fetch_netatmo(self) -> dict[str, Any]:
         try:
-            energy_data: list[dict[str, Any]] = fetch_tibber.get_consumption_data()
+            if self._netatmo is None:
+                with span("import netatmo"):
+                    from .fetch_netatmo import FetchNetatmo
+                with span("auth netatmo"):
+                    self._netatmo = FetchNetatmo(
+                        self._log, getattr(self._config, "netatmo_credentials", None)
+                    )
+            netatmo_data: dict[str, Any] = self._limiter.call(
+                "netatmo", self._netatmo.get_data
+            )
+            if not netatmo_data:
+                raise ValueError("Netatmo returned no data")
         except Exception as e:
-            self._log.error(f"Failed to fetch Tibber consumption data: {e}")
+            self._log.error(f"Failed to fetch Netatmo data: {e}")
             raise e
+        return netatmo_data
+
+    def fetch_tibber(self) -> dict[str, Any]:
+        fetch_tibber = self._get_tibber()
+        data: dict[str, Any] = {}
+        if wanted("energy.current_price", self._sections):
+            try:
+                data["info"] = self._limiter.call(
+                    "tibber", fetch_tibber.get_data, cost=4
+                )
+            except Exception as e:
+                self._log.error(f"Failed to fetch Tibber data: {e}")
+                raise e
+        if wanted("energy.consumption", self._sections):
+            try:
+                data["consumption"] = self._limiter.call(
+                    "tibber", fetch_tibber.get_consumption_data, cost=2
+                )
+            except Exception as e:
+                self._log.error(f"Failed to fetch Tibber consumption data: {e}")
+                raise e
+        return data
+
+    def fetch_tibber_prices(self) -> dict[str, Any]:
+        fetch_tibber = self._get_tibber()
         try:
-            price_data: dict[str, Any] = fetch_tibber.get_2_days_price_info()
+            price_data: dict[str, Any] = self._limiter.call(
+                "tibber", fetch_tibber.get_2_days_price_info, cost=3
+            )
         except Exception as e:
             self._log.error(f"Failed to fetch Tibber price data: {e}")
             raise e
+        return price_data
 
-        # Fetch SMHI data
+    def fetch_smhi(self) -> dict[str, Any]:
+        fetch_smhi = self._get_smhi()
+        to_conditions = fetch_smhi.forecast_to_conditions
+        data: dict[str, Any] = {}
         try:
-            fetch_smhi = FetchSMHI(
-                self._config.map_latitude, self._config.map_longitude, self._log
-            )
+            if wanted("outdoor.current", self._sections):
+                current = self._limiter.call("smhi", fetch_smhi.get_current_conditions)
+                with span("forecast_to_conditions"):
+                    data["current"] = to_conditions(current)
+            if wanted("outdoor.forecast", self._sections):
+                forecast = self._limiter.call("smhi", fetch_smhi.get_forecast)
+                with span("forecast_to_conditions"):
+                    data["forecast"] = [to_conditions(f) for f in forecast]
+            if wanted("outdoor.forecast_24h", self._sections):
+                forecast_hour = self._limiter.call("smhi", fetch_smhi.get_forecast_hour)
+                with span("forecast_to_conditions"):
+                    data["forecast_hour"] = [to_conditions(f) for f in forecast_hour]
         except Exception as e:
             self._log.error(f"Failed to fetch SMHI data: {e}")
             raise e
-        current_smhi_data: dict[str, Any] = fetch_smhi.get_current_conditions()
-        forecast_smhi_data: list[dict[str, Any]] = fetch_smhi.get_forecast()
-        forecast_h_smhi_data: list[dict[str, Any]] = fetch_smhi.get_forecast_hour()
-        forecast_24h_smhi_data = forecast_h_smhi_data[1:25]
+        return data
+
+    def get_smhi_approved_time(self) -> str:
+        """Cheap check of when SMHI last published a forecast run."""
+        return self._breaker("smhi").call(
+            lambda: self._limiter.call("smhi", self._get_smhi().get_approved_time)
+        )
+
+    # The fetchers are imported when first used, so that only the libraries
+    # of the enabled sources are loaded.
+
+    def _get_tibber(self) -> "FetchTibber":
+        if self._tibber is None:
+            with span("import tibber"):
+                from .fetch_tibber import FetchTibber
+
+            tibber_token = self._config.tibber_token
+            if not tibber_token:
+                raise ValueError("TIBBER_TOKEN must be set")
+            self._tibber = FetchTibber(token=tibber_token, logger=self._log)
+        return self._tibber
+
+    def _get_smhi(self) -> "FetchSMHI":
+        if self._smhi is None:
+            with span("import smhi"):
+                from .fetch_smhi import FetchSMHI
+
+            self._smhi = FetchSMHI(
+                self._config.map_latitude, self._config.map_longitude, self._log
+            )
+        return self._smhi
+
+    def merge(self, sources: dict[str, dict[str, Any]]) -> dict[str, Any]:
+        """Build the final data structure from the raw source data.
+
+        Args:
+            sources (dict): Raw data keyed by source name, see fetch_source().
+
+        Returns:
+            dict[str, Any]: The combined data from all sources.
+        """
+        sections = {spec.name: spec.section for spec in self.sources}
+        with span("merge"):
+            return merge_sources(sources, self._log, sections)
 
-        # Build final data structure
-        all_data: dict[str, Any] = {}
 
-        # Copy/merge Netatmo data at the top level
-        all_data.update(netatmo_data)
+def merge_sources(
+    sources: dict[str, dict[str, Any]],
+    logger: logging.Logger | None = None,
+    sections: dict[str, str] | None = None,
+) -> dict[str, Any]:
+    """Build the final data structure from the raw source data.
 
-        # --- Outdoor data ---
+    The source data is left untouched, so the same data can be merged
+    again when only some of the sources have been refreshed. Sources, and
+    parts of sources, that are missing are left out of the result.
+
+    Args:
+        sources (dict): Raw data keyed by source name, see
+            FetchAll.fetch_source().
+        logger (logging.Logger | None): Logger to use.
+        sections (dict[str, str] | None): The output section of each plugin
+            source, see SourceSpec.
+
+    Returns:
+        dict[str, Any]: The combined data from all sources.
+    """
+    log = logger if logger is not None else logging.getLogger(__name__)
+    netatmo_data = sources.get("netatmo", {})
+    smhi_data = sources.get("smhi", {})
+
+    # Build final data structure
+    all_data: dict[str, Any] = {}
+
+    # Copy/merge Netatmo data at the top level, the outdoor data is merged
+    # into the outdoor section below
+    all_data.update(
+        {key: dict(val) for key, val in netatmo_data.items() if key != "outdoor"}
+    )
+
+    # --- Outdoor data ---
+    if "current" in smhi_data or "outdoor" in netatmo_data:
         all_data["outdoor"] = {}
-        current: dict[str, Any] = fetch_smhi.forecast_to_conditions(current_smhi_data)
-        # We'll remove the valid_time from the 'current' block
-        del current["valid_time"]
+        current: dict[str, Any] = {}
+        if "current" in smhi_data:
+            current.update(smhi_data["current"])
+            # We'll remove the valid_time from the 'current' block
+            del current["valid_time"]
         all_data["outdoor"]["current"] = current
-        # Check if the Netatmo outdoor data is available and if so, use it
-        if "outdoor" in netatmo_data:
-            if netatmo_data["outdoor"]["temperature"] > -999:
-                self._log.info("Netatmo outdoor data is available, using it")
-                all_data["outdoor"]["current"]["temperature"] = netatmo_data["outdoor"][
-                    "temperature"
-                ]
-            if netatmo_data["outdoor"]["min_temp"] > -999:
-                all_data["outdoor"]["current"]["temperature_min"] = netatmo_data[
-                    "outdoor"
-                ]["min_temp"]
-            if netatmo_data["outdoor"]["max_temp"] > -999:
-                all_data["outdoor"]["current"]["temperature_max"] = netatmo_data[
-                    "outdoor"
-                ]["max_temp"]
-            if netatmo_data["outdoor"]["humidity"] > -999:
-                all_data["outdoor"]["current"]["humidity"] = netatmo_data["outdoor"][
-                    "humidity"
-                ]
+    # Check if the Netatmo outdoor data is available and if so, use it
+    if "outdoor" in netatmo_data:
+        if netatmo_data["outdoor"]["temperature"] > -999:
+            log.info("Netatmo outdoor data is available, using it")
+            all_data["outdoor"]["current"]["temperature"] = netatmo_data["outdoor"][
+                "temperature"
+            ]
+        if netatmo_data["outdoor"]["min_temp"] > -999:
+            all_data["outdoor"]["current"]["temperature_min"] = netatmo_data["outdoor"][
+                "min_temp"
+            ]
+        if netatmo_data["outdoor"]["max_temp"] > -999:
+            all_data["outdoor"]["current"]["temperature_max"] = netatmo_data["outdoor"][
+                "max_temp"
+            ]
+        if netatmo_data["outdoor"]["humidity"] > -999:
+            all_data["outdoor"]["current"]["humidity"] = netatmo_data["outdoor"][
+                "humidity"
+            ]
 
+    if "forecast" in smhi_data:
         # Create the "forecast" subdict
-        all_data["outdoor"]["forecast"] = {}
-        for entry in forecast_smhi_data:
-            conditions: dict[str, Any] = fetch_smhi.forecast_to_conditions(entry)
+        all_data.setdefault("outdoor", {})["forecast"] = {}
+        for conditions in smhi_data["forecast"]:
             valid_time = cast(datetime, conditions["valid_time"])
             date_str = valid_time.strftime("%Y-%m-%d")
+            all_data["outdoor"]["forecast"][date_str] = _forecast_entry(conditions)
 
-            forecast: dict[str, Any] = {
-                "temperature": conditions["temperature"],
-                "temperature_min": conditions["temperature_min"],
-                "temperature_max": conditions["temperature_max"],
-                "precipitation": conditions["precipitation"],
-                "wind_speed": conditions["wind_speed"],
-                "wind_direction": conditions["wind_direction"],
-                "wind_gust": conditions["wind_gust"],
-                "symbol": conditions["symbol"],
-                "symbol_string": conditions["symbol_string"],
-                "humidity": conditions["humidity"],
-                "pressure": conditions["pressure"],
-                "precipitation_string": conditions["precipitation_string"],
-            }
-            all_data["outdoor"]["forecast"][date_str] = forecast
+    if "forecast_hour" in smhi_data:
+        forecast_24h_smhi_data = smhi_data["forecast_hour"][1:25]
 
         # Create the "forecast_24h" subdict
-        all_data["outdoor"]["forecast_24h"] = {}
-        for entry in forecast_24h_smhi_data:
-            conditions_24h: dict[str, Any] = fetch_smhi.forecast_to_conditions(entry)
+        all_data.setdefault("outdoor", {})["forecast_24h"] = {}
+        for conditions_24h in forecast_24h_smhi_data:
             valid_time = cast(datetime, conditions_24h["valid_time"])
             date_str = valid_time.strftime("%H:%M:%S")
+            all_data["outdoor"]["forecast_24h"][date_str] = _forecast_entry(
+                conditions_24h
+            )
 
-            forecast_24h: dict[str, Any] = {
-                "temperature": conditions_24h["temperature"],
-                "temperature_min": conditions_24h["temperature_min"],
-                "temperature_max": conditions_24h["temperature_max"],
-                "precipitation": conditions_24h["precipitation"],
-                "wind_speed": conditions_24h["wind_speed"],
-                "wind_direction": conditions_24h["wind_direction"],
-                "wind_gust": conditions_24h["wind_gust"],
-                "symbol": conditions_24h["symbol"],
-                "symbol_string": conditions_24h["symbol_string"],
-                "humidity": conditions_24h["humidity"],
-                "pressure": conditions_24h["pressure"],
-                "precipitation_string": conditions_24h["precipitation_string"],
-            }
-            all_data["outdoor"]["forecast_24h"][date_str] = forecast_24h
-
-        # --- Energy data ---
+    # --- Energy data ---
+    if "tibber" in sources or "tibber_prices" in sources:
         all_data["energy"] = {}
+    tibber_source = sources.get("tibber", {})
+    if "info" in tibber_source:
+        tibber_data = tibber_source["info"]
         all_data["energy"]["current_price"] = tibber_data["current_price_info"]
+    if "consumption" in tibber_source:
+        energy_data = tibber_source["consumption"]
         all_data["energy"]["consumption"] = {}
 
         for entry in energy_data:
             date_str = entry["from"][0:10] + " " + entry["from"][11:19]
-            del entry["from"]
-            all_data["energy"]["consumption"][date_str] = entry
+            consumption = {key: val for key, val in entry.items() if key != "from"}
+            all_data["energy"]["consumption"][date_str] = consumption
 
-        all_data["energy"]["prices"] = price_data
+    if "tibber_prices" in sources:
+        all_data["energy"]["prices"] = sources["tibber_prices"]
 
-        return all_data
+    # --- Plugin sources ---
+    for name, data in sources.items():
+        if name in BUILTIN_SOURCES or sections is None or name not in sections:
+            continue
+        section = all_data
+        *parents, key = sections[name].split(".")
+        for parent in parents:
+            section = section.setdefault(parent, {})
+        section[key] = data
+
+    return all_data
+
+
+def select_sections(all_data: dict[str, Any], sections: list[str]) -> dict[str, Any]:
+    """Return only the sections of all_data, dotted paths like energy.prices."""
+    selected: dict[str, Any] = {}
+    for section in sections:
+        value: Any = all_data
+        for key in section.split("."):
+            if not isinstance(value, dict) or key not in value:
+                break
+            value = value[key]
+        else:
+            *parents, last = section.split(".")
+            target = selected
+            for parent in parents:
+                target = target.setdefault(parent, {})
+            target[last] = value
+    return selected
+
+
+def _forecast_entry(conditions: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "temperature": conditions["temperature"],
+        "temperature_min": conditions["temperature_min"],
+        "temperature_max": conditions["temperature_max"],
+        "precipitation": conditions["precipitation"],
+        "wind_speed": conditions["wind_speed"],
+        "wind_direction": conditions["wind_direction"],
+        "wind_gust": conditions["wind_gust"],
+        "symbol": conditions["symbol"],
+        "symbol_string": conditions["symbol_string"],
+        "humidity": conditions["humidity"],
+        "pressure": conditions["pressure"],
+        "precipitation_string": conditions["precipitation_string"],
+    }
@@ -4,6 +4,10 @@
 
 Authentication: See the installation instructions in the
 documentation.
+
+All stations of the account and all their modules are read from one
+station data request. The values of each module are picked by a field
+schema for its module type, compiled once when the module is imported.
 """
 
 import logging
@@ -11,6 +15,70 @@ from typing import Any, Optional
 
 import lnetatmo  # type: ignore
 
+# The kind of each Netatmo module type
+MODULE_KINDS = {
+    "NAMain": "indoor",
+    "NAModule1": "outdoor",
+    "NAModule2": "wind",
+    "NAModule3": "rain",
+    "NAModule4": "indoor",
+}
+
+# Our key, the Netatmo key and the value used when missing
+_TEMPERATURE = (
+    ("temperature", "Temperature", -999.0),
+    ("humidity", "Humidity", -999.0),
+    ("min_temp", "min_temp", -999.0),
+    ("max_temp", "max_temp", -999.0),
+    ("date_min_temp", "date_min_temp", ""),
+    ("date_max_temp", "date_max_temp", ""),
+    ("temp_trend", "temp_trend", ""),
+)
+_RADIO = (
+    ("battery_percent", "battery_percent", -999),
+    ("rf_status", "rf_status", -999),
+)
+_FIELDS: dict[str, tuple[tuple[str, str, Any], ...]] = {
+    "NAMain": _TEMPERATURE
+    + (
+        ("co2", "CO2", -999),
+        ("pressure", "Pressure", -999.0),
+        ("absolute_pressure", "AbsolutePressure", -999.0),
+        ("noise", "Noise", -999),
+        ("pressure_trend", "pressure_trend", ""),
+    ),
+    "NAModule1": _TEMPERATURE + _RADIO,
+    "NAModule2": (
+        ("wind_strength", "WindStrength", -999.0),
+        ("wind_angle", "WindAngle", -999),
+        ("gust_strength", "GustStrength", -999.0),
+        ("gust_angle", "GustAngle", -999),
+        ("max_wind_strength", "max_wind_str", -999.0),
+        ("max_wind_angle", "max_wind_angle", -999),
+        ("date_max_wind_strength", "date_max_wind_str", ""),
+    )
+    + _RADIO,
+    "NAModule3": (
+        ("rain", "Rain", -999.0),
+        ("sum_rain_1", "sum_rain_1", -999.0),
+        ("sum_rain_24", "sum_rain_24", -999.0),
+    )
+    + _RADIO,
+    "NAModule4": _TEMPERATURE + (("co2", "CO2", -999),) + _RADIO,
+}
+# Read from the module itself, the other values are in its dashboard_data
+_MODULE_KEYS = {"battery_percent", "rf_status"}
+
+# Compiled schema per Netatmo module type: (key, Netatmo key, default,
+# read from the module instead of dashboard_data)
+SCHEMAS = {
+    module_type: tuple(
+        (key, netatmo_key, default, netatmo_key in _MODULE_KEYS)
+        for key, netatmo_key, default in fields
+    )
+    for module_type, fields in _FIELDS.items()
+}
+
 
 class FetchNetatmo:
     """FetchNetatmo is responsible for fetching weather data from a Netatmo
@@ -19,120 +87,106 @@ class FetchNetatmo:
     It fetches data from the Netatmo API.
     """
 
-    def __init__(self, logger: Optional[logging.Logger] = None) -> None:
-        """Initialize FetchNetatmo."""
+    def __init__(
+        self,
+        logger: Optional[logging.Logger] = None,
+        credential_file: Optional[str] = None,
+    ) -> None:
+        """Initialize FetchNetatmo.
+
+        Args:
+            credential_file (str, optional): The Netatmo credentials file.
+                Defaults to ~/.netatmo.credentials.
+        """
         self._log = logger if logger is not None else logging.getLogger(__name__)
         try:
-            self._authorization = lnetatmo.ClientAuth()
+            if credential_file:
+                self._authorization = lnetatmo.ClientAuth(
+                    credentialFile=credential_file
+                )
+            else:
+                self._authorization = lnetatmo.ClientAuth()
         except Exception as e:
             self._log.error(f"Failed to authenticate with Netatmo API: {e}")
             raise
 
     def get_data(self) -> dict[str, dict[str, Any]]:
-        """Retrieve the weather data from the Netatmo object.
+        """Retrieve the weather data of all stations and modules.
 
         Returns:
-            dict: A dictionary of weather data with all required keys.
+            dict: The main module of the first station as indoor, its first
+                outdoor module as outdoor, and every module of every station
+                in modules, keyed by kind (indoor, outdoor, wind, rain) and
+                module id. Missing values are -999 or "".
+
+        Raises:
+            Exception: If the station data could not be fetched.
         """
         try:
-            weatherData = lnetatmo.WeatherStationData(self._authorization)
-            latest_data = weatherData.lastData()
+            weather_data = lnetatmo.WeatherStationData(self._authorization)
+            stations = weather_data.rawData
         except Exception as e:
+            # Raised so that the request is retried and the breaker counts it
             self._log.error(f"Failed to fetch data from Netatmo API: {e}")
-            return {}
-
-        data: dict[str, dict[str, Any]] = {}
-
-        # Define default values with desired keys (lowercase)
-        default_values = {
-            "indoor": {
-                "temperature": -999.0,
-                "co2": -999,
-                "humidity": -999.0,
-                "pressure": -999.0,
-                "absolute_pressure": -999.0,
-                "noise": -999,
-                "min_temp": -999.0,
-                "max_temp": -999.0,
-                "date_min_temp": "",
-                "date_max_temp": "",
-                "temp_trend": "",
-                "pressure_trend": "",
-            },
-            "outdoor": {
-                "temperature": -999.0,
-                "humidity": -999.0,
-                "min_temp": -999.0,
-                "max_temp": -999.0,
-                "date_min_temp": "",
-                "date_max_temp": "",
-                "battery_percent": -999,
-                "rf_status": -999,
-            },
-        }
-
-        # Define mapping from final keys to fetched data keys
-        key_mapping = {
-            "indoor": {
-                "temperature": "Temperature",
-                "co2": "CO2",
-                "humidity": "Humidity",
-                "pressure": "Pressure",
-                "absolute_pressure": "AbsolutePressure",
-                "noise": "Noise",
-                "min_temp": "min_temp",
-                "max_temp": "max_temp",
-                "date_min_temp": "date_min_temp",
-                "date_max_temp": "date_max_temp",
-                "temp_trend": "temp_trend",
-                "pressure_trend": "pressure_trend",
-            },
-            "outdoor": {
-                "temperature": "Temperature",
-                "humidity": "Humidity",
-                "min_temp": "min_temp",
-                "max_temp": "max_temp",
-                "date_min_temp": "date_min_temp",
-                "date_max_temp": "date_max_temp",
-                "battery_percent": "battery_percent",
-                "rf_status": "rf_status",
-            },
-        }
-
-        # Helper function to fetch data with defaults
-        def fetch_sensor_data(
-            sensor_type: str, keys: dict[str, str], defaults: dict[str, Any]
-        ) -> dict[str, Any]:
-            sensor_data = latest_data.get(sensor_type, {})
-            fetched_data = {}
-            for final_key, fetched_key in keys.items():
-                value = sensor_data.get(fetched_key, defaults[final_key])
-                if value == defaults[final_key]:
-                    self._log.warning(
-                        f"Missing '{fetched_key}' in {sensor_type} data. "
-                        f"Using default value: {defaults[final_key]}"
-                    )
-                fetched_data[final_key] = value
-            return fetched_data
-
-        # Fetch indoor data
-        if "Indoor" in latest_data:
-            data["indoor"] = fetch_sensor_data(
-                "Indoor", key_mapping["indoor"], default_values["indoor"]
+            raise e
+
+        modules: dict[str, dict[str, Any]] = {}
+        # Names of the missing values, reported once per call
+        missing: dict[str, None] = {}
+        indoor = outdoor = None
+        for station in stations:
+            station_name = station.get("station_name", station["_id"])
+            for module in (station, *station.get("modules", ())):
+                module_type = module.get("type", "")
+                schema = SCHEMAS.get(module_type)
+                if schema is None:
+                    self._log.debug(f"Skipping unknown Netatmo module {module_type}")
+                    continue
+                dashboard = module.get("dashboard_data", {})
+                values: dict[str, Any] = {
+                    "station": station_name,
+                    "name": module.get("module_name", ""),
+                    "type": module_type,
+                }
+                for key, netatmo_key, default, in_module in schema:
+                    value = (module if in_module else dashboard).get(netatmo_key)
+                    if value is None:
+                        value = default
+                        missing[f"{values['name']}.{netatmo_key}"] = None
+                    values[key] = value
+                kind = MODULE_KINDS[module_type]
+                modules.setdefault(kind, {})[module["_id"]] = values
+                if indoor is None and module_type == "NAMain":
+                    indoor = values
+                if outdoor is None and module_type == "NAModule1":
+                    outdoor = values
+        if missing:
+            self._log.warning(
+                "Missing values in Netatmo data, using defaults: "
+                f"{', '.join(missing)}"
             )
-        else:
-            self._log.warning("No indoor data available. Using default indoor values.")
-            data["indoor"] = default_values["indoor"]
 
-        # Fetch outdoor data
-        if "Outdoor" in latest_data:
-            data["outdoor"] = fetch_sensor_data(
-                "Outdoor", key_mapping["outdoor"], default_values["outdoor"]
-            )
-        else:
+        data: dict[str, dict[str, Any]] = {"modules": modules}
+        if indoor is None:
+            self._log.warning("No indoor data available. Using default indoor values.")
+            indoor = self._defaults("NAMain")
+        if outdoor is None:
             self._log.warning(
                 "No outdoor data available. Using default outdoor values."
             )
-            data["outdoor"] = default_values["outdoor"]
-
+            outdoor = self._defaults("NAModule1")
+        data["indoor"] = self._without_labels(indoor)
+        data["outdoor"] = self._without_labels(outdoor)
         return data
+
+    @staticmethod
+    def _defaults(module_type: str) -> dict[str, Any]:
+        return {key: default for key, _, default, _ in SCHEMAS[module_type]}
+
+    @staticmethod
+    def _without_labels(values: dict[str, Any]) -> dict[str, Any]:
+        return {
+            key: value
+            for key, value in values.items()
+            if key not in ("station", "name", "type")
+        }
@@ -6,11 +6,20 @@ Uses the SMHI API to fetch weather data for a specific location see:
 - https://github.com/joysoftware/pypi_smhi?tab=readme-ov-file
 """
 
+import json
 import logging
+import urllib.request
 from datetime import datetime
 
 from smhi.smhi_lib import Smhi, SmhiForecast  # type: ignore
 
+from ..series.forecast_series import ForecastSeries
+
+APPROVED_TIME_URL = (
+    "https://opendata-download-metfcst.smhi.se"
+    "/api/category/pmp3g/version/2/approvedtime.json"
+)
+
 
 class FetchSMHI:
     """FetchSMHI is responsible for fetching weather forecasts.
@@ -51,6 +60,16 @@ class FetchSMHI:
         forecasts: list[SmhiForecast] = smhi.get_forecast_hour()
         return forecasts[1:]
 
+    def get_forecast_series(self) -> ForecastSeries:
+        """Retrieve the hourly forecast as arrays that can be interpolated.
+
+        Returns:
+            ForecastSeries: The hourly forecast.
+        """
+        return ForecastSeries.from_conditions(
+            [self.forecast_to_conditions(f) for f in self.get_forecast_hour()]
+        )
+
     def get_current_conditions(self) -> SmhiForecast:
         """Retrieve the current weather conditions.
 
@@ -61,6 +80,19 @@ class FetchSMHI:
         forecasts: list[SmhiForecast] = smhi.get_forecast()
         return forecasts[0]
 
+    def get_approved_time(self) -> str:
+        """Retrieve the time when the latest forecast run was approved.
+
+        This is a small request that can be used to find out if a new
+        forecast has been published without downloading the forecast.
+
+        Returns:
+            str: The approved time as an ISO 8601 string.
+        """
+        with urllib.request.urlopen(APPROVED_TIME_URL, timeout=10) as response:
+            approved: dict[str, str] = json.load(response)
+        return approved["approvedTime"]
+
     def forecast_to_conditions(
         self, forecast: SmhiForecast
     ) -> dict[str, int | str | float | datetime]:
@@ -2,11 +2,35 @@
 
 import asyncio
 import logging
-from typing import Any
+from typing import Any, Awaitable, Callable, Coroutine
 
 import tibber  # type: ignore
 import tibber.const  # type: ignore
 
+CONSUMPTION_QUERY = """
+query ($homeId: ID!, $resolution: EnergyResolution!, $first: Int!, $after: String) {
+  viewer {
+    home(id: $homeId) {
+      consumption(resolution: $resolution, first: $first, after: $after) {
+        nodes {
+          from
+          to
+          cost
+          unitPrice
+          unitPriceVAT
+          consumption
+          consumptionUnit
+        }
+      }
+    }
+  }
+}
+"""
+
+# Makes one request with the function it is given, which may be called
+# again to retry the request
+Request = Callable[[Callable[[], Coroutine[Any, Any, Any]]], Awaitable[Any]]
+
 
 class FetchTibber:
     """FetchTibber is responsible for fetching energy data from the Tibber API.
@@ -60,6 +84,66 @@ class FetchTibber:
         """
         return asyncio.run(self._get_consumption_data_async())
 
+    def get_consumption_pages(
+        self,
+        pages: list[tuple[str, str, int]],
+        on_page: Callable[[tuple[str, str, int], list[dict[str, Any]]], None],
+        concurrency: int = 4,
+        request: Request | None = None,
+    ) -> None:
+        """Fetch pages of historic consumption concurrently over one connection.
+
+        Args:
+            pages (list[tuple[str, str, int]]): Resolution (HOURLY, DAILY,
+                MONTHLY, ...), cursor to fetch after and number of nodes for
+                each page.
+            on_page (Callable): Called with the page and its nodes as soon as
+                a page has been fetched.
+            concurrency (int): The maximum number of requests in flight.
+            request (Request | None): Awaited with a function that makes a
+                request, e.g. to keep the rate limit and retry failures.
+                Without it each request is made once.
+        """
+        asyncio.run(self._get_consumption_pages(pages, on_page, concurrency, request))
+
+    async def _get_consumption_pages(
+        self,
+        pages: list[tuple[str, str, int]],
+        on_page: Callable[[tuple[str, str, int], list[dict[str, Any]]], None],
+        concurrency: int,
+        request: Request | None,
+    ) -> None:
+        tibber_connection = tibber.Tibber(self.token, user_agent=self.user_agent)
+        await tibber_connection.update_info()
+        home = tibber_connection.get_homes()[0]
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch_page(page: tuple[str, str, int]) -> None:
+            resolution, cursor, first = page
+
+            def execute() -> Coroutine[Any, Any, Any]:
+                coroutine: Coroutine[Any, Any, Any] = tibber_connection.execute(
+                    CONSUMPTION_QUERY,
+                    {
+                        "homeId": home.home_id,
+                        "resolution": resolution,
+                        "first": first,
+                        "after": cursor,
+                    },
+                )
+                return coroutine
+
+            async with semaphore:
+                data = await (request(execute) if request is not None else execute())
+            nodes = data["viewer"]["home"]["consumption"]["nodes"] if data else []
+            self._log.debug(f"Fetched {len(nodes)} {resolution} consumption nodes")
+            on_page(page, nodes)
+
+        try:
+            await asyncio.gather(*(fetch_page(page) for page in pages))
+        finally:
+            await tibber_connection.close_connection()
+
     async def _get_consumption_data_async(self) -> Any:
         """Async method that fetches consumption data using Tibber's async library.
 
@@ -0,0 +1,36 @@
+"""The last data fetched successfully from each source.
+
+Used to answer with somewhat old data when a source is too slow or down.
+The data is pickled since it contains datetime objects. FetchAll keys the
+data by source and account, like the circuit breakers, so one account
+never gets the data of another.
+"""
+
+import os
+import pickle
+import time
+from pathlib import Path
+from typing import Any
+
+
+class LastGoodStore:
+    """Keep the last good data of each source in a directory."""
+
+    def __init__(self, directory: Path) -> None:
+        directory.mkdir(parents=True, exist_ok=True)
+        self._directory = directory
+
+    def save(self, name: str, data: dict[str, Any]) -> None:
+        path = self._directory / f"{name}.pickle"
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_bytes(pickle.dumps((time.time(), data)))
+        os.replace(tmp_path, path)
+
+    def load(self, name: str) -> tuple[float, dict[str, Any]] | None:
+        """Return when the data was saved (epoch) and the data, if any."""
+        try:
+            path = self._directory / f"{name}.pickle"
+            saved_at, data = pickle.loads(path.read_bytes())
+        except (OSError, pickle.UnpicklingError, EOFError, ValueError):
+            return None
+        return saved_at, data
@@ -0,0 +1,158 @@
+"""Keep a run of FetchAll within a latency budget.
+
+Every fetch gets a deadline from the overall budget. When a fetch has been
+running longer than what the source usually needs (a percentile of its
+earlier run times), a second identical request is started and whichever
+answers first is used. A source that has not answered by its deadline
+gets a TimeoutError, FetchAll then uses its last good data.
+
+The fetches run in daemon threads, so a request that never answers does
+not keep the program from exiting.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from pathlib import Path
+from typing import Any, Callable, cast
+
+FetchFunction = Callable[[], dict[str, Any]]
+
+
+def _start(func: FetchFunction) -> "Future[dict[str, Any]]":
+    future: Future[dict[str, Any]] = Future()
+
+    def run() -> None:
+        try:
+            future.set_result(func())
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+
+class LatencyTracker:
+    """Run times of the recent fetches of each source, kept in a file."""
+
+    def __init__(self, path: Path, samples: int = 50) -> None:
+        self._path = path
+        self._samples = samples
+        self._lock = threading.Lock()
+        try:
+            self._durations: dict[str, list[float]] = json.loads(path.read_text())
+        except (OSError, ValueError):
+            self._durations = {}
+
+    def record(self, name: str, duration: float) -> None:
+        with self._lock:
+            durations = self._durations.setdefault(name, [])
+            durations.append(duration)
+            del durations[: -self._samples]
+
+    def percentile(self, name: str, percentile: float) -> float | None:
+        """Return a percentile of the run times, None with too few samples."""
+        with self._lock:
+            durations = sorted(self._durations.get(name, []))
+        if len(durations) < 5:
+            return None
+        return durations[min(len(durations) - 1, int(percentile * len(durations)))]
+
+    def save(self) -> None:
+        with self._lock:
+            encoded = json.dumps(self._durations)
+        tmp_path = self._path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(encoded)
+        os.replace(tmp_path, self._path)
+
+
+class LatencyBudget:
+    """Run fetches with deadlines, hedged requests and stale fallbacks."""
+
+    def __init__(
+        self,
+        budget: float,
+        tracker: LatencyTracker,
+        hedge_percentile: float = 0.95,
+        logger: logging.Logger | None = None,
+    ) -> None:
+        """Initialize LatencyBudget.
+
+        Args:
+            budget (float): Seconds that a whole run may take.
+            tracker (LatencyTracker): Run times of earlier fetches.
+            hedge_percentile (float): A second request is started when a
+                fetch has run longer than this percentile of its run times.
+        """
+        self.budget = budget
+        self._tracker = tracker
+        self._hedge_percentile = hedge_percentile
+        self._log = logger if logger is not None else logging.getLogger(__name__)
+
+    def run(
+        self, calls: dict[str, FetchFunction], deadline: float
+    ) -> tuple[dict[str, dict[str, Any]], dict[str, Exception]]:
+        """Run fetches concurrently until they are done or the deadline.
+
+        Args:
+            calls (dict[str, FetchFunction]): The fetch of each source.
+            deadline (float): When to give up waiting (epoch).
+
+        Returns:
+            tuple: The data of the sources that answered and the error of
+                each source that failed or did not answer in time.
+        """
+        started = time.time()
+        attempts: dict[str, list[Future[dict[str, Any]]]] = {
+            name: [_start(call)] for name, call in calls.items()
+        }
+        hedge_at = {}
+        for name in calls:
+            usual = self._tracker.percentile(name, self._hedge_percentile)
+            if usual is not None:
+                hedge_at[name] = started + usual
+        results: dict[str, dict[str, Any]] = {}
+        errors: dict[str, Exception] = {}
+
+        while True:
+            now = time.time()
+            for name, at in list(hedge_at.items()):
+                if name in results or name in errors:
+                    del hedge_at[name]
+                elif at <= now:
+                    self._log.info(f"{name} is slow, sending a hedged request")
+                    attempts[name].append(_start(calls[name]))
+                    del hedge_at[name]
+            for name, futures in attempts.items():
+                if name in results or name in errors:
+                    continue
+                succeeded = [f for f in futures if f.done() and f.exception() is None]
+                if succeeded:
+                    results[name] = succeeded[0].result()
+                    self._tracker.record(name, time.time() - started)
+                elif all(f.done() for f in futures):
+                    # Every attempt failed, the rate limiter has already retried
+                    errors[name] = cast(Exception, futures[0].exception())
+            if len(results) + len(errors) == len(calls) or now >= deadline:
+                break
+            waiting = [
+                future
+                for name, futures in attempts.items()
+                if name not in results and name not in errors
+                for future in futures
+                if not future.done()
+            ]
+            next_event = min([deadline, *hedge_at.values()])
+            timeout = max(0.0, next_event - now)
+            wait(waiting, timeout=timeout, return_when=FIRST_COMPLETED)
+
+        for name in calls:
+            if name not in results and name not in errors:
+                errors[name] = TimeoutError(
+                    f"{name} did not answer within the latency budget"
+                )
+        self._tracker.save()
+        return results, errors
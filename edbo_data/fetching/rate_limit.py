@@ -0,0 +1,228 @@
+"""Rate limiting of the requests to the upstream APIs.
+
+Each source gets a token bucket that is stored in a file, so that all
+edbo_data processes on the machine share the same budget. When an upstream
+still answers that the rate limit is exceeded, the wait time it asks for
+(Retry-After) is written to the bucket so that the other processes back off
+as well.
+"""
+
+import fcntl
+import json
+import logging
+import random
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Any, Callable, TypeVar
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    """Sustained request rate and the size of the bursts allowed."""
+
+    rate: float  # requests per second
+    burst: float
+
+
+# Netatmo allows 500 requests per hour and 50 per 10 seconds for a user.
+# Tibber asks clients to stay below 100 requests per 5 minutes. SMHI has no
+# published limit, this is just to be polite.
+DEFAULT_RATE_LIMITS = {
+    "netatmo": RateLimit(rate=500 / 3600, burst=50),
+    "tibber": RateLimit(rate=100 / 300, burst=20),
+    "smhi": RateLimit(rate=1.0, burst=10),
+}
+
+
+class TokenBucket:
+    """A token bucket kept in a file and shared between processes."""
+
+    def __init__(self, path: Path, limit: RateLimit) -> None:
+        """Initialize TokenBucket.
+
+        Args:
+            path (Path): The file that holds the state of the bucket.
+            limit (RateLimit): The rate limit to enforce.
+        """
+        self._path = path
+        self._limit = limit
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """Take tokens from the bucket, waiting until they are available.
+
+        Args:
+            tokens (float): The number of tokens (requests) needed.
+
+        Returns:
+            float: The number of seconds spent waiting.
+        """
+        tokens = min(tokens, self._limit.burst)
+        waited = 0.0
+        while True:
+            delay = self._update(tokens=tokens)
+            if delay <= 0:
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+    def block(self, seconds: float) -> None:
+        """Stop all users of the bucket from making requests for a while."""
+        self._update(block=seconds)
+
+    def _update(self, tokens: float = 0.0, block: float = 0.0) -> float:
+        """Refill the bucket and take tokens if possible.
+
+        Returns:
+            float: Zero if the tokens were taken, otherwise the number of
+                seconds until they can be.
+        """
+        with open(self._path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                state: dict[str, float] = json.loads(f.read())
+            except ValueError:
+                state = {}
+            now = time.time()
+            available = state.get("tokens", self._limit.burst)
+            elapsed = max(0.0, now - state.get("updated", now))
+            available = min(self._limit.burst, available + elapsed * self._limit.rate)
+            blocked_until = max(state.get("blocked_until", 0.0), now + block)
+            if blocked_until > now:
+                delay = blocked_until - now
+            elif available >= tokens:
+                available -= tokens
+                delay = 0.0
+            else:
+                delay = (tokens - available) / self._limit.rate
+            state = {
+                "tokens": available,
+                "updated": now,
+                "blocked_until": blocked_until,
+            }
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(state))
+        return delay
+
+
+class RateLimiter:
+    """Run requests to a source within its rate limit and retry on failures."""
+
+    def __init__(
+        self,
+        directory: Path,
+        limits: dict[str, RateLimit] | None = None,
+        attempts: int = 4,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        logger: logging.Logger | None = None,
+    ) -> None:
+        """Initialize RateLimiter.
+
+        Args:
+            directory (Path): Where the token bucket files are kept.
+            limits (dict[str, RateLimit] | None): Limit per source, defaults
+                to DEFAULT_RATE_LIMITS.
+            attempts (int): The maximum number of attempts for a request.
+            base_delay (float): The first backoff delay in seconds, doubled for
+                every failed attempt.
+            max_delay (float): Upper limit of the backoff delay in seconds.
+        """
+        directory.mkdir(parents=True, exist_ok=True)
+        if limits is None:
+            limits = DEFAULT_RATE_LIMITS
+        self._buckets = {
+            name: TokenBucket(directory / f"{name}.json", limit)
+            for name, limit in limits.items()
+        }
+        self._attempts = attempts
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._log = logger if logger is not None else logging.getLogger(__name__)
+
+    def acquire(self, source: str, cost: float = 1.0) -> float:
+        """Wait until cost requests can be made to source.
+
+        Returns:
+            float: The number of seconds spent waiting.
+        """
+        bucket = self._buckets.get(source)
+        return bucket.acquire(cost) if bucket is not None else 0.0
+
+    def call(self, source: str, func: Callable[[], T], cost: float = 1.0) -> T:
+        """Call func once there is room for it within the rate limit.
+
+        Failures that are worth retrying are retried with a jittered
+        exponential backoff, or after the time the upstream asked for.
+
+        Args:
+            source (str): The source that func makes requests to.
+            func (Callable[[], T]): The function making the requests.
+            cost (float): The number of requests func makes.
+
+        Returns:
+            T: What func returns.
+        """
+        bucket = self._buckets.get(source)
+        for attempt in range(self._attempts):
+            if bucket is not None:
+                waited = bucket.acquire(cost)
+                if waited > 0:
+                    self._log.debug(f"Waited {waited:.1f} s for the {source} limit")
+            try:
+                return func()
+            except Exception as e:
+                if not is_retryable(e) or attempt == self._attempts - 1:
+                    raise
+                delay = retry_after(e)
+                if delay is not None:
+                    if bucket is not None:
+                        bucket.block(delay)
+                else:
+                    ceiling = min(self._max_delay, self._base_delay * 2**attempt)
+                    delay = random.uniform(0, ceiling)
+                self._log.warning(
+                    f"Request to {source} failed ({e}), retrying in {delay:.1f} s"
+                )
+                time.sleep(delay)
+        raise AssertionError("unreachable")
+
+
+def _status(exc: BaseException) -> int | None:
+    for attr in ("status", "code", "status_code"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    return None
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """Check if a failed request is worth retrying."""
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    return _status(exc) in RETRYABLE_STATUS
+
+
+def retry_after(exc: BaseException) -> float | None:
+    """Return the number of seconds the upstream asked us to wait, if any."""
+    value: Any = getattr(exc, "retry_after", None)
+    headers = getattr(exc, "headers", None)
+    if value is None and headers is not None:
+        value = headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(str(value)).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
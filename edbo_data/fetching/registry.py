@@ -0,0 +1,204 @@
+"""Registry of the data sources.
+
+Each source is described by a SourceSpec: the section of the output it
+fills in, how often it has new data, how many requests a fetch costs and
+which other sources it needs. The built-in sources are Netatmo, Tibber and
+SMHI. More sources can be added by other packages through the entry point
+group ``edbo_data.sources``, each entry point pointing at a SourceSpec.
+
+Only the specs are loaded up front. The code that fetches a source is
+imported when the source is used, and only the sources listed in
+``sources`` in the ``[GENERAL]`` section of the configuration are used.
+Without that setting the built-in sources are used.
+
+A plugin source is created by calling its factory with the configuration
+and a logger. The object returned must have a method
+``fetch(dependencies: dict[str, dict]) -> dict`` which is given the data of
+the sources it depends on. What it returns is put in its section of the
+FetchAll output.
+
+A caller that only needs some of the output asks for sections, dotted
+paths like ``energy.prices``. select_sources() resolves them to the
+sources that provide them, using the paths in SourceSpec.provides.
+"""
+
+import importlib
+import logging
+from dataclasses import dataclass
+from importlib.metadata import entry_points
+from typing import Any, Protocol
+
+from python_support.configuration import MyConfig  # type: ignore
+
+from ..collecting.scheduler import DEFAULT_CADENCES, Cadence, IntervalCadence
+
+ENTRY_POINT_GROUP = "edbo_data.sources"
+
+
+class Source(Protocol):
+    def fetch(self, dependencies: dict[str, dict[str, Any]]) -> dict[str, Any]: ...
+
+
+@dataclass(frozen=True)
+class SourceSpec:
+    """Description of a data source."""
+
+    name: str
+    # Dotted path of the section in the output, e.g. "energy.prices"
+    section: str
+    # "module:callable" creating the source, None for the built-in sources
+    factory: str | None = None
+    cadence: Cadence = IntervalCadence(interval=3600, max_interval=3600)
+    # Number of requests a fetch makes
+    cost: float = 1.0
+    # The rate limit bucket, defaults to the name of the source
+    rate_limit: str | None = None
+    depends_on: tuple[str, ...] = ()
+    # The output paths the source fills in, defaults to its section
+    provides: tuple[str, ...] = ()
+
+    @property
+    def paths(self) -> tuple[str, ...]:
+        return self.provides or (self.section,)
+
+    def load(self, config: MyConfig, logger: logging.Logger) -> Source:
+        """Import the source and create it."""
+        if self.factory is None:
+            raise ValueError(f"{self.name} is a built-in source")
+        module_name, _, attribute = self.factory.partition(":")
+        factory = getattr(importlib.import_module(module_name), attribute)
+        source: Source = factory(config, logger)
+        return source
+
+
+BUILTIN_SOURCES = {
+    spec.name: spec
+    for spec in (
+        SourceSpec(
+            "netatmo",
+            "indoor",
+            cadence=DEFAULT_CADENCES["netatmo"],
+            cost=1,
+            provides=("indoor", "outdoor.current", "modules"),
+        ),
+        SourceSpec(
+            "tibber",
+            "energy",
+            cadence=DEFAULT_CADENCES["tibber"],
+            cost=6,
+            provides=("energy.current_price", "energy.consumption"),
+        ),
+        SourceSpec(
+            "tibber_prices",
+            "energy.prices",
+            cadence=DEFAULT_CADENCES["tibber_prices"],
+            cost=3,
+            rate_limit="tibber",
+        ),
+        SourceSpec(
+            "smhi",
+            "outdoor",
+            cadence=DEFAULT_CADENCES["smhi"],
+            cost=3,
+            provides=("outdoor.current", "outdoor.forecast", "outdoor.forecast_24h"),
+        ),
+    )
+}
+
+
+def discover() -> dict[str, SourceSpec]:
+    """Return the built-in sources and the sources from entry points."""
+    specs = dict(BUILTIN_SOURCES)
+    for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+        spec = entry_point.load()
+        if not isinstance(spec, SourceSpec):
+            raise TypeError(f"Entry point {entry_point.name} is not a SourceSpec")
+        specs[spec.name] = spec
+    return specs
+
+
+def enabled_sources(config: MyConfig | None) -> list[SourceSpec]:
+    """Return the sources enabled in the configuration, with dependencies.
+
+    The sources are ordered so that a source comes after its dependencies.
+
+    Args:
+        config (MyConfig | None): The configuration.
+
+    Returns:
+        list[SourceSpec]: The enabled sources.
+    """
+    configured = getattr(config, "general_sources", "") if config else ""
+    names = [name.strip() for name in configured.split(",") if name.strip()]
+    if names and all(name in BUILTIN_SOURCES for name in names):
+        # No need to look at the installed plugins
+        specs = dict(BUILTIN_SOURCES)
+    elif names:
+        specs = discover()
+    else:
+        return list(BUILTIN_SOURCES.values())
+
+    ordered: list[SourceSpec] = []
+
+    def add(name: str, chain: tuple[str, ...]) -> None:
+        if name in chain:
+            cycle = " -> ".join(chain + (name,))
+            raise ValueError(f"Circular source dependencies: {cycle}")
+        if any(spec.name == name for spec in ordered):
+            return
+        if name not in specs:
+            raise ValueError(f"Unknown source: {name}")
+        for dependency in specs[name].depends_on:
+            add(dependency, chain + (name,))
+        ordered.append(specs[name])
+
+    for name in names:
+        add(name, ())
+    return ordered
+
+
+def overlaps(path: str, other: str) -> bool:
+    """Check if one dotted path is the same as or inside the other."""
+    return path == other or path.startswith(other + ".") or other.startswith(path + ".")
+
+
+def wanted(path: str, sections: list[str] | None) -> bool:
+    """Check if anything at or below path is asked for, None asks for all."""
+    return sections is None or any(overlaps(path, s) for s in sections)
+
+
+def select_sources(
+    specs: list[SourceSpec], sections: list[str] | None
+) -> list[SourceSpec]:
+    """Return the sources needed for the sections, with their dependencies.
+
+    Args:
+        specs (list[SourceSpec]): The enabled sources, each after its
+            dependencies.
+        sections (list[str] | None): Dotted output paths, None for all.
+
+    Returns:
+        list[SourceSpec]: The needed sources, in the same order.
+    """
+    if sections is None:
+        return specs
+    by_name = {spec.name: spec for spec in specs}
+    needed: set[str] = set()
+
+    def add(name: str) -> None:
+        if name not in needed:
+            needed.add(name)
+            for dependency in by_name[name].depends_on:
+                add(dependency)
+
+    for section in sections:
+        providers = [
+            spec.name
+            for spec in specs
+            if any(overlaps(section, path) for path in spec.paths)
+        ]
+        if not providers:
+            raise ValueError(f"No enabled source provides {section}")
+        for name in providers:
+            add(name)
+    return [spec for spec in specs if spec.name in needed]
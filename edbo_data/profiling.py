@@ -0,0 +1,240 @@
+"""Find out where the time of a run goes.
+
+Stages of a run are marked with span(), e.g. the fetch of each source, the
+merge and the rendering. Spans cost next to nothing unless a run is
+profiled with profile(), which also runs a profiler:
+
+- "sample" samples the stacks of all threads every few milliseconds and
+  writes them as collapsed stacks, one line per stack with the number of
+  samples. The file can be given to flamegraph.pl, speedscope or inferno.
+- "deterministic" runs cProfile in every thread and writes the merged
+  statistics, which can be read with pstats, snakeviz or flameprof.
+
+When the run is done a table with the time spent in each stage is printed.
+The modules imported when edbo_data starts are loaded before the run, so
+their import time is not in the profile, use ``python -X importtime`` for
+it. The fetchers are imported during the run and are included.
+"""
+
+import cProfile
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from types import FrameType
+from typing import TYPE_CHECKING, Callable, Iterator, TypeVar
+
+if TYPE_CHECKING:
+    from rich.console import Console  # type: ignore
+    from rich.table import Table  # type: ignore
+
+T = TypeVar("T")
+
+MODES = ("sample", "deterministic")
+
+
+@dataclass
+class _Stage:
+    calls: int = 0
+    total: float = 0.0
+    longest: float = 0.0
+
+
+class SpanTracer:
+    """Wall clock time spent in each stage of a run."""
+
+    def __init__(self) -> None:
+        self.stages: dict[str, _Stage] = {}
+        self._lock = threading.Lock()
+
+    def add(self, name: str, duration: float) -> None:
+        with self._lock:
+            stage = self.stages.setdefault(name, _Stage())
+            stage.calls += 1
+            stage.total += duration
+            stage.longest = max(stage.longest, duration)
+
+    def summary(self, wall_time: float) -> "Table":
+        """Return a table of the stages, the slowest first.
+
+        Stages that run in parallel threads, e.g. the fetches, can add up to
+        more than the wall time of the run.
+        """
+        # Imported here since span() is used by modules that do not need rich
+        from rich import box  # type: ignore
+        from rich.table import Table
+
+        table = Table(
+            title=f"Stages ({wall_time:.3f} s wall time)",
+            box=box.SIMPLE_HEAVY,
+            title_style="bold magenta",
+        )
+        table.add_column("Stage", style="bold green")
+        table.add_column("Calls", justify="right")
+        table.add_column("Total (s)", justify="right", style="cyan")
+        table.add_column("Mean (ms)", justify="right")
+        table.add_column("Max (ms)", justify="right")
+        table.add_column("Of wall time", justify="right")
+        ordered = sorted(self.stages.items(), key=lambda i: i[1].total, reverse=True)
+        for name, stage in ordered:
+            table.add_row(
+                name,
+                str(stage.calls),
+                f"{stage.total:.3f}",
+                f"{stage.total / stage.calls * 1000:.1f}",
+                f"{stage.longest * 1000:.1f}",
+                f"{stage.total / wall_time:.0%}" if wall_time > 0 else "",
+            )
+        return table
+
+
+_tracer: SpanTracer | None = None
+
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    """Mark a stage of the run, e.g. ``with span("merge"): ...``."""
+    tracer = _tracer
+    if tracer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        tracer.add(name, time.perf_counter() - start)
+
+
+class StackSampler:
+    """Sample the stacks of all threads in a background thread."""
+
+    def __init__(self, interval: float = 0.005) -> None:
+        self.samples: Counter[str] = Counter()
+        self._interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self._interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id != own_id:
+                    thread = names.get(thread_id, str(thread_id))
+                    self.samples[_collapse(thread, frame)] += 1
+
+    def write(self, path: Path) -> None:
+        """Write the samples as collapsed stacks."""
+        with open(path, "w") as f:
+            for stack, count in sorted(self.samples.items()):
+                f.write(f"{stack} {count}\n")
+
+
+def _collapse(thread: str, frame: FrameType | None) -> str:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        filename = os.path.basename(code.co_filename)
+        stack.append(f"{code.co_name} ({filename}:{code.co_firstlineno})")
+        frame = frame.f_back
+    stack.append(thread)
+    return ";".join(reversed(stack))
+
+
+class ThreadProfiler:
+    """cProfile for all threads, with the statistics merged.
+
+    Before Python 3.12 a cProfile profiler only sees the thread that
+    enabled it, so every thread started during the run gets its own.
+    """
+
+    def __init__(self) -> None:
+        self._profilers = [cProfile.Profile()]
+        self._lock = threading.Lock()
+
+    def runcall(self, func: Callable[[], T]) -> T:
+        per_thread = sys.version_info < (3, 12)
+        if per_thread:
+            threading.setprofile(self._start_thread)
+        try:
+            return self._profilers[0].runcall(func)
+        finally:
+            if per_thread:
+                threading.setprofile(None)
+
+    def dump_stats(self, path: Path) -> None:
+        with self._lock:
+            profilers = list(self._profilers)
+        stats = pstats.Stats(profilers[0])
+        for profiler in profilers[1:]:
+            stats.add(profiler)
+        stats.dump_stats(path)
+
+    def _start_thread(self, frame: FrameType, event: str, arg: object) -> None:
+        # Called in the new thread, cProfile replaces this profile function
+        profiler = cProfile.Profile()
+        with self._lock:
+            self._profilers.append(profiler)
+        profiler.enable()
+
+
+def profile(
+    func: Callable[[], T],
+    mode: str,
+    output: Path,
+    console: "Console | None" = None,
+) -> T:
+    """Run func with a profiler and the span tracer.
+
+    The profile is written and the stage table printed (to stderr) also
+    when func raises or exits.
+
+    Args:
+        func (Callable[[], T]): What to profile.
+        mode (str): One of MODES.
+        output (Path): Where to write the profile.
+        console (Console | None): Where to print the stage table.
+
+    Returns:
+        T: What func returns.
+    """
+    global _tracer
+    if mode not in MODES:
+        raise ValueError(f"Unknown profiling mode: {mode}")
+    tracer = SpanTracer()
+    _tracer = tracer
+    sampler = StackSampler() if mode == "sample" else None
+    profiler = ThreadProfiler() if mode == "deterministic" else None
+    start = time.perf_counter()
+    try:
+        if sampler is not None:
+            sampler.start()
+            return func()
+        assert profiler is not None
+        return profiler.runcall(func)
+    finally:
+        wall_time = time.perf_counter() - start
+        _tracer = None
+        if sampler is not None:
+            sampler.stop()
+            sampler.write(output)
+        if profiler is not None:
+            profiler.dump_stats(output)
+        if console is None:
+            from rich.console import Console
+
+            console = Console(stderr=True)
+        console.print(tracer.summary(wall_time))
+        console.print(f"Profile written to {output}")
@@ -0,0 +1,120 @@
+"""Hourly forecast as numeric arrays that can be interpolated.
+
+SMHI gives the forecast at its own time steps. ForecastSeries keeps the
+valid times as int64 epoch seconds and every parameter as a float64 array,
+and interpolates a parameter to any batch of timestamps in one call, e.g.
+to the start of each price slot in a PriceSeries.
+"""
+
+import math
+from array import array
+from datetime import datetime, timezone
+from typing import Any, Sequence
+
+# How each parameter is interpolated between two time steps
+LINEAR = ("temperature", "humidity", "pressure", "wind_speed", "wind_gust")
+CIRCULAR = ("wind_direction",)
+# Codes can not be interpolated, the value of the previous time step is used
+STEP = ("precipitation", "symbol")
+PARAMETERS = LINEAR + CIRCULAR + STEP
+
+
+def _epoch(valid_time: datetime) -> int:
+    # SMHI valid times are in UTC
+    if valid_time.tzinfo is None:
+        valid_time = valid_time.replace(tzinfo=timezone.utc)
+    return int(valid_time.timestamp())
+
+
+class ForecastSeries:
+    """Forecast parameters per valid time, sorted by time."""
+
+    def __init__(
+        self, timestamps: "array[int]", values: dict[str, "array[float]"]
+    ) -> None:
+        """Initialize ForecastSeries.
+
+        Args:
+            timestamps (array[int]): Valid times (epoch seconds), sorted.
+            values (dict[str, array[float]]): An array per parameter.
+        """
+        self.timestamps = timestamps
+        self.values = values
+
+    @classmethod
+    def from_conditions(cls, conditions: list[dict[str, Any]]) -> "ForecastSeries":
+        """Create a ForecastSeries from FetchSMHI.forecast_to_conditions() output.
+
+        Args:
+            conditions (list[dict[str, Any]]): Conditions with a valid_time.
+
+        Returns:
+            ForecastSeries: The forecast.
+        """
+        ordered = sorted(conditions, key=lambda c: _epoch(c["valid_time"]))
+        timestamps = array("q", (_epoch(c["valid_time"]) for c in ordered))
+        values = {
+            parameter: array(
+                "d",
+                (
+                    math.nan if c.get(parameter) is None else float(c[parameter])
+                    for c in ordered
+                ),
+            )
+            for parameter in PARAMETERS
+        }
+        return cls(timestamps, values)
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def interpolate(
+        self, parameter: str, timestamps: Sequence[float]
+    ) -> "array[float]":
+        """Interpolate a parameter to a batch of timestamps.
+
+        The timestamps are sorted once and the forecast is walked through in
+        a single pass. Timestamps outside the forecast give NaN.
+
+        Args:
+            parameter (str): One of PARAMETERS.
+            timestamps (Sequence[float]): Epoch seconds, in any order.
+
+        Returns:
+            array[float]: The value for each timestamp, in the same order.
+        """
+        if parameter not in PARAMETERS:
+            raise ValueError(f"Unknown forecast parameter: {parameter}")
+        grid = self.timestamps
+        values = self.values[parameter]
+        result = array("d", [math.nan]) * len(timestamps)
+        if not grid:
+            return result
+
+        order = sorted(range(len(timestamps)), key=timestamps.__getitem__)
+        last = len(grid) - 1
+        i = 0
+        for index in order:
+            t = timestamps[index]
+            if t < grid[0] or t > grid[last]:
+                continue
+            while i < last and grid[i + 1] <= t:
+                i += 1
+            if i == last or t == grid[i] or parameter in STEP:
+                result[index] = values[i]
+                continue
+            fraction = (t - grid[i]) / (grid[i + 1] - grid[i])
+            if parameter in CIRCULAR:
+                # Go the short way around, e.g. from 350 to 10 degrees
+                delta = (values[i + 1] - values[i] + 180.0) % 360.0 - 180.0
+                result[index] = (values[i] + fraction * delta) % 360.0
+            else:
+                result[index] = values[i] + fraction * (values[i + 1] - values[i])
+        return result
+
+    def interpolate_all(self, timestamps: Sequence[float]) -> dict[str, "array[float]"]:
+        """Interpolate every parameter to a batch of timestamps."""
+        return {
+            parameter: self.interpolate(parameter, timestamps)
+            for parameter in PARAMETERS
+        }
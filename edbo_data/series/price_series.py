@@ -0,0 +1,152 @@
+"""Energy prices as a compact time series.
+
+Tibber returns the prices as a dict from ISO 8601 strings to floats, with
+hourly or 15 minute resolution. PriceSeries keeps the start of each slot as
+int64 epoch seconds and the prices as float64 in two arrays. Lookups are
+binary searches and the series can be resampled between resolutions.
+"""
+
+import bisect
+import time
+from array import array
+from datetime import datetime
+from typing import Iterator
+
+QUARTER_HOUR = 15 * 60
+HOUR = 60 * 60
+
+
+def _epoch(date_str: str) -> int:
+    return int(datetime.fromisoformat(date_str).timestamp())
+
+
+class PriceSeries:
+    """Prices per time slot, sorted by the start of the slot."""
+
+    __slots__ = ("timestamps", "prices", "resolution")
+
+    def __init__(
+        self,
+        timestamps: "array[int]",
+        prices: "array[float]",
+        resolution: int = HOUR,
+    ) -> None:
+        """Initialize PriceSeries.
+
+        Args:
+            timestamps (array[int]): Start of each slot (epoch seconds), sorted.
+            prices (array[float]): The price for each slot.
+            resolution (int): The length of a slot in seconds.
+        """
+        self.timestamps = timestamps
+        self.prices = prices
+        self.resolution = resolution
+
+    @classmethod
+    def from_price_info(cls, price_info: dict[str, float]) -> "PriceSeries":
+        """Create a PriceSeries from the price dict returned by Tibber.
+
+        Tibber returns the slots in order and without gaps, so only the first,
+        second and last timestamps are parsed. Should the slots not be evenly
+        spaced, every timestamp is parsed.
+
+        Args:
+            price_info (dict[str, float]): Prices keyed by ISO 8601 time.
+
+        Returns:
+            PriceSeries: The prices.
+        """
+        keys = list(price_info)
+        prices = array("d", price_info.values())
+        if not keys:
+            return cls(array("q"), prices)
+        first = _epoch(keys[0])
+        if len(keys) == 1:
+            return cls(array("q", [first]), prices)
+        step = _epoch(keys[1]) - first
+        last = _epoch(keys[-1])
+        if step > 0 and last == first + (len(keys) - 1) * step:
+            return cls(array("q", range(first, last + 1, step)), prices, step)
+
+        entries = sorted((_epoch(key), price) for key, price in price_info.items())
+        timestamps = array("q", (t for t, _ in entries))
+        step = min(b - a for a, b in zip(timestamps, timestamps[1:]))
+        return cls(timestamps, array("d", (p for _, p in entries)), max(step, 1))
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    def items(self) -> Iterator[tuple[int, float]]:
+        """Iterate over (slot start, price) pairs."""
+        return zip(self.timestamps, self.prices)
+
+    def slot_index(self, timestamp: float) -> int:
+        """Return the index of the slot that contains timestamp, -1 if none."""
+        index = bisect.bisect_right(self.timestamps, timestamp) - 1
+        if index < 0 or timestamp >= self.timestamps[index] + self.resolution:
+            return -1
+        return index
+
+    def current(self, now: float | None = None) -> float | None:
+        """Return the price right now, None if it is not known."""
+        index = self.slot_index(time.time() if now is None else now)
+        return self.prices[index] if index >= 0 else None
+
+    def future(self, now: float | None = None) -> "PriceSeries":
+        """Return the slots that start after now."""
+        if now is None:
+            now = time.time()
+        index = bisect.bisect_right(self.timestamps, now)
+        return PriceSeries(
+            self.timestamps[index:], self.prices[index:], self.resolution
+        )
+
+    def resample(self, resolution: int) -> "PriceSeries":
+        """Return the series with another resolution.
+
+        Going to a coarser resolution averages the prices of the slots that
+        start within each new slot. Going to a finer resolution repeats the
+        price of each slot.
+
+        Args:
+            resolution (int): The new slot length in seconds, e.g. HOUR.
+
+        Returns:
+            PriceSeries: The resampled series.
+
+        Raises:
+            ValueError: If one resolution is not a multiple of the other.
+        """
+        if resolution == self.resolution:
+            return self
+        finer, coarser = sorted((resolution, self.resolution))
+        if finer <= 0 or coarser % finer:
+            raise ValueError(
+                f"Cannot resample {self.resolution} s slots to {resolution} s"
+            )
+        timestamps: array[int] = array("q")
+        prices: array[float] = array("d")
+        if resolution < self.resolution:
+            repeat = self.resolution // resolution
+            for timestamp, price in self.items():
+                end = timestamp + self.resolution
+                timestamps.extend(range(timestamp, end, resolution))
+                prices.extend([price] * repeat)
+            return PriceSeries(timestamps, prices, resolution)
+
+        total = 0.0
+        count = 0
+        for timestamp, price in self.items():
+            start = timestamp - timestamp % resolution
+            if timestamps and timestamps[-1] == start:
+                total += price
+                count += 1
+                continue
+            if count:
+                prices.append(total / count)
+            timestamps.append(start)
+            total = price
+            count = 1
+        if count:
+            prices.append(total / count)
+        return PriceSeries(timestamps, prices, resolution)
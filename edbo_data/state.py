@@ -0,0 +1,29 @@
+"""Location of the files edbo_data keeps between runs.
+
+The directory can be set with ``state_dir`` in the ``[GENERAL]`` section of
+the configuration file. It defaults to ``$XDG_STATE_HOME/edbo_data``.
+"""
+
+import os
+from pathlib import Path
+
+from python_support.configuration import MyConfig  # type: ignore
+
+
+def state_dir(config: MyConfig | None = None) -> Path:
+    """Return the state directory, creating it if needed.
+
+    Args:
+        config (MyConfig | None): The configuration, if any.
+
+    Returns:
+        Path: The state directory.
+    """
+    configured = getattr(config, "general_state_dir", "") if config else ""
+    if configured:
+        path = Path(configured).expanduser()
+    else:
+        base = os.environ.get("XDG_STATE_HOME") or "~/.local/state"
+        path = Path(base).expanduser() / "edbo_data"
+    path.mkdir(parents=True, exist_ok=True)
+    return path
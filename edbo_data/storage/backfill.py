@@ -0,0 +1,181 @@
+"""Backfill the consumption history from Tibber.
+
+The period to backfill is split in chunks, one page of the Tibber
+consumption connection each. Tibber cursors are the base64 encoded start
+time of a node, so the cursor for every chunk can be computed up front and
+all chunks fetched concurrently. Chunks that have been stored are recorded
+in the database and skipped when the backfill is run again.
+
+Every request goes through RateLimiter.call(), so the requests keep the
+Tibber rate limit and failed requests are retried like the other Tibber
+requests.
+"""
+
+import asyncio
+import base64
+import logging
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Any, Callable, Coroutine
+from zoneinfo import ZoneInfo
+
+from ..fetching.rate_limit import RateLimiter
+from .history import HistoryStore
+
+if TYPE_CHECKING:
+    from ..fetching.fetch_tibber import FetchTibber
+
+RESOLUTIONS = ("HOURLY", "DAILY", "MONTHLY")
+TIMEZONE = ZoneInfo("Europe/Stockholm")
+
+# Number of days in a chunk for each resolution
+_CHUNK_DAYS = {"HOURLY": 30, "DAILY": 365}
+
+
+@dataclass(frozen=True)
+class Chunk:
+    resolution: str
+    start: datetime
+    end: datetime
+    size: int
+
+    @property
+    def cursor(self) -> str:
+        """Cursor pointing at the node before the first node of the chunk."""
+        previous = _step_back(self.resolution, self.start)
+        encoded = previous.isoformat(timespec="milliseconds").encode()
+        return base64.b64encode(encoded).decode()
+
+    @property
+    def key(self) -> int:
+        return int(self.start.timestamp())
+
+
+def _step_back(resolution: str, start: datetime) -> datetime:
+    match resolution:
+        case "HOURLY":
+            utc = start.astimezone(timezone.utc) - timedelta(hours=1)
+            return utc.astimezone(TIMEZONE)
+        case "DAILY":
+            return start - timedelta(days=1)
+        case "MONTHLY":
+            return _add_months(start, -1)
+        case _:
+            raise ValueError(f"Unknown resolution: {resolution}")
+
+
+def _add_months(date: datetime, months: int) -> datetime:
+    month = date.month - 1 + months
+    return date.replace(year=date.year + month // 12, month=month % 12 + 1)
+
+
+def chunks(resolution: str, start: datetime, end: datetime) -> list[Chunk]:
+    """Split [start, end) in chunks for a resolution.
+
+    Args:
+        resolution (str): One of RESOLUTIONS.
+        start (datetime): Start of the period, rounded down to midnight (and
+            the first of the month for MONTHLY).
+        end (datetime): End of the period.
+
+    Returns:
+        list[Chunk]: The chunks.
+    """
+    start = start.astimezone(TIMEZONE).replace(
+        hour=0, minute=0, second=0, microsecond=0
+    )
+    if resolution == "MONTHLY":
+        start = start.replace(day=1)
+        months = (end.year - start.year) * 12 + end.month - start.month + 1
+        return [Chunk(resolution, start, _add_months(start, months), months)]
+
+    days = _CHUNK_DAYS[resolution]
+    # A couple of extra nodes to cover DST changes, overlaps are deduplicated
+    size = days * 24 + 2 if resolution == "HOURLY" else days + 1
+    result = []
+    chunk_start = start
+    while chunk_start < end:
+        chunk_end = chunk_start + timedelta(days=days)
+        result.append(Chunk(resolution, chunk_start, chunk_end, size))
+        chunk_start = chunk_end
+    return result
+
+
+class ConsumptionBackfill:
+    """Fetch years of consumption and cost into the history database."""
+
+    def __init__(
+        self,
+        fetch_tibber: "FetchTibber",
+        store: HistoryStore,
+        rate_limiter: RateLimiter | None = None,
+        concurrency: int = 4,
+        logger: logging.Logger | None = None,
+    ) -> None:
+        """Initialize ConsumptionBackfill.
+
+        Args:
+            fetch_tibber (FetchTibber): Used for the Tibber requests.
+            store (HistoryStore): Where the consumption is stored.
+            rate_limiter (RateLimiter | None): Keeps the requests within the
+                Tibber rate limit.
+            concurrency (int): The maximum number of requests in flight.
+        """
+        self._fetch_tibber = fetch_tibber
+        self._store = store
+        self._limiter = rate_limiter
+        self._concurrency = concurrency
+        self._log = logger if logger is not None else logging.getLogger(__name__)
+
+    def run(
+        self,
+        start: datetime,
+        resolutions: tuple[str, ...] = RESOLUTIONS,
+        end: datetime | None = None,
+    ) -> int:
+        """Backfill the consumption from start until end.
+
+        Args:
+            start (datetime): The first day to backfill.
+            resolutions (tuple[str, ...]): The resolutions to backfill.
+            end (datetime | None): Defaults to now.
+
+        Returns:
+            int: The number of nodes stored.
+        """
+        until = end if end is not None else datetime.now(TIMEZONE)
+        todo = {}
+        for resolution in resolutions:
+            for chunk in chunks(resolution, start, until):
+                if self._store.chunk_done(resolution, chunk.key):
+                    continue
+                todo[(resolution, chunk.cursor, chunk.size)] = chunk
+        self._log.info(f"Backfilling {len(todo)} chunks of consumption data")
+
+        stored = 0
+
+        def on_page(page: tuple[str, str, int], nodes: list[dict[str, Any]]) -> None:
+            nonlocal stored
+            chunk = todo[page]
+            stored += self._store.add_consumption(chunk.resolution, nodes)
+            # The chunk that is still ongoing will get more data later
+            if chunk.end <= until:
+                self._store.mark_chunk_done(chunk.resolution, chunk.key)
+
+        self._fetch_tibber.get_consumption_pages(
+            list(todo), on_page, self._concurrency, self._request
+        )
+        self._log.info(f"Stored {stored} consumption nodes")
+        return stored
+
+    async def _request(self, execute: Callable[[], Coroutine[Any, Any, Any]]) -> Any:
+        if self._limiter is None:
+            return await execute()
+        loop = asyncio.get_running_loop()
+
+        def call() -> Any:
+            # The limiter waits and retries in a worker thread, the requests
+            # run in the event loop that holds the Tibber connection
+            return asyncio.run_coroutine_threadsafe(execute(), loop).result()
+
+        return await asyncio.to_thread(self._limiter.call, "tibber", call)
@@ -0,0 +1,235 @@
+"""Export the history as Parquet files for analysis.
+
+The history is written as three datasets, each a directory of Parquet
+files partitioned by source and month (UTC) in the hive layout, e.g.
+``samples/source=indoor/month=2025-03/part-0.parquet``:
+
+- samples: one row per sample time, with a float64 column per series of
+  the source, e.g. temperature and co2 for indoor.
+- hourly: the hourly rollups, with <series>_count, _min, _max, _mean and
+  _sum columns.
+- consumption: the consumption backfilled from Tibber (source tibber),
+  with the resolution as a column.
+
+The source is the first part of the series name. Times are timestamp
+columns in UTC. The exported range is widened to whole months, so that
+exporting again rewrites complete partitions.
+
+The files can be read with pandas, polars or DuckDB. read() memory maps
+the files and only reads the columns, sources and months it needs.
+
+pyarrow is an optional dependency, ``pip install edbo_data[export]``.
+"""
+
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from .history import HOUR, HistoryStore
+
+if TYPE_CHECKING:
+    import pyarrow  # type: ignore
+
+DATASETS = ("samples", "hourly", "consumption")
+_CONSUMPTION_COLUMNS = (
+    "resolution",
+    "start",
+    "end",
+    "consumption",
+    "cost",
+    "unit_price",
+    "unit_price_vat",
+)
+
+# {(source, month): {row key: {column: value}}}, the rows are sorted by key
+_Partitions = dict[tuple[str, str], dict[Any, dict[str, Any]]]
+
+
+def _pyarrow() -> Any:
+    try:
+        import pyarrow
+        import pyarrow.dataset  # type: ignore
+        import pyarrow.fs  # type: ignore
+        import pyarrow.parquet  # type: ignore
+    except ImportError as e:
+        raise ImportError(
+            "Exporting needs pyarrow, install it with: pip install edbo_data[export]"
+        ) from e
+    return pyarrow
+
+
+def _month(timestamp: int) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m")
+
+
+def _month_start(timestamp: int, months: int = 0) -> int:
+    """Return the start of the month of timestamp, months later."""
+    date = datetime.fromtimestamp(timestamp, timezone.utc)
+    index = date.year * 12 + date.month - 1 + months
+    start = datetime(index // 12, index % 12 + 1, 1, tzinfo=timezone.utc)
+    return int(start.timestamp())
+
+
+def _split(series: str) -> tuple[str, str]:
+    source, _, name = series.partition(".")
+    return source, name.replace(".", "_") or "value"
+
+
+class ParquetExporter:
+    """Write the history database as partitioned Parquet datasets."""
+
+    def __init__(self, store: HistoryStore, directory: Path) -> None:
+        """Initialize ParquetExporter.
+
+        Args:
+            store (HistoryStore): The history to export.
+            directory (Path): Where the datasets are written.
+        """
+        self._pa = _pyarrow()
+        self._store = store
+        self._directory = directory
+
+    def export(self, start: int = 0, end: int | None = None) -> list[Path]:
+        """Export the history in [start, end).
+
+        Args:
+            start (int): Start of the range (epoch).
+            end (int | None): End of the range (epoch), defaults to all.
+
+        Returns:
+            list[Path]: The files written.
+        """
+        start = _month_start(start)
+        end = 2**62 if end is None else _month_start(end - 1, months=1)
+        samples: _Partitions = {}
+        hourly: _Partitions = {}
+        for series in self._store.series_names():
+            source, column = _split(series)
+            for timestamp, value in self._store.raw_samples(series, start, end):
+                row = samples.setdefault((source, _month(timestamp)), {})
+                row.setdefault(timestamp, {})[column] = value
+            for aggregate in self._store.rollup(series, HOUR, start, end):
+                row = hourly.setdefault((source, _month(aggregate.start)), {})
+                row.setdefault(aggregate.start, {}).update(
+                    {
+                        f"{column}_count": aggregate.samples,
+                        f"{column}_min": aggregate.min,
+                        f"{column}_max": aggregate.max,
+                        f"{column}_mean": aggregate.mean,
+                        f"{column}_sum": aggregate.sum,
+                    }
+                )
+        consumption: _Partitions = {}
+        for consumption_row in self._store.consumption_rows(start, end):
+            values = dict(zip(_CONSUMPTION_COLUMNS, consumption_row))
+            partition = consumption.setdefault(("tibber", _month(values["start"])), {})
+            partition[(values["resolution"], values["start"])] = values
+
+        written = self._write("samples", samples, "time")
+        written += self._write("hourly", hourly, "time")
+        written += self._write("consumption", consumption, None)
+        return written
+
+    def _write(
+        self, dataset: str, partitions: _Partitions, time_column: str | None
+    ) -> list[Path]:
+        pa = self._pa
+        written = []
+        for (source, month), rows in sorted(partitions.items()):
+            keys = sorted(rows)
+            columns: dict[str, Any] = {}
+            if time_column is not None:
+                columns[time_column] = pa.array(keys, pa.timestamp("s", tz="UTC"))
+            names = sorted({name for row in rows.values() for name in row})
+            for name in names:
+                values = [rows[key].get(name) for key in keys]
+                columns[name] = pa.array(values, self._type(name))
+            path = self._directory / dataset / f"source={source}" / f"month={month}"
+            path.mkdir(parents=True, exist_ok=True)
+            tmp_path = path / f".part-0.{os.getpid()}.tmp"
+            pa.parquet.write_table(pa.table(columns), tmp_path)
+            os.replace(tmp_path, path / "part-0.parquet")
+            written.append(path / "part-0.parquet")
+        return written
+
+    def _type(self, name: str) -> Any:
+        pa = self._pa
+        if name in ("start", "end"):
+            return pa.timestamp("s", tz="UTC")
+        if name == "resolution":
+            return pa.dictionary(pa.int8(), pa.string())
+        if name.endswith("_count"):
+            return pa.int64()
+        return pa.float64()
+
+
+def read(
+    directory: Path,
+    dataset: str = "samples",
+    source: str | None = None,
+    columns: list[str] | None = None,
+    start: datetime | None = None,
+    end: datetime | None = None,
+) -> "pyarrow.Table":
+    """Read an exported dataset as an Arrow table.
+
+    The files are memory mapped. Only the partitions of the source and the
+    months in the time range are opened and only the columns asked for are
+    read.
+
+    Args:
+        directory (Path): Where the datasets were exported.
+        dataset (str): One of DATASETS.
+        source (str | None): Only read this source, e.g. indoor.
+        columns (list[str] | None): The columns to read, defaults to all.
+            The time column is always included.
+        start (datetime | None): Only rows at or after this time.
+        end (datetime | None): Only rows before this time.
+
+    Returns:
+        pyarrow.Table: The rows, with source and month columns.
+    """
+    if dataset not in DATASETS:
+        raise ValueError(f"Unknown dataset: {dataset}")
+    pa = _pyarrow()
+    ds = pa.dataset
+    time_column = "start" if dataset == "consumption" else "time"
+    filesystem = pa.fs.LocalFileSystem(use_mmap=True)
+    files = ds.dataset(
+        str(directory / dataset),
+        format="parquet",
+        partitioning="hive",
+        filesystem=filesystem,
+    )
+    # Series can be added over time, so the months can have different columns
+    in_source = None if source is None else ds.field("source") == source
+    fragments = files.get_fragments(filter=in_source)
+    schema = pa.unify_schemas(
+        [files.partitioning.schema, *(f.physical_schema for f in fragments)]
+    )
+    files = ds.dataset(
+        str(directory / dataset),
+        schema=schema,
+        format="parquet",
+        partitioning="hive",
+        filesystem=filesystem,
+    )
+
+    condition = None
+
+    def add(expression: Any) -> None:
+        nonlocal condition
+        condition = expression if condition is None else condition & expression
+
+    if source is not None:
+        add(ds.field("source") == source)
+    if start is not None:
+        add(ds.field("month") >= _month(int(start.timestamp())))
+        add(ds.field(time_column) >= pa.scalar(start, pa.timestamp("s", tz="UTC")))
+    if end is not None:
+        add(ds.field("month") <= _month(int(end.timestamp())))
+        add(ds.field(time_column) < pa.scalar(end, pa.timestamp("s", tz="UTC")))
+    if columns is not None and time_column not in columns:
+        columns = [time_column, *columns]
+    return files.to_table(columns=columns, filter=condition)
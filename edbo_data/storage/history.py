@@ -0,0 +1,440 @@
+"""Local history of the collected data.
+
+The history is kept in an SQLite database in the state directory. Rows are
+keyed by their start time, so storing the same data twice only updates
+the existing rows.
+
+Besides the Tibber consumption, the numbers of every snapshot are kept as
+samples of named series, e.g. indoor.temperature. compact() rolls the
+samples up into hourly and daily count/min/max/sum aggregates and deletes
+samples older than the retention time once they are rolled up. The hours
+and days are in UTC. aggregates() answers a range query from the coarsest
+level that has the requested resolution.
+
+Each forecast run is kept as well, with the time it was fetched, so that
+the forecast known at a point in time can be found again.
+"""
+
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterable, NamedTuple
+
+from python_support.configuration import MyConfig  # type: ignore
+
+from ..state import state_dir
+
+HISTORY_FILE = "history.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS consumption (
+    resolution TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER,
+    consumption REAL,
+    cost REAL,
+    unit_price REAL,
+    unit_price_vat REAL,
+    PRIMARY KEY (resolution, start)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS backfill_progress (
+    resolution TEXT NOT NULL,
+    chunk_start INTEGER NOT NULL,
+    PRIMARY KEY (resolution, chunk_start)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS samples (
+    series TEXT NOT NULL,
+    time INTEGER NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (series, time)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollups (
+    series TEXT NOT NULL,
+    resolution INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    min REAL,
+    max REAL,
+    sum REAL,
+    PRIMARY KEY (series, resolution, start)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS forecasts (
+    issued INTEGER NOT NULL,
+    parameter TEXT NOT NULL,
+    valid INTEGER NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (issued, parameter, valid)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS compaction (
+    level TEXT PRIMARY KEY,
+    done_until INTEGER NOT NULL
+) WITHOUT ROWID;
+"""
+
+HOUR = 3600
+DAY = 86400
+# The rollup levels, coarsest first. Each level is made from the next.
+ROLLUPS = (DAY, HOUR)
+RAW_RETENTION = 30 * DAY
+
+
+class Aggregate(NamedTuple):
+    """Aggregate of the samples in [start, start + resolution)."""
+
+    start: int
+    samples: int
+    min: float
+    max: float
+    sum: float
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.samples
+
+
+def history_path(config: MyConfig | None = None) -> Path:
+    """Return the path to the history database."""
+    return state_dir(config) / HISTORY_FILE
+
+
+def _epoch(date_str: str | None) -> int | None:
+    if date_str is None:
+        return None
+    return int(datetime.fromisoformat(date_str).timestamp())
+
+
+class HistoryStore:
+    """Read and write the history database."""
+
+    def __init__(self, path: Path) -> None:
+        """Initialize HistoryStore, creating the database if needed.
+
+        Args:
+            path (Path): The database file.
+        """
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.executescript(_SCHEMA)
+
+    def add_consumption(self, resolution: str, nodes: list[dict[str, Any]]) -> int:
+        """Store consumption nodes from Tibber.
+
+        Args:
+            resolution (str): The resolution of the nodes, e.g. HOURLY.
+            nodes (list[dict[str, Any]]): Nodes with from, to, consumption,
+                cost, unitPrice and unitPriceVAT.
+
+        Returns:
+            int: The number of nodes stored.
+        """
+        rows = [
+            (
+                resolution,
+                _epoch(node["from"]),
+                _epoch(node.get("to")),
+                node.get("consumption"),
+                node.get("cost"),
+                node.get("unitPrice"),
+                node.get("unitPriceVAT"),
+            )
+            for node in nodes
+        ]
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO consumption VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+        return len(rows)
+
+    def consumption(
+        self, resolution: str, start: int, end: int
+    ) -> list[tuple[int, float | None, float | None]]:
+        """Return (start, consumption, cost) rows in [start, end)."""
+        cursor = self._db.execute(
+            "SELECT start, consumption, cost FROM consumption "
+            "WHERE resolution = ? AND start >= ? AND start < ? ORDER BY start",
+            (resolution, start, end),
+        )
+        return cursor.fetchall()
+
+    def chunk_done(self, resolution: str, chunk_start: int) -> bool:
+        cursor = self._db.execute(
+            "SELECT 1 FROM backfill_progress WHERE resolution = ? AND chunk_start = ?",
+            (resolution, chunk_start),
+        )
+        return cursor.fetchone() is not None
+
+    def mark_chunk_done(self, resolution: str, chunk_start: int) -> None:
+        with self._db:
+            self._db.execute(
+                "INSERT OR IGNORE INTO backfill_progress VALUES (?, ?)",
+                (resolution, chunk_start),
+            )
+
+    def add_samples(self, samples: Iterable[tuple[str, int, float]]) -> None:
+        """Store (series, time, value) samples, time in epoch seconds."""
+        rows = list(samples)
+        if not rows:
+            return
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO samples VALUES (?, ?, ?)", rows
+            )
+            # The oldest sample that has not been rolled up, see compact()
+            self._db.execute(
+                "INSERT INTO compaction VALUES ('pending', ?) ON CONFLICT(level) "
+                "DO UPDATE SET done_until = MIN(done_until, excluded.done_until)",
+                (min(row[1] for row in rows),),
+            )
+
+    def add_forecast(
+        self, issued: int, forecast: Iterable[tuple[str, int, float]]
+    ) -> None:
+        """Store a forecast run of (parameter, valid time, value).
+
+        Args:
+            issued (int): When the run was fetched (epoch).
+            forecast (Iterable[tuple[str, int, float]]): The values of the run.
+        """
+        with self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO forecasts VALUES (?, ?, ?, ?)",
+                (
+                    (issued, parameter, valid, value)
+                    for parameter, valid, value in forecast
+                ),
+            )
+
+    def forecasts(self, start: int, end: int) -> list[tuple[int, str, int, float]]:
+        """Return the forecast runs in use in [start, end).
+
+        These are the runs issued in the range and the last run issued
+        before it.
+
+        Returns:
+            list[tuple[int, str, int, float]]: (issued, parameter, valid
+                time, value) sorted by issue and valid time.
+        """
+        cursor = self._db.execute(
+            "SELECT issued, parameter, valid, value FROM forecasts WHERE issued >= "
+            "COALESCE((SELECT MAX(issued) FROM forecasts WHERE issued <= ?), ?) "
+            "AND issued < ? ORDER BY issued, valid",
+            (start, start, end),
+        )
+        return cursor.fetchall()
+
+    def compact(
+        self, now: float | None = None, raw_retention: float = RAW_RETENTION
+    ) -> None:
+        """Roll up the samples and delete the old ones.
+
+        Only whole hours and days are rolled up. The buckets that got
+        samples since the last compaction are rolled up again, so samples
+        that arrive late, like the consumption from Tibber, are included.
+        Samples older than the retention time when they arrive are not.
+
+        Args:
+            now (float | None): The current time (epoch), defaults to now.
+            raw_retention (float): Seconds that samples are kept.
+        """
+        if now is None:
+            now = time.time()
+        with self._db:
+            pending = self._pending()
+            if pending is not None:
+                # The hours partly deleted can not be rolled up again
+                purged = self._done_until("samples")
+                pending = max(pending, -(-purged // HOUR) * HOUR)
+            source = "samples"
+            for resolution in reversed(ROLLUPS):
+                level = str(resolution)
+                done_until = self._done_until(level)
+                start = max(0, done_until - resolution)
+                if pending is not None:
+                    start = min(start, pending // resolution * resolution)
+                end = int(now) // resolution * resolution
+                if source == "samples":
+                    select = (
+                        "SELECT series, ?, time / ? * ?, COUNT(value), "
+                        "MIN(value), MAX(value), SUM(value) FROM samples "
+                        "WHERE time >= ? AND time < ? GROUP BY series, time / ?"
+                    )
+                    parameters: tuple[int, ...] = (start, end)
+                else:
+                    select = (
+                        "SELECT series, ?, start / ? * ?, SUM(count), MIN(min), "
+                        "MAX(max), SUM(sum) FROM rollups WHERE start >= ? "
+                        "AND start < ? AND resolution = ? GROUP BY series, start / ?"
+                    )
+                    parameters = (start, end, int(source))
+                self._db.execute(
+                    f"INSERT OR REPLACE INTO rollups {select}",
+                    (resolution,) * 3 + parameters + (resolution,),
+                )
+                self._set_done_until(level, max(done_until, end))
+                source = level
+            # Samples after end are in the buckets rolled up again next time
+            self._db.execute("DELETE FROM compaction WHERE level = 'pending'")
+            # Keep the samples that have not been rolled up
+            purge_until = min(int(now - raw_retention), self._done_until(str(HOUR)))
+            if purge_until > self._done_until("samples"):
+                self._db.execute("DELETE FROM samples WHERE time < ?", (purge_until,))
+                self._set_done_until("samples", purge_until)
+
+    def aggregates(
+        self, series: str, start: int, end: int, resolution: int = 0
+    ) -> list[Aggregate]:
+        """Return the aggregates of a series in [start, end).
+
+        The coarsest rollup whose resolution evenly divides the requested
+        one is used. The parts of the range it does not cover, partial
+        buckets at the ends included, are taken from finer levels, and
+        samples that have been deleted are taken from the hourly rollup.
+
+        Args:
+            series (str): The name of the series.
+            start (int): Start of the range (epoch).
+            end (int): End of the range (epoch).
+            resolution (int): Seconds per aggregate, zero for every sample.
+
+        Returns:
+            list[Aggregate]: The aggregates sorted by start.
+        """
+        levels = [r for r in ROLLUPS if resolution > 0 and resolution % r == 0]
+        pieces = self._pieces(levels, start, end)
+
+        buckets: dict[int, Aggregate] = {}
+        for level, piece_start, piece_end in pieces:
+            rows = self._aggregate(level, series, piece_start, piece_end, resolution)
+            for row in rows:
+                aggregate = Aggregate(*row)
+                previous = buckets.get(aggregate.start)
+                if previous is not None:
+                    aggregate = Aggregate(
+                        aggregate.start,
+                        previous.samples + aggregate.samples,
+                        min(previous.min, aggregate.min),
+                        max(previous.max, aggregate.max),
+                        previous.sum + aggregate.sum,
+                    )
+                buckets[aggregate.start] = aggregate
+        return [buckets[key] for key in sorted(buckets)]
+
+    def _pieces(
+        self, levels: list[int], start: int, end: int
+    ) -> list[tuple[str, int, int]]:
+        """Split [start, end) into (level, start, end) pieces to read.
+
+        A rollup only covers whole buckets of its level. The parts of the
+        range before the first and after the last whole bucket, and after
+        what has been rolled up, are read from the finer levels.
+        """
+        if start >= end:
+            return []
+        if not levels:
+            # Deleted samples are only left in the hourly rollup, whose
+            # hours are read as a whole
+            purged = -(-self._done_until("samples") // HOUR) * HOUR
+            if start >= purged:
+                return [("samples", start, end)]
+            pieces = [(str(HOUR), start // HOUR * HOUR, min(end, purged))]
+            if purged < end:
+                pieces.append(("samples", purged, end))
+            return pieces
+        level, *finer = levels
+        first = -(-start // level) * level
+        until = min(self._done_until(str(level)), end // level * level)
+        if first >= until:
+            return self._pieces(finer, start, end)
+        return [
+            *self._pieces(finer, start, first),
+            (str(level), first, until),
+            *self._pieces(finer, until, end),
+        ]
+
+    def _aggregate(
+        self, level: str, series: str, start: int, end: int, resolution: int
+    ) -> list[tuple[int, int, float, float, float]]:
+        if level == "samples" and resolution <= 0:
+            sql = (
+                "SELECT time, 1, value, value, value FROM samples "
+                "WHERE series = ? AND time >= ? AND time < ? ORDER BY time"
+            )
+            return self._db.execute(sql, (series, start, end)).fetchall()
+        # Without a resolution the hourly rollup is returned as it is
+        step = resolution if resolution > 0 else HOUR
+        if level == "samples":
+            sql = (
+                "SELECT time / ? * ?, COUNT(value), MIN(value), MAX(value), "
+                "SUM(value) FROM samples WHERE series = ? AND time >= ? "
+                "AND time < ? GROUP BY time / ? ORDER BY 1"
+            )
+            parameters: tuple[Any, ...] = (step, step, series, start, end, step)
+        else:
+            sql = (
+                "SELECT start / ? * ?, SUM(count), MIN(min), MAX(max), SUM(sum) "
+                "FROM rollups WHERE series = ? AND resolution = ? AND start >= ? "
+                "AND start < ? GROUP BY start / ? ORDER BY 1"
+            )
+            parameters = (step, step, series, int(level), start, end, step)
+        return self._db.execute(sql, parameters).fetchall()
+
+    def raw_samples(self, series: str, start: int, end: int) -> list[tuple[int, float]]:
+        """Return the (time, value) samples of a series in [start, end)."""
+        cursor = self._db.execute(
+            "SELECT time, value FROM samples "
+            "WHERE series = ? AND time >= ? AND time < ? ORDER BY time",
+            (series, start, end),
+        )
+        return cursor.fetchall()
+
+    def rollup(
+        self, series: str, resolution: int, start: int, end: int
+    ) -> list[Aggregate]:
+        """Return the rollups of a series at one of ROLLUPS in [start, end)."""
+        cursor = self._db.execute(
+            "SELECT start, count, min, max, sum FROM rollups WHERE series = ? "
+            "AND resolution = ? AND start >= ? AND start < ? ORDER BY start",
+            (series, resolution, start, end),
+        )
+        return [Aggregate(*row) for row in cursor.fetchall()]
+
+    def consumption_rows(self, start: int, end: int) -> list[tuple[Any, ...]]:
+        """Return all columns of the consumption rows in [start, end)."""
+        cursor = self._db.execute(
+            "SELECT * FROM consumption WHERE start >= ? AND start < ? "
+            "ORDER BY resolution, start",
+            (start, end),
+        )
+        return cursor.fetchall()
+
+    def series_names(self) -> list[str]:
+        """Return the names of the stored series."""
+        cursor = self._db.execute(
+            "SELECT DISTINCT series FROM rollups UNION SELECT DISTINCT series "
+            "FROM samples ORDER BY 1"
+        )
+        return [name for (name,) in cursor.fetchall()]
+
+    def _pending(self) -> int | None:
+        cursor = self._db.execute(
+            "SELECT done_until FROM compaction WHERE level = 'pending'"
+        )
+        row = cursor.fetchone()
+        return int(row[0]) if row is not None else None
+
+    def _done_until(self, level: str) -> int:
+        cursor = self._db.execute(
+            "SELECT done_until FROM compaction WHERE level = ?", (level,)
+        )
+        row = cursor.fetchone()
+        return int(row[0]) if row is not None else 0
+
+    def _set_done_until(self, level: str, done_until: int) -> None:
+        self._db.execute(
+            "INSERT OR REPLACE INTO compaction VALUES (?, ?)", (level, done_until)
+        )
+
+    def close(self) -> None:
+        self._db.close()
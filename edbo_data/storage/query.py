@@ -0,0 +1,146 @@
+"""Time range queries over the history database.
+
+The samples and rollups are stored by (series, time), so a query for one
+series over a time range is a range scan of the primary key. Resampled
+queries are answered from the rollups, see HistoryStore.aggregates().
+
+Buckets of whole days start at local midnight and weeks on Monday, so a
+daily query gives the days of the calendar. They are made from the hourly
+aggregates, which are in UTC, so with a time zone that is not a whole
+number of hours from UTC an hour is counted in the day it starts in.
+Shorter buckets are in UTC like the rollups.
+
+The consumption and cost backfilled from Tibber are available as the
+series tibber.consumption and tibber.cost. They are read from the hourly
+rows, and for days and weeks also from the daily rows of the days without
+hourly rows.
+"""
+
+import re
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Iterable
+
+from .history import DAY, HOUR, Aggregate, HistoryStore
+
+# Series read from the consumption table instead of the samples
+TIBBER_SERIES = {"tibber.consumption": 1, "tibber.cost": 2}
+
+AGGREGATIONS: dict[str, Callable[[Aggregate], float]] = {
+    "mean": lambda a: a.mean,
+    "min": lambda a: a.min,
+    "max": lambda a: a.max,
+    "sum": lambda a: a.sum,
+    "count": lambda a: a.samples,
+}
+
+_UNITS = {"s": 1, "m": 60, "h": HOUR, "d": DAY, "w": 7 * DAY}
+_DURATION = re.compile(r"(\d+)([smhdw])")
+
+# The day buckets are counted from a Monday, so that weeks start on Monday
+_MONDAY = date(1970, 1, 5)
+
+
+def parse_duration(text: str) -> int:
+    """Parse a duration like 15m, 1h, 1d or 2w into seconds. raw gives 0."""
+    if text == "raw":
+        return 0
+    match = _DURATION.fullmatch(text)
+    if match is None:
+        raise ValueError(f"Invalid duration: {text}, use e.g. 15m, 1h, 1d or 1w")
+    return int(match.group(1)) * _UNITS[match.group(2)]
+
+
+def parse_time(text: str, now: float | None = None) -> int:
+    """Parse an ISO date or time, or a duration back from now, e.g. 7d."""
+    if now is None:
+        now = time.time()
+    if _DURATION.fullmatch(text):
+        return int(now) - parse_duration(text)
+    return int(datetime.fromisoformat(text).timestamp())
+
+
+def bucket_start(timestamp: int, resolution: int) -> int:
+    """Return the start of the bucket of timestamp.
+
+    Buckets of whole days start at local midnight, others are in UTC.
+    """
+    if resolution <= 0:
+        return timestamp
+    if resolution % DAY:
+        return timestamp // resolution * resolution
+    day = datetime.fromtimestamp(timestamp).date()
+    first = day - timedelta(days=(day - _MONDAY).days % (resolution // DAY))
+    return int(datetime.combine(first, datetime.min.time()).timestamp())
+
+
+def _merge(aggregates: Iterable[Aggregate], resolution: int) -> list[Aggregate]:
+    """Merge aggregates into the buckets of resolution."""
+    buckets: dict[int, Aggregate] = {}
+    for aggregate in aggregates:
+        start = bucket_start(aggregate.start, resolution)
+        previous = buckets.get(start)
+        if previous is not None:
+            aggregate = Aggregate(
+                start,
+                previous.samples + aggregate.samples,
+                min(previous.min, aggregate.min),
+                max(previous.max, aggregate.max),
+                previous.sum + aggregate.sum,
+            )
+        buckets[start] = aggregate._replace(start=start)
+    return [buckets[key] for key in sorted(buckets)]
+
+
+def _values(
+    rows: list[tuple[int, float | None, float | None]], column: int
+) -> list[tuple[int, float]]:
+    return [(row[0], value) for row in rows if (value := row[column]) is not None]
+
+
+def query(
+    store: HistoryStore, series: str, start: int, end: int, resolution: int = 0
+) -> list[Aggregate]:
+    """Return the aggregates of a series in [start, end).
+
+    Args:
+        store (HistoryStore): The history database.
+        series (str): The name of the series.
+        start (int): Start of the range (epoch).
+        end (int): End of the range (epoch).
+        resolution (int): Seconds per aggregate, zero for every sample.
+
+    Returns:
+        list[Aggregate]: The aggregates sorted by start.
+    """
+    days = resolution > 0 and resolution % DAY == 0
+    if series not in TIBBER_SERIES:
+        if not days:
+            return store.aggregates(series, start, end, resolution)
+        return _merge(store.aggregates(series, start, end, HOUR), resolution)
+    column = TIBBER_SERIES[series]
+    values = _values(store.consumption("HOURLY", start, end), column)
+    if days:
+        with_hours = {bucket_start(timestamp, DAY) for timestamp, _ in values}
+        values += [
+            (timestamp, value)
+            for timestamp, value in _values(
+                store.consumption("DAILY", start, end), column
+            )
+            if bucket_start(timestamp, DAY) not in with_hours
+        ]
+    return _merge(
+        (Aggregate(timestamp, 1, value, value, value) for timestamp, value in values),
+        resolution,
+    )
+
+
+def rows(aggregates: list[Aggregate], functions: list[str]) -> list[dict[str, Any]]:
+    """Return a row per aggregate with its local start time and the functions."""
+    return [
+        {
+            "time": datetime.fromtimestamp(aggregate.start).isoformat(),
+            **{name: AGGREGATIONS[name](aggregate) for name in functions},
+        }
+        for aggregate in aggregates
+    ]
@@ -0,0 +1,145 @@
+import asyncio
+import base64
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+import pytest
+
+from edbo_data.fetching.rate_limit import RateLimit, RateLimiter
+from edbo_data.storage.backfill import TIMEZONE, ConsumptionBackfill, chunks
+from edbo_data.storage.history import HistoryStore
+
+Page = tuple[str, str, int]
+
+
+def decode(cursor: str) -> datetime:
+    return datetime.fromisoformat(base64.b64decode(cursor).decode())
+
+
+class Tibber:
+    """Stands in for FetchTibber, answers with the hours after the cursor."""
+
+    def __init__(self, failures: int = 0) -> None:
+        self.requests: list[Page] = []
+        self.failures = failures
+
+    def get_consumption_pages(
+        self,
+        pages: list[Page],
+        on_page: Callable[[Page, list[dict[str, Any]]], None],
+        concurrency: int = 4,
+        request: Any = None,
+    ) -> None:
+        async def fetch_page(page: Page) -> None:
+            async def execute() -> list[dict[str, Any]]:
+                self.requests.append(page)
+                if self.failures:
+                    self.failures -= 1
+                    raise ConnectionError("Tibber is down")
+                return nodes(page)
+
+            data = await (request(execute) if request is not None else execute())
+            on_page(page, data)
+
+        async def fetch_all() -> None:
+            await asyncio.gather(*(fetch_page(page) for page in pages))
+
+        asyncio.run(fetch_all())
+
+
+def nodes(page: Page) -> list[dict[str, Any]]:
+    resolution, cursor, first = page
+    assert resolution == "HOURLY"
+    previous = decode(cursor).astimezone(timezone.utc)
+    return [
+        {
+            "from": (previous + timedelta(hours=hour)).astimezone(TIMEZONE).isoformat(),
+            "consumption": 1.0,
+            "cost": 2.0,
+        }
+        for hour in range(1, first + 1)
+    ]
+
+
+@pytest.fixture
+def store(tmp_path: Path) -> Iterator[HistoryStore]:
+    history = HistoryStore(tmp_path / "history.sqlite")
+    yield history
+    history.close()
+
+
+START = datetime(2025, 1, 1, tzinfo=TIMEZONE)
+
+
+class TestChunks:
+
+    def test_hourly(self) -> None:
+        result = chunks("HOURLY", START, datetime(2025, 3, 5, tzinfo=TIMEZONE))
+        assert [chunk.start.date().isoformat() for chunk in result] == [
+            "2025-01-01",
+            "2025-01-31",
+            "2025-03-02",
+        ]
+        assert {chunk.size for chunk in result} == {30 * 24 + 2}
+        assert (
+            result[0].cursor
+            == base64.b64encode(b"2024-12-31T23:00:00.000+01:00").decode()
+        )
+
+    def test_hourly_cursor_across_dst(self) -> None:
+        start = datetime(2025, 3, 31, tzinfo=TIMEZONE)
+        (chunk,) = chunks("HOURLY", start, start + timedelta(days=1))
+        # Midnight is two hours from UTC, the hour before it only one
+        assert decode(chunk.cursor).isoformat() == "2025-03-30T23:00:00+02:00"
+
+    def test_daily_and_monthly(self) -> None:
+        end = datetime(2025, 6, 15, tzinfo=TIMEZONE)
+        (daily,) = chunks("DAILY", START + timedelta(hours=13), end)
+        assert decode(daily.cursor).isoformat() == "2024-12-31T00:00:00+01:00"
+        (monthly,) = chunks("MONTHLY", datetime(2025, 1, 20, tzinfo=TIMEZONE), end)
+        assert monthly.size == 6
+        assert decode(monthly.cursor).isoformat() == "2024-12-01T00:00:00+01:00"
+
+
+class TestConsumptionBackfill:
+
+    def test_resume(self, store: HistoryStore) -> None:
+        end = START + timedelta(days=60)
+        tibber = Tibber()
+        backfill = ConsumptionBackfill(tibber, store)
+        backfill.run(START, ("HOURLY",), end)
+        assert len(tibber.requests) == 2
+        hours = store.consumption(
+            "HOURLY", int(START.timestamp()), int(end.timestamp())
+        )
+        assert len(hours) == 60 * 24
+        # Both chunks are done, nothing is fetched again
+        tibber.requests.clear()
+        assert backfill.run(START, ("HOURLY",), end) == 0
+        assert tibber.requests == []
+
+    def test_ongoing_chunk_is_fetched_again(self, store: HistoryStore) -> None:
+        tibber = Tibber()
+        backfill = ConsumptionBackfill(tibber, store)
+        backfill.run(START, ("HOURLY",), START + timedelta(days=40))
+        tibber.requests.clear()
+        end = START + timedelta(days=45)
+        backfill.run(START, ("HOURLY",), end)
+        # Only the second chunk, which had not ended at the first run
+        second = chunks("HOURLY", START, end)[1]
+        assert [cursor for _, cursor, _ in tibber.requests] == [second.cursor]
+
+    def test_failed_requests_are_retried(
+        self, tmp_path: Path, store: HistoryStore
+    ) -> None:
+        limiter = RateLimiter(
+            tmp_path / "rate_limits",
+            {"tibber": RateLimit(rate=1000.0, burst=10)},
+            base_delay=0.0,
+        )
+        tibber = Tibber(failures=2)
+        backfill = ConsumptionBackfill(tibber, store, limiter)
+        end = START + timedelta(days=30)
+        assert backfill.run(START, ("HOURLY",), end) == 30 * 24 + 2
+        assert len(tibber.requests) == 3
@@ -0,0 +1,104 @@
+import json
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from edbo_data.collecting.batch import (
+    BatchCollector,
+    SiteConfig,
+    find_configs,
+    tenant_state_dir,
+)
+from edbo_data.fetching.fetch_all import FetchAll
+
+
+def write_config(directory: Path, tenant: str, latitude: float) -> Path:
+    path = directory / "sites" / f"{tenant}.ini"
+    path.parent.mkdir(exist_ok=True)
+    path.write_text(
+        "[GENERAL]\n"
+        f"state_dir = {directory / 'state' / tenant}\n"
+        "sources = smhi\n"
+        "[MAP]\n"
+        f"latitude = {latitude}\n"
+        "longitude = 18.0\n"
+        "[TIBBER]\n"
+        f"token = token-{tenant}\n"
+    )
+    return path
+
+
+class SMHI:
+    """Counts the SMHI downloads, fails when asked to."""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.fail = False
+        self._lock = threading.Lock()
+
+    def __call__(self) -> dict[str, Any]:
+        with self._lock:
+            self.calls += 1
+        if self.fail:
+            raise ConnectionError("SMHI is down")
+        valid_time = datetime(2025, 1, 17, tzinfo=timezone.utc)
+        return {"current": {"valid_time": valid_time, "temperature": -3.0}}
+
+
+@pytest.fixture
+def smhi(monkeypatch: pytest.MonkeyPatch) -> SMHI:
+    download = SMHI()
+    monkeypatch.setattr(FetchAll, "fetch_smhi", lambda self: download())
+    return download
+
+
+class TestConfigs:
+
+    def test_find_configs(self, tmp_path: Path) -> None:
+        a = write_config(tmp_path, "a", 59.0)
+        b = write_config(tmp_path, "b", 59.0)
+        (tmp_path / "sites" / ".hidden").write_text("")
+        single = tmp_path / "c.ini"
+        single.write_text("")
+        assert find_configs([str(tmp_path / "sites"), str(single)]) == [a, b, single]
+
+    def test_sites_keep_their_own_values(self, tmp_path: Path) -> None:
+        a = SiteConfig(write_config(tmp_path, "a", 59.0))
+        b = SiteConfig(write_config(tmp_path, "b", 60.0))
+        assert a.tibber_token == "token-a"
+        assert b.tibber_token == "token-b"
+        assert a.map_latitude == "59.0"
+        assert getattr(a, "netatmo_credentials", "") == ""
+
+    def test_tenant_state_dir(self, tmp_path: Path) -> None:
+        config = SiteConfig(write_config(tmp_path, "a", 59.0))
+        assert tenant_state_dir("a", config) == tmp_path / "state" / "a"
+
+
+class TestBatchCollector:
+
+    def test_smhi_shared_per_grid_point(self, tmp_path: Path, smhi: SMHI) -> None:
+        paths = [
+            write_config(tmp_path, tenant, latitude)
+            for tenant, latitude in (("a", 59.0), ("b", 59.0), ("c", 61.0))
+        ]
+        output = tmp_path / "output"
+        errors = BatchCollector(paths, output).run()
+        assert errors == {"a": None, "b": None, "c": None}
+        assert smhi.calls == 2
+        for tenant in "abc":
+            data = json.loads((output / f"{tenant}.json").read_text())
+            assert data["outdoor"]["current"]["temperature"] == -3.0
+
+    def test_smhi_through_the_circuit_breaker(self, tmp_path: Path, smhi: SMHI) -> None:
+        paths = [write_config(tmp_path, "a", 59.0)]
+        smhi.fail = True
+        for _ in range(4):
+            errors = BatchCollector(paths, tmp_path / "output").run()
+        # The breaker opens after three failures in a row
+        assert smhi.calls == 3
+        assert errors["a"] is not None and "Circuit open" in errors["a"]
+        assert (tmp_path / "state" / "a" / "circuit_breakers" / "smhi.json").exists()
@@ -0,0 +1,134 @@
+import math
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+from edbo_data.collecting.derived import MAX_GAP, DerivedMetrics, RollingWindow
+from edbo_data.collecting.values import consumption_time, lookup
+from edbo_data.storage.history import HOUR
+
+# 2025-01-17 00:00 UTC
+T0 = 1_737_072_000
+
+
+def outdoor(temperature: float) -> dict[str, Any]:
+    return {"outdoor": {"current": {"temperature": temperature}}}
+
+
+def degree_hours(samples: list[tuple[int, float]]) -> float:
+    metrics = DerivedMetrics(None, base_temperature=17.0)
+    for timestamp, temperature in samples:
+        metrics.update(outdoor(temperature), timestamp)
+    total: float = metrics.metrics(samples[-1][0])["degree_hours_total"]
+    return total
+
+
+class TestValues:
+
+    def test_lookup(self) -> None:
+        all_data = {"indoor": {"co2": 600, "noise": None}}
+        assert lookup(all_data, ("indoor", "co2")) == 600.0
+        assert math.isnan(lookup(all_data, ("indoor", "noise")))
+        assert math.isnan(lookup(all_data, ("outdoor", "current")))
+
+    def test_consumption_time_is_local(self) -> None:
+        local = datetime(2025, 1, 17, 13)
+        assert consumption_time("2025-01-17 13:00:00") == int(local.timestamp())
+
+
+class TestRollingWindow:
+
+    def test_values_leave_the_window(self) -> None:
+        rolling = RollingWindow(3 * HOUR)
+        for hour, value in enumerate((1.0, 2.0, 3.0)):
+            rolling.add(T0 + hour * HOUR + 60, value)
+        assert (rolling.sum, rolling.count, rolling.mean) == (6.0, 3, 2.0)
+        rolling.advance(T0 + 3 * HOUR)
+        assert (rolling.sum, rolling.count) == (5.0, 2)
+        rolling.advance(T0 + 10 * HOUR)
+        assert (rolling.sum, rolling.count, rolling.mean) == (0.0, 0, None)
+
+    def test_old_values_are_ignored(self) -> None:
+        rolling = RollingWindow(3 * HOUR)
+        rolling.add(T0 + 5 * HOUR, 1.0)
+        rolling.add(T0 + 2 * HOUR, 10.0)
+        rolling.add(T0 + 3 * HOUR, 2.0)
+        assert rolling.sum == 3.0
+
+    def test_bucket_sum(self) -> None:
+        rolling = RollingWindow(3 * HOUR)
+        rolling.add(T0, 1.0)
+        rolling.add(T0 + 600, 2.0)
+        assert rolling.bucket_sum(T0 + 1200) == 3.0
+        rolling.advance(T0 + 3 * HOUR)
+        assert rolling.bucket_sum(T0) == 0.0
+
+    def test_state(self) -> None:
+        rolling = RollingWindow(3 * HOUR)
+        rolling.add(T0, 1.5)
+        rolling.add(T0 + HOUR, 2.5)
+        loaded = RollingWindow(3 * HOUR)
+        loaded.load_state(rolling.to_state())
+        assert (loaded.sum, loaded.count) == (4.0, 2)
+        # A state of another length is not used
+        shorter = RollingWindow(2 * HOUR)
+        shorter.load_state(rolling.to_state())
+        assert shorter.count == 0
+
+
+class TestDegreeHours:
+
+    def test_trapezoid(self) -> None:
+        # A mean of 7 degrees, 10 below the base, for two hours
+        assert degree_hours([(T0, 5.0), (T0 + 2 * HOUR, 9.0)]) == 20.0
+
+    def test_above_the_base(self) -> None:
+        assert degree_hours([(T0, 18.0), (T0 + HOUR, 20.0)]) == 0.0
+
+    def test_gap_of_max_gap_is_counted(self) -> None:
+        assert degree_hours([(T0, 7.0), (T0 + MAX_GAP, 7.0)]) == 30.0
+
+    def test_longer_gap_is_not_counted(self) -> None:
+        samples = [(T0, 7.0), (T0 + MAX_GAP + 1, 7.0), (T0 + MAX_GAP + HOUR + 1, 7.0)]
+        assert degree_hours(samples) == 10.0
+
+    def test_missing_netatmo_value_is_skipped(self) -> None:
+        samples = [(T0, 7.0), (T0 + HOUR, -999.0), (T0 + 2 * HOUR, 7.0)]
+        assert degree_hours(samples) == 20.0
+
+
+class TestDerivedMetrics:
+
+    def test_windows(self) -> None:
+        metrics = DerivedMetrics(None)
+        for hour in range(25):
+            metrics.update(outdoor(float(hour)), T0 + hour * HOUR)
+        values = metrics.metrics(T0 + 24 * HOUR)
+        # The first hour has left the 24 hour window, not the 7 day one
+        assert values["24h"]["outdoor_temperature_mean"] == 12.5
+        assert values["7d"]["outdoor_temperature_mean"] == 12.0
+
+    def test_per_degree_hour(self) -> None:
+        metrics = DerivedMetrics(None, base_temperature=17.0)
+        metrics.update(outdoor(7.0), T0)
+        # The consumption of the hour with the 10 degree-hours
+        hour = datetime.fromtimestamp(T0 + HOUR).strftime("%Y-%m-%d %H:%M:%S")
+        all_data = {
+            **outdoor(7.0),
+            "energy": {"consumption": {hour: {"consumption": 5.0, "cost": 10.0}}},
+        }
+        values = metrics.update(all_data, T0 + HOUR)["24h"]
+        assert values["kwh_per_degree_hour"] == 0.5
+        assert values["cost_per_degree_hour"] == 1.0
+        assert values["cost_per_kwh"] == 2.0
+
+    def test_state_is_kept(self, tmp_path: Path) -> None:
+        path = tmp_path / "derived_metrics.json"
+        metrics = DerivedMetrics(path)
+        metrics.update(outdoor(7.0), T0)
+        metrics.update(outdoor(7.0), T0 + HOUR)
+        loaded = DerivedMetrics(path)
+        assert loaded.metrics(T0 + HOUR) == metrics.metrics(T0 + HOUR)
+        # Degree-hours against another base are not reused
+        other = DerivedMetrics(path, base_temperature=20.0)
+        assert other.metrics(T0 + HOUR)["degree_hours_total"] == 0.0
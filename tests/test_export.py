@@ -0,0 +1,87 @@
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+
+from edbo_data.storage.export import ParquetExporter, read
+from edbo_data.storage.history import DAY, HOUR, HistoryStore
+
+pytest.importorskip("pyarrow")
+
+# 2025-03-31 00:00 UTC, the samples cross into April
+T0 = int(datetime(2025, 3, 31, tzinfo=timezone.utc).timestamp())
+
+
+@pytest.fixture
+def exported(tmp_path: Path) -> Path:
+    store = HistoryStore(tmp_path / "history.sqlite")
+    store.add_samples(
+        (series, t, float(t - T0) / 600 + offset)
+        for series, offset in (("indoor.temperature", 0.0), ("indoor.co2", 400.0))
+        for t in range(T0, T0 + 2 * DAY, 600)
+    )
+    store.add_samples(
+        ("outdoor.temperature", t, -1.0) for t in range(T0, T0 + 2 * DAY, HOUR)
+    )
+    store.compact(now=T0 + 2 * DAY)
+    store.add_consumption(
+        "HOURLY",
+        [
+            {
+                "from": "2025-03-31T00:00:00+00:00",
+                "to": "2025-03-31T01:00:00+00:00",
+                "consumption": 1.5,
+                "cost": 3.0,
+            }
+        ],
+    )
+    ParquetExporter(store, tmp_path / "export").export()
+    store.close()
+    return tmp_path / "export"
+
+
+class TestParquetExport:
+
+    def test_partitions(self, exported: Path) -> None:
+        partitions = sorted(
+            str(path.relative_to(exported)) for path in exported.glob("samples/*/*")
+        )
+        assert partitions == [
+            "samples/source=indoor/month=2025-03",
+            "samples/source=indoor/month=2025-04",
+            "samples/source=outdoor/month=2025-03",
+            "samples/source=outdoor/month=2025-04",
+        ]
+
+    def test_samples_round_trip(self, exported: Path) -> None:
+        table = read(exported, "samples", source="indoor")
+        assert table.num_rows == 2 * 24 * 6
+        rows = table.sort_by("time").to_pylist()
+        assert rows[1]["time"] == datetime.fromtimestamp(T0 + 600, timezone.utc)
+        assert rows[1]["temperature"] == 1.0
+        assert rows[1]["co2"] == 401.0
+
+    def test_columns_and_range(self, exported: Path) -> None:
+        table = read(
+            exported,
+            "samples",
+            columns=["temperature"],
+            start=datetime.fromtimestamp(T0 + DAY, timezone.utc),
+        )
+        assert "time" in table.column_names
+        assert "co2" not in table.column_names
+        # The indoor samples of the second day and the outdoor ones
+        assert table.num_rows == 24 * 6 + 24
+
+    def test_hourly_round_trip(self, exported: Path) -> None:
+        table = read(exported, "hourly", source="indoor").sort_by("time")
+        first = table.to_pylist()[0]
+        assert first["temperature_count"] == 6
+        assert first["temperature_mean"] == 2.5
+        assert first["co2_max"] == 405.0
+
+    def test_consumption_round_trip(self, exported: Path) -> None:
+        (row,) = read(exported, "consumption").to_pylist()
+        assert row["resolution"] == "HOURLY"
+        assert row["consumption"] == 1.5
+        assert row["source"] == "tibber"
@@ -0,0 +1,136 @@
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+import pytest
+
+from edbo_data.fetching.circuit_breaker import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpenError,
+)
+from edbo_data.fetching.fetch_all import FetchAll
+from edbo_data.fetching.rate_limit import RateLimit, TokenBucket
+from edbo_data.fetching.registry import BUILTIN_SOURCES, SourceSpec, select_sources
+
+
+class TestTokenBucket:
+
+    def test_burst_then_wait(self, tmp_path: Path) -> None:
+        bucket = TokenBucket(tmp_path / "bucket.json", RateLimit(rate=100, burst=3))
+        assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+        assert bucket.acquire() > 0
+
+    def test_shared_through_the_file(self, tmp_path: Path) -> None:
+        limit = RateLimit(rate=0.001, burst=1)
+        TokenBucket(tmp_path / "bucket.json", limit).acquire()
+        assert TokenBucket(tmp_path / "bucket.json", limit)._update(tokens=1) > 0
+
+    def test_block(self, tmp_path: Path) -> None:
+        bucket = TokenBucket(tmp_path / "bucket.json", RateLimit(rate=100, burst=10))
+        bucket.block(60)
+        assert bucket._update(tokens=1) > 50
+
+
+def fail() -> None:
+    raise ConnectionError("down")
+
+
+class TestCircuitBreaker:
+
+    def test_opens_after_threshold(self, tmp_path: Path) -> None:
+        breaker = CircuitBreaker(tmp_path / "breaker.json", failure_threshold=2)
+        for _ in range(2):
+            with pytest.raises(ConnectionError):
+                breaker.call(fail)
+        assert breaker.state == OPEN
+        with pytest.raises(CircuitOpenError):
+            breaker.call(lambda: None)
+
+    def test_half_open_closes_on_success(self, tmp_path: Path) -> None:
+        breaker = CircuitBreaker(
+            tmp_path / "breaker.json", failure_threshold=1, reset_timeout=0
+        )
+        with pytest.raises(ConnectionError):
+            breaker.call(fail)
+        breaker.before_call()
+        assert breaker.state == HALF_OPEN
+        breaker.record_success()
+        assert breaker.state == CLOSED
+
+    def test_success_resets_failures(self, tmp_path: Path) -> None:
+        breaker = CircuitBreaker(tmp_path / "breaker.json", failure_threshold=2)
+        with pytest.raises(ConnectionError):
+            breaker.call(fail)
+        assert breaker.call(lambda: 1) == 1
+        with pytest.raises(ConnectionError):
+            breaker.call(fail)
+        assert breaker.state == CLOSED
+
+
+class TestSelectSources:
+
+    specs = list(BUILTIN_SOURCES.values())
+
+    def names(self, sections: list[str] | None) -> list[str]:
+        return [spec.name for spec in select_sources(self.specs, sections)]
+
+    def test_all(self) -> None:
+        assert self.names(None) == list(BUILTIN_SOURCES)
+
+    def test_section(self) -> None:
+        assert self.names(["energy.prices"]) == ["tibber_prices"]
+        assert self.names(["indoor.co2"]) == ["netatmo"]
+
+    def test_shared_section(self) -> None:
+        assert self.names(["outdoor.current"]) == ["netatmo", "smhi"]
+
+    def test_dependencies(self) -> None:
+        spec = SourceSpec("derived", "extra", depends_on=("smhi",))
+        names = [s.name for s in select_sources([*self.specs, spec], ["extra"])]
+        assert names == ["smhi", "derived"]
+
+    def test_unknown_section(self) -> None:
+        with pytest.raises(ValueError):
+            self.names(["garden"])
+
+
+PRICES = {"2025-01-17T00:00:00+01:00": 1.25}
+
+
+def fetch_prices(self: FetchAll) -> dict[str, Any]:
+    return PRICES
+
+
+def fail_prices(self: FetchAll) -> dict[str, Any]:
+    raise ConnectionError("Tibber is down")
+
+
+def fetch_all(directory: Path, token: str) -> FetchAll:
+    config = SimpleNamespace(general_sources="tibber_prices", tibber_token=token)
+    return FetchAll(config, directory=directory)
+
+
+class TestLastGood:
+
+    def test_stale_data_of_the_same_account(
+        self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        monkeypatch.setattr(FetchAll, "fetch_tibber_prices", fetch_prices)
+        assert fetch_all(tmp_path, "a").get_data()["energy"]["prices"] == PRICES
+        monkeypatch.setattr(FetchAll, "fetch_tibber_prices", fail_prices)
+        all_data = fetch_all(tmp_path, "a").get_data()
+        assert all_data["energy"]["prices"] == PRICES
+        assert all_data["stale_sources"] == ["tibber_prices"]
+
+    def test_not_shared_between_accounts(
+        self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        monkeypatch.setattr(FetchAll, "fetch_tibber_prices", fetch_prices)
+        fetch_all(tmp_path, "a").get_data()
+        monkeypatch.setattr(FetchAll, "fetch_tibber_prices", fail_prices)
+        all_data = fetch_all(tmp_path, "b").get_data()
+        assert "prices" not in all_data.get("energy", {})
+        assert all_data["unavailable_sources"] == ["tibber_prices"]
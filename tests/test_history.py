@@ -0,0 +1,86 @@
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+
+from edbo_data.storage.history import DAY, HOUR, HistoryStore
+
+# Midnight UTC
+T0 = 1_700_006_400
+
+
+@pytest.fixture
+def store(tmp_path: Path) -> Iterator[HistoryStore]:
+    history = HistoryStore(tmp_path / "history.sqlite")
+    yield history
+    history.close()
+
+
+def add_every_10_minutes(store: HistoryStore, start: int, end: int) -> None:
+    store.add_samples(("x", t, 1.0) for t in range(start, end, 600))
+
+
+class TestCompaction:
+
+    def test_rollups_match_samples(self, store: HistoryStore) -> None:
+        add_every_10_minutes(store, T0, T0 + 2 * DAY)
+        before = store.aggregates("x", T0, T0 + 2 * DAY, HOUR)
+        store.compact(now=T0 + 2 * DAY)
+        assert store.aggregates("x", T0, T0 + 2 * DAY, HOUR) == before
+        assert [a.samples for a in store.rollup("x", DAY, T0, T0 + 2 * DAY)] == [
+            144,
+            144,
+        ]
+
+    def test_late_samples_are_rolled_up(self, store: HistoryStore) -> None:
+        add_every_10_minutes(store, T0, T0 + DAY)
+        store.compact(now=T0 + DAY)
+        # Consumption arriving three hours late
+        late = T0 + DAY - 3 * HOUR + 60
+        store.add_samples([("x", late, 100.0)])
+        store.compact(now=T0 + DAY + 600)
+        (hour,) = store.rollup("x", HOUR, late - 60, late - 60 + HOUR)
+        assert hour.samples == 7
+        assert hour.max == 100.0
+        (day,) = store.rollup("x", DAY, T0, T0 + DAY)
+        assert day.sum == 244.0
+
+    def test_purge_keeps_rollups(self, store: HistoryStore) -> None:
+        add_every_10_minutes(store, T0, T0 + 2 * DAY)
+        store.compact(now=T0 + 2 * DAY, raw_retention=DAY)
+        assert store.raw_samples("x", T0, T0 + DAY) == []
+        aggregates = store.aggregates("x", T0, T0 + 2 * DAY, DAY)
+        assert [a.samples for a in aggregates] == [144, 144]
+
+
+class TestAggregates:
+
+    def test_unaligned_start_keeps_partial_bucket(self, store: HistoryStore) -> None:
+        add_every_10_minutes(store, T0, T0 + 2 * DAY)
+        store.compact(now=T0 + 2 * DAY)
+        aggregates = store.aggregates("x", T0 + HOUR, T0 + 2 * DAY, DAY)
+        assert [(a.start, a.samples) for a in aggregates] == [
+            (T0, 138),
+            (T0 + DAY, 144),
+        ]
+
+    def test_unaligned_start_and_end(self, store: HistoryStore) -> None:
+        add_every_10_minutes(store, T0, T0 + DAY)
+        store.compact(now=T0 + DAY)
+        aggregates = store.aggregates("x", T0 + 1800, T0 + 3 * HOUR + 1800, HOUR)
+        assert [a.samples for a in aggregates] == [3, 6, 6, 3]
+
+    def test_uncompacted_tail_from_samples(self, store: HistoryStore) -> None:
+        add_every_10_minutes(store, T0, T0 + DAY + 2 * HOUR)
+        store.compact(now=T0 + DAY)
+        aggregates = store.aggregates("x", T0, T0 + 2 * DAY, DAY)
+        assert [a.samples for a in aggregates] == [144, 12]
+
+
+class TestForecasts:
+
+    def test_runs_in_use(self, store: HistoryStore) -> None:
+        for issued in (T0, T0 + HOUR, T0 + 2 * HOUR):
+            store.add_forecast(issued, [("temperature", issued + HOUR, 1.0)])
+        runs = store.forecasts(T0 + 1800, T0 + 2 * HOUR)
+        assert [issued for issued, *_ in runs] == [T0, T0 + HOUR]
@@ -0,0 +1,92 @@
+import threading
+import time
+from pathlib import Path
+from typing import Any, Iterator
+
+import pytest
+
+from edbo_data.fetching.latency import LatencyBudget, LatencyTracker
+
+
+class Upstream:
+    """Hangs on the first request until released, answers the others."""
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.released = threading.Event()
+        self._lock = threading.Lock()
+
+    def fetch(self) -> dict[str, Any]:
+        with self._lock:
+            self.calls += 1
+            first = self.calls == 1
+        if first:
+            self.released.wait()
+        return {"attempt": 1 if first else 2}
+
+
+@pytest.fixture
+def upstream() -> Iterator[Upstream]:
+    stand_in = Upstream()
+    yield stand_in
+    stand_in.released.set()
+
+
+def tracker(tmp_path: Path, durations: list[float]) -> LatencyTracker:
+    latency = LatencyTracker(tmp_path / "latency.json")
+    for duration in durations:
+        latency.record("smhi", duration)
+    return latency
+
+
+class TestLatencyTracker:
+
+    def test_percentile_needs_samples(self, tmp_path: Path) -> None:
+        latency = tracker(tmp_path, [0.1] * 4)
+        assert latency.percentile("smhi", 0.95) is None
+        latency.record("smhi", 0.5)
+        assert latency.percentile("smhi", 0.95) == 0.5
+        assert latency.percentile("smhi", 0.5) == 0.1
+
+    def test_saved(self, tmp_path: Path) -> None:
+        tracker(tmp_path, [0.1, 0.2, 0.3, 0.4, 0.5]).save()
+        loaded = LatencyTracker(tmp_path / "latency.json")
+        assert loaded.percentile("smhi", 0.0) == 0.1
+
+
+class TestLatencyBudget:
+
+    def test_hedged_request(self, tmp_path: Path, upstream: Upstream) -> None:
+        budget = LatencyBudget(10.0, tracker(tmp_path, [0.05] * 5))
+        started = time.time()
+        results, errors = budget.run({"smhi": upstream.fetch}, started + 10.0)
+        assert results == {"smhi": {"attempt": 2}}
+        assert errors == {}
+        assert upstream.calls == 2
+        assert time.time() - started < 5.0
+
+    def test_no_hedge_without_run_times(
+        self, tmp_path: Path, upstream: Upstream
+    ) -> None:
+        budget = LatencyBudget(10.0, tracker(tmp_path, []))
+        threading.Timer(0.2, upstream.released.set).start()
+        results, _ = budget.run({"smhi": upstream.fetch}, time.time() + 10.0)
+        assert results == {"smhi": {"attempt": 1}}
+        assert upstream.calls == 1
+
+    def test_deadline(self, tmp_path: Path, upstream: Upstream) -> None:
+        budget = LatencyBudget(0.2, tracker(tmp_path, []))
+        started = time.time()
+        results, errors = budget.run({"smhi": upstream.fetch}, started + 0.2)
+        assert results == {}
+        assert isinstance(errors["smhi"], TimeoutError)
+        assert 0.2 <= time.time() - started < 5.0
+
+    def test_failure(self, tmp_path: Path) -> None:
+        def fail() -> dict[str, Any]:
+            raise ConnectionError("SMHI is down")
+
+        budget = LatencyBudget(10.0, tracker(tmp_path, []))
+        results, errors = budget.run({"smhi": fail}, time.time() + 10.0)
+        assert results == {}
+        assert isinstance(errors["smhi"], ConnectionError)
@@ -0,0 +1,146 @@
+import json
+from typing import Any
+
+from edbo_data.collecting.mqtt import MqttPublisher, topics
+
+
+class Broker:
+    """Keeps the retained messages like an MQTT broker."""
+
+    def __init__(self) -> None:
+        self.retained: dict[str, str] = {}
+        self.received: list[str] = []
+
+    def receive(self, topic: str, payload: str, retain: bool) -> None:
+        self.received.append(topic)
+        if not retain:
+            return
+        if payload:
+            self.retained[topic] = payload
+        else:
+            # An empty retained message removes the retained value
+            self.retained.pop(topic, None)
+
+
+class Client:
+    """Stands in for a paho Client connected to a Broker."""
+
+    def __init__(self, broker: Broker) -> None:
+        self.broker = broker
+        self.connected = False
+        self.will: tuple[str, str] | None = None
+        self.on_connect: Any = None
+        self.on_disconnect: Any = None
+
+    def username_pw_set(self, username: str, password: str | None) -> None:
+        pass
+
+    def will_set(self, topic: str, payload: str, retain: bool) -> None:
+        self.will = (topic, payload)
+
+    def connect_async(self, host: str, port: int) -> None:
+        pass
+
+    def loop_start(self) -> None:
+        self.connect()
+
+    def loop_stop(self) -> None:
+        pass
+
+    def publish(self, topic: str, payload: str, retain: bool = False) -> None:
+        # paho drops the messages published while it is disconnected
+        if self.connected:
+            self.broker.receive(topic, payload, retain)
+
+    def disconnect(self) -> None:
+        self.connected = False
+
+    def connect(self) -> None:
+        self.connected = True
+        self.on_connect(self, None, {}, 0)
+
+    def lose_connection(self) -> None:
+        # The broker publishes the last will when a client goes away
+        self.connected = False
+        assert self.will is not None
+        self.broker.receive(*self.will, retain=True)
+        self.on_disconnect(self, None, 1)
+
+
+DATA = {
+    "indoor": {"temperature": 21.5, "co2": 600},
+    "energy": {"prices": {"2025-01-17T00:00:00+01:00": 1.25}},
+}
+
+
+def publisher(broker: Broker) -> tuple[MqttPublisher, Client]:
+    client = Client(broker)
+    return MqttPublisher("broker", prefix="home", client=client), client
+
+
+class TestTopics:
+
+    def test_topics(self) -> None:
+        messages = topics(DATA, "home")
+        assert messages["home/indoor/temperature"] == "21.5"
+        assert json.loads(messages["home/energy/prices"]) == DATA["energy"]["prices"]
+
+
+class TestMqttPublisher:
+
+    def test_retained(self) -> None:
+        broker = Broker()
+        mqtt, _ = publisher(broker)
+        assert mqtt.publish(DATA) == 3
+        assert broker.retained == {
+            "home/status": "online",
+            "home/indoor/temperature": "21.5",
+            "home/indoor/co2": "600",
+            "home/energy/prices": '{"2025-01-17T00:00:00+01:00": 1.25}',
+        }
+
+    def test_only_changed(self) -> None:
+        broker = Broker()
+        mqtt, _ = publisher(broker)
+        mqtt.publish(DATA)
+        broker.received.clear()
+        changed = {**DATA, "indoor": {"temperature": 22.0, "co2": 600}}
+        assert mqtt.publish(changed) == 1
+        assert broker.received == ["home/indoor/temperature"]
+
+    def test_gone_values_are_cleared(self) -> None:
+        broker = Broker()
+        mqtt, _ = publisher(broker)
+        mqtt.publish(DATA)
+        assert mqtt.publish({"indoor": {"temperature": 21.5}}) == 2
+        assert "home/indoor/co2" not in broker.retained
+        assert "home/energy/prices" not in broker.retained
+        assert mqtt.publish({"indoor": {"temperature": 21.5}}) == 0
+
+    def test_republish_on_reconnect(self) -> None:
+        broker = Broker()
+        mqtt, client = publisher(broker)
+        mqtt.publish(DATA)
+        client.lose_connection()
+        # The broker lost the retained values, and this snapshot is dropped
+        broker.retained.clear()
+        changed = {**DATA, "indoor": {"temperature": 22.0, "co2": 600}}
+        mqtt.publish(changed)
+        client.connect()
+        assert broker.retained["home/status"] == "online"
+        assert broker.retained["home/indoor/temperature"] == "22.0"
+        assert broker.retained["home/indoor/co2"] == "600"
+
+    def test_last_will(self) -> None:
+        broker = Broker()
+        mqtt, client = publisher(broker)
+        assert client.will == ("home/status", "offline")
+        client.lose_connection()
+        assert broker.retained["home/status"] == "offline"
+
+    def test_close(self) -> None:
+        broker = Broker()
+        mqtt, client = publisher(broker)
+        mqtt.close()
+        assert broker.retained["home/status"] == "offline"
+        assert not client.connected
@@ -0,0 +1,96 @@
+import io
+import pstats
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+from rich.console import Console
+
+from edbo_data import profiling
+from edbo_data.profiling import SpanTracer, profile, span
+
+
+def work() -> int:
+    with span("fetch"):
+        thread = threading.Thread(target=busy, name="fetcher")
+        thread.start()
+        thread.join()
+    with span("merge"):
+        pass
+    with span("merge"):
+        pass
+    return 42
+
+
+def busy() -> None:
+    end = time.perf_counter() + 0.1
+    while time.perf_counter() < end:
+        pass
+
+
+def quiet(buffer: io.StringIO | None = None) -> Console:
+    return Console(file=buffer or io.StringIO(), width=120)
+
+
+class TestSpans:
+
+    def test_no_tracer_outside_profile(self) -> None:
+        with span("fetch"):
+            pass
+        assert profiling._tracer is None
+
+    def test_tracer(self) -> None:
+        tracer = SpanTracer()
+        tracer.add("fetch", 0.5)
+        tracer.add("fetch", 1.5)
+        stage = tracer.stages["fetch"]
+        assert (stage.calls, stage.total, stage.longest) == (2, 2.0, 1.5)
+
+    def test_stage_table(self, tmp_path: Path) -> None:
+        buffer = io.StringIO()
+        assert profile(work, "sample", tmp_path / "profile.txt", quiet(buffer)) == 42
+        output = buffer.getvalue()
+        assert "fetch" in output
+        assert "merge" in output
+        assert profiling._tracer is None
+
+
+class TestProfilers:
+
+    def test_collapsed_stacks(self, tmp_path: Path) -> None:
+        output = tmp_path / "profile.txt"
+        profile(work, "sample", output, quiet())
+        lines = output.read_text().splitlines()
+        assert lines
+        for line in lines:
+            assert int(line.rsplit(" ", 1)[1]) > 0
+        busy_stacks = [line for line in lines if "busy (test_profiling.py:" in line]
+        assert busy_stacks
+        # The thread name is the root of the stack
+        assert all(line.startswith("fetcher;") for line in busy_stacks)
+
+    def test_deterministic(self, tmp_path: Path) -> None:
+        output = tmp_path / "profile.pstats"
+        profile(work, "deterministic", output, quiet())
+        stats = pstats.Stats(str(output))
+        functions = {name for _, _, name in stats.stats}
+        assert "work" in functions
+        if sys.version_info < (3, 12):
+            # Every thread has its own profiler, merged when written
+            assert "busy" in functions
+
+    def test_written_when_func_raises(self, tmp_path: Path) -> None:
+        def fail() -> None:
+            with span("fetch"):
+                raise ConnectionError("down")
+
+        output = tmp_path / "profile.txt"
+        with pytest.raises(ConnectionError):
+            profile(fail, "sample", output, quiet())
+        assert output.exists()
+
+    def test_unknown_mode(self, tmp_path: Path) -> None:
+        with pytest.raises(ValueError):
+            profile(work, "tracing", tmp_path / "profile.txt", quiet())
@@ -0,0 +1,123 @@
+import argparse
+import json
+import time
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Iterator
+
+import pytest
+
+from edbo_data.storage.history import HOUR, HistoryStore, history_path
+from edbo_data.storage.query import bucket_start, parse_duration, query
+
+
+@pytest.fixture(autouse=True)
+def stockholm(monkeypatch: pytest.MonkeyPatch) -> Iterator[None]:
+    # The days are local, and summer time starts on 2025-03-30
+    monkeypatch.setenv("TZ", "Europe/Stockholm")
+    time.tzset()
+    yield
+    monkeypatch.undo()
+    time.tzset()
+
+
+def local(text: str) -> int:
+    return int(datetime.fromisoformat(text).timestamp())
+
+
+def hourly_nodes(start: int, end: int) -> list[dict[str, Any]]:
+    return [
+        {
+            "from": datetime.fromtimestamp(t).astimezone().isoformat(),
+            "consumption": 1.0,
+            "cost": 2.0,
+        }
+        for t in range(start, end, HOUR)
+    ]
+
+
+@pytest.fixture
+def store(tmp_path: Path) -> Iterator[HistoryStore]:
+    history = HistoryStore(tmp_path / "history.sqlite")
+    yield history
+    history.close()
+
+
+class TestBuckets:
+
+    def test_days_start_at_local_midnight(self) -> None:
+        assert bucket_start(local("2025-03-29T00:30"), 86400) == local("2025-03-29")
+        assert bucket_start(local("2025-03-30T23:30"), 86400) == local("2025-03-30")
+
+    def test_weeks_start_on_monday(self) -> None:
+        week = parse_duration("1w")
+        assert bucket_start(local("2025-03-30T12:00"), week) == local("2025-03-24")
+
+    def test_shorter_buckets_in_utc(self) -> None:
+        assert bucket_start(local("2025-03-29T00:30"), HOUR) == local("2025-03-29")
+
+
+class TestQuery:
+
+    def test_samples_by_local_day(self, store: HistoryStore) -> None:
+        start, end = local("2025-03-29"), local("2025-03-31")
+        store.add_samples(("indoor.co2", t, 500.0) for t in range(start, end, HOUR))
+        store.compact(now=end)
+        days = query(store, "indoor.co2", start, end, 86400)
+        assert [(a.start, a.samples) for a in days] == [
+            (local("2025-03-29"), 24),
+            (local("2025-03-30"), 23),
+        ]
+
+    def test_consumption_by_local_day(self, store: HistoryStore) -> None:
+        start, end = local("2025-03-29"), local("2025-03-31")
+        store.add_consumption("HOURLY", hourly_nodes(start, end))
+        days = query(store, "tibber.cost", start, end, 86400)
+        assert [(a.start, a.sum) for a in days] == [
+            (local("2025-03-29"), 48.0),
+            (local("2025-03-30"), 46.0),
+        ]
+
+    def test_daily_rows_without_hourly_rows(self, store: HistoryStore) -> None:
+        start, end = local("2025-03-01"), local("2025-03-04")
+        store.add_consumption("HOURLY", hourly_nodes(local("2025-03-03"), end))
+        store.add_consumption(
+            "DAILY",
+            [
+                {"from": f"2025-03-0{day}T00:00:00+01:00", "consumption": 30.0}
+                for day in (1, 2, 3)
+            ],
+        )
+        days = query(store, "tibber.consumption", start, end, 86400)
+        assert [a.sum for a in days] == [30.0, 30.0, 24.0]
+        hours = query(store, "tibber.consumption", start, end, HOUR)
+        assert len(hours) == 24
+
+
+class TestHistoryCommand:
+
+    def test_local_days(
+        self, tmp_path: Path, capsys: pytest.CaptureFixture[str]
+    ) -> None:
+        from edbo_data.edbo_data import print_history
+
+        config = SimpleNamespace(general_state_dir=str(tmp_path))
+        store = HistoryStore(history_path(config))
+        store.add_consumption(
+            "HOURLY", hourly_nodes(local("2025-03-29"), local("2025-03-31"))
+        )
+        store.close()
+        args = argparse.Namespace(
+            series="tibber.consumption",
+            since="2025-03-29",
+            until="2025-03-31",
+            resample="1d",
+            agg="sum,count",
+            format="json",
+        )
+        print_history(config, args)
+        assert json.loads(capsys.readouterr().out) == [
+            {"time": "2025-03-29T00:00:00", "sum": 24.0, "count": 24},
+            {"time": "2025-03-30T00:00:00", "sum": 23.0, "count": 23},
+        ]
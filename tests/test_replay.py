@@ -0,0 +1,95 @@
+from datetime import datetime
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from edbo_data.collecting.replay import Replay
+from edbo_data.storage.history import DAY, HOUR, HistoryStore
+
+# Local midnight, the prices of the next day are published at 13:00 local time
+T0 = int(datetime(2025, 1, 17).timestamp())
+
+
+@pytest.fixture
+def history(tmp_path: Path) -> Path:
+    path = tmp_path / "history.sqlite"
+    store = HistoryStore(path)
+    # Indoor temperature 10 in the first hour and 20 in the second
+    store.add_samples(
+        ("indoor.temperature", t, 10.0 if t < T0 + HOUR else 20.0)
+        for t in range(T0, T0 + 2 * HOUR, 600)
+    )
+    # Two forecast runs, the second one two hours in
+    for issued, temperature in ((T0 - HOUR, 1.0), (T0 + 2 * HOUR, 2.0)):
+        store.add_forecast(
+            issued,
+            [("temperature", issued + hour * HOUR, temperature) for hour in range(26)],
+        )
+    # Hourly prices of today and tomorrow
+    store.add_samples(
+        ("energy.prices", T0 + hour * HOUR, float(hour)) for hour in range(48)
+    )
+    store.close()
+    return path
+
+
+def snapshots(history: Path, start: int, end: int) -> dict[int, dict[str, Any]]:
+    replay = Replay(history)
+    timeline = replay.timeline(start, end)
+    return {step - T0: data for step, data in replay.snapshots(timeline)}
+
+
+def forecast_temperature(all_data: dict[str, Any]) -> float:
+    first = next(iter(all_data["outdoor"]["forecast_24h"].values()))
+    temperature: float = first["temperature"]
+    return temperature
+
+
+class TestSnapshots:
+
+    def test_only_ended_buckets(self, history: Path) -> None:
+        steps = snapshots(history, T0, T0 + 3 * HOUR)
+        assert "indoor" not in steps[0]
+        # Also at the end of the first hour the samples of the second one
+        # are not known yet
+        assert steps[HOUR]["indoor"]["temperature"] == 10.0
+        assert steps[2 * HOUR]["indoor"]["temperature"] == 20.0
+
+    def test_forecast_issued_before_the_step(self, history: Path) -> None:
+        steps = snapshots(history, T0, T0 + 4 * HOUR)
+        assert forecast_temperature(steps[0]) == 1.0
+        assert forecast_temperature(steps[HOUR]) == 1.0
+        assert forecast_temperature(steps[2 * HOUR]) == 2.0
+        assert forecast_temperature(steps[3 * HOUR]) == 2.0
+
+    def test_next_day_prices_from_13(self, history: Path) -> None:
+        steps = snapshots(history, T0 + 12 * HOUR, T0 + 14 * HOUR)
+        assert len(steps[12 * HOUR]["energy"]["prices"]) == 24
+        assert len(steps[13 * HOUR]["energy"]["prices"]) == 48
+
+
+def derived(step_time: int, all_data: dict[str, Any]) -> dict[str, Any]:
+    # The total counts from the start of the replay, the windows do not
+    return {window: all_data["derived"][window] for window in ("24h", "7d")}
+
+
+class TestRun:
+
+    def test_split_run_matches_single_run(self, tmp_path: Path) -> None:
+        path = tmp_path / "history.sqlite"
+        store = HistoryStore(path)
+        store.add_samples(
+            ("outdoor.temperature", t, float(t // HOUR % 24 - 5))
+            for t in range(T0 - 10 * DAY, T0 + 4 * DAY, 600)
+        )
+        store.add_samples(
+            ("energy.current_price.total", t, float(t // HOUR % 7))
+            for t in range(T0 - 10 * DAY, T0 + 4 * DAY, HOUR)
+        )
+        store.close()
+        replay = Replay(path)
+        single = replay.run(derived, T0, T0 + 4 * DAY)
+        split = replay.run(derived, T0, T0 + 4 * DAY, workers=2)
+        assert len(single) == 4 * 24
+        assert split == single
@@ -0,0 +1,59 @@
+from datetime import datetime, time
+from zoneinfo import ZoneInfo
+
+from edbo_data.collecting.scheduler import (
+    AlignedCadence,
+    DailyCadence,
+    IntervalCadence,
+    PollScheduler,
+)
+
+NOW = 1_700_006_400.0
+
+
+class TestCadences:
+
+    def test_interval_backs_off(self) -> None:
+        cadence = IntervalCadence(interval=600, max_interval=1800)
+        assert cadence.next_poll(NOW, True, 0) == NOW + 600
+        assert cadence.next_poll(NOW, False, 1) == NOW + 1200
+        assert cadence.next_poll(NOW, False, 5) == NOW + 1800
+
+    def test_aligned(self) -> None:
+        cadence = AlignedCadence(period=3600, offset=120)
+        assert cadence.next_poll(NOW + 200, True, 0) == NOW + 3600 + 120
+        assert cadence.next_poll(NOW + 200, False, 1) == NOW + 500
+
+    def test_daily_waits_for_publishing(self) -> None:
+        cadence = DailyCadence(publish=time(13, 0))
+        zone = ZoneInfo(cadence.timezone)
+        morning = datetime(2025, 1, 17, 9, 0, tzinfo=zone).timestamp()
+        publish = datetime(2025, 1, 17, 13, 0, tzinfo=zone).timestamp()
+        assert cadence.next_poll(morning, True, 0) == publish
+        assert cadence.next_poll(publish + 60, True, 0) == publish + 86400
+
+
+class TestPollScheduler:
+
+    def scheduler(self) -> PollScheduler:
+        return PollScheduler({"a": IntervalCadence(interval=600, max_interval=1800)})
+
+    def test_due_until_polled(self) -> None:
+        scheduler = self.scheduler()
+        assert scheduler.due(NOW) == ["a"]
+        assert scheduler.record("a", {"value": 1}, NOW)
+        assert scheduler.due(NOW) == []
+        assert scheduler.seconds_until_next(NOW) == 600
+
+    def test_unchanged_data(self) -> None:
+        scheduler = self.scheduler()
+        scheduler.record("a", {"value": 1}, NOW)
+        assert scheduler.is_unchanged("a", {"value": 1})
+        assert not scheduler.record("a", {"value": 1}, NOW + 600)
+        assert scheduler.seconds_until_next(NOW + 600) == 1200
+
+    def test_failures_back_off(self) -> None:
+        scheduler = self.scheduler()
+        scheduler.record_failure("a", NOW)
+        scheduler.record_failure("a", NOW)
+        assert scheduler.seconds_until_next(NOW) == 120
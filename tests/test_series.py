@@ -0,0 +1,104 @@
+import math
+from array import array
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from edbo_data.series.forecast_series import ForecastSeries
+from edbo_data.series.price_series import HOUR, QUARTER_HOUR, PriceSeries
+
+START = datetime(2025, 1, 17, tzinfo=timezone.utc)
+
+
+def hourly_prices(count: int) -> dict[str, float]:
+    return {
+        (START + timedelta(hours=hour)).isoformat(): float(hour)
+        for hour in range(count)
+    }
+
+
+class TestPriceSeries:
+
+    def test_from_price_info(self) -> None:
+        series = PriceSeries.from_price_info(hourly_prices(24))
+        assert len(series) == 24
+        assert series.resolution == HOUR
+        assert series.timestamps[1] - series.timestamps[0] == HOUR
+
+    def test_from_price_info_with_gap(self) -> None:
+        prices = hourly_prices(4)
+        del prices[(START + timedelta(hours=2)).isoformat()]
+        series = PriceSeries.from_price_info(prices)
+        assert list(series.prices) == [0.0, 1.0, 3.0]
+        assert series.resolution == HOUR
+
+    def test_current(self) -> None:
+        series = PriceSeries.from_price_info(hourly_prices(24))
+        start = series.timestamps[0]
+        assert series.current(start - 1) is None
+        assert series.current(start + 90 * 60) == 1.0
+        assert series.current(start + 23 * HOUR + 3599) == 23.0
+        assert series.current(start + 24 * HOUR) is None
+
+    def test_future(self) -> None:
+        series = PriceSeries.from_price_info(hourly_prices(24))
+        future = series.future(series.timestamps[0] + 90 * 60)
+        assert list(future.prices) == [float(hour) for hour in range(2, 24)]
+
+    def test_resample_round_trip(self) -> None:
+        series = PriceSeries.from_price_info(hourly_prices(24))
+        quarters = series.resample(QUARTER_HOUR)
+        assert len(quarters) == 96
+        assert quarters.current(series.timestamps[0] + 50 * 60) == 0.0
+        hours = quarters.resample(HOUR)
+        assert list(hours.timestamps) == list(series.timestamps)
+        assert list(hours.prices) == list(series.prices)
+
+    def test_resample_to_a_non_multiple(self) -> None:
+        series = PriceSeries.from_price_info(hourly_prices(24))
+        with pytest.raises(ValueError):
+            series.resample(25 * 60)
+        with pytest.raises(ValueError):
+            series.resample(90 * 60)
+        with pytest.raises(ValueError):
+            series.resample(0)
+
+
+def forecast(values: dict[str, list[float]]) -> ForecastSeries:
+    count = len(next(iter(values.values())))
+    conditions = [
+        {"valid_time": START + timedelta(hours=hour)}
+        | {parameter: column[hour] for parameter, column in values.items()}
+        for hour in range(count)
+    ]
+    return ForecastSeries.from_conditions(conditions)
+
+
+class TestForecastSeries:
+
+    def test_linear(self) -> None:
+        series = forecast({"temperature": [0.0, 10.0]})
+        start = series.timestamps[0]
+        result = series.interpolate(
+            "temperature", [start + 1800, start, start + HOUR, start + 2 * HOUR]
+        )
+        assert list(result[:3]) == [5.0, 0.0, 10.0]
+        assert math.isnan(result[3])
+
+    def test_circular_goes_the_short_way(self) -> None:
+        series = forecast({"wind_direction": [350.0, 10.0]})
+        start = series.timestamps[0]
+        (middle,) = series.interpolate("wind_direction", [start + 1800])
+        assert middle == pytest.approx(0.0)
+        (quarter,) = series.interpolate("wind_direction", [start + 900])
+        assert quarter == pytest.approx(355.0)
+
+    def test_step(self) -> None:
+        series = forecast({"symbol": [1.0, 5.0]})
+        start = series.timestamps[0]
+        assert list(series.interpolate("symbol", [start + 3599])) == [1.0]
+
+    def test_unknown_parameter(self) -> None:
+        series = ForecastSeries(array("q"), {})
+        with pytest.raises(ValueError):
+            series.interpolate("snow", [0])
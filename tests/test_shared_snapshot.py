@@ -0,0 +1,121 @@
+import math
+import sys
+import threading
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Iterator
+
+import pytest
+
+from edbo_data.collecting.shared_snapshot import SnapshotReader, SnapshotWriter, samples
+from edbo_data.series.forecast_series import ForecastSeries
+
+# 2025-01-17 00:00 UTC
+T0 = 1_737_072_000
+HOUR = 3600
+
+
+def prices(hours: int, price: float) -> dict[str, float]:
+    return {
+        datetime.fromtimestamp(T0 + hour * HOUR, timezone.utc).isoformat(): price
+        for hour in range(hours)
+    }
+
+
+def forecast(hours: int, temperature: float) -> ForecastSeries:
+    return ForecastSeries.from_conditions(
+        [
+            {
+                "valid_time": datetime.fromtimestamp(T0 + hour * HOUR, timezone.utc),
+                "temperature": temperature,
+            }
+            for hour in range(hours)
+        ]
+    )
+
+
+def all_data(value: float, hours: int) -> dict[str, Any]:
+    return {
+        "indoor": {"temperature": value, "co2": value},
+        "energy": {"prices": prices(hours, value)},
+    }
+
+
+@pytest.fixture
+def path(tmp_path: Path) -> Iterator[Path]:
+    path = tmp_path / "snapshot.bin"
+    writer = SnapshotWriter(path)
+    writer.publish(all_data(1.0, 24), forecast(72, -2.0))
+    writer.close()
+    yield path
+
+
+class TestSnapshot:
+
+    def test_scalars(self, path: Path) -> None:
+        reader = SnapshotReader(path)
+        assert reader.scalar("indoor.temperature") == 1.0
+        assert math.isnan(reader.scalar("outdoor.temperature"))
+        reader.close()
+
+    def test_current_price(self, path: Path) -> None:
+        reader = SnapshotReader(path)
+        assert reader.current_price(T0 + 30 * 60) == 1.0
+        assert math.isnan(reader.current_price(T0 + 24 * HOUR))
+        reader.close()
+
+    def test_forecast_keeps_the_nearest_hours(self, path: Path) -> None:
+        reader = SnapshotReader(path)
+        timestamps, values = reader.series("forecast.temperature")
+        assert timestamps == tuple(range(T0, T0 + 48 * HOUR, HOUR))
+        assert set(values) == {-2.0}
+        reader.close()
+
+    def test_forecast_not_in_samples(self) -> None:
+        names = {name for name, _, _ in samples(all_data(1.0, 24), T0)}
+        assert names == {"indoor.temperature", "indoor.co2", "energy.prices"}
+
+    def test_other_files_are_refused(self, tmp_path: Path) -> None:
+        other = tmp_path / "other.bin"
+        other.write_bytes(b"\0" * 4096)
+        with pytest.raises(ValueError):
+            SnapshotReader(other)
+
+
+class TestSeqlock:
+
+    def test_reader_never_sees_a_torn_snapshot(self, path: Path) -> None:
+        # Switch threads often so that reads overlap with writes
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        writer = SnapshotWriter(path)
+        done = threading.Event()
+
+        def write() -> None:
+            # Every snapshot has the same value everywhere, and the number
+            # of prices and forecast hours tells which one it is
+            for value in range(1, 2001):
+                hours = 24 if value % 2 else 48
+                writer.publish(all_data(value, hours), forecast(hours, value))
+            done.set()
+
+        reader = SnapshotReader(path, max_retries=1_000_000)
+        thread = threading.Thread(target=write)
+        try:
+            thread.start()
+            reads = 0
+            while not done.is_set():
+                for name in ("energy.prices", "forecast.temperature"):
+                    timestamps, values = reader.series(name)
+                    assert len(timestamps) == len(values)
+                    assert len(set(values)) == 1
+                    assert len(values) == (24 if values[0] % 2 else 48)
+                scalars = reader.scalars()
+                assert scalars["indoor.temperature"] == scalars["indoor.co2"]
+                reads += 1
+            thread.join()
+        finally:
+            sys.setswitchinterval(interval)
+            reader.close()
+            writer.close()
+        assert reads > 0
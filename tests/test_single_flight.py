@@ -0,0 +1,64 @@
+import multiprocessing
+import os
+import pickle
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any
+
+from edbo_data.collecting.single_flight import SingleFlight
+
+VALID_TIME = datetime(2025, 1, 17, 12, tzinfo=timezone.utc)
+
+
+def slow_fetch(calls: Path) -> dict[str, Any]:
+    with open(calls, "a") as f:
+        f.write(f"{os.getpid()}\n")
+    time.sleep(0.5)
+    return {"outdoor": {"current": {"valid_time": VALID_TIME, "temperature": -3.0}}}
+
+
+def fetch_in_process(directory: Path, barrier: Any, result: Path) -> None:
+    barrier.wait()
+    data = SingleFlight(directory / "fetch_all.pickle").get(
+        lambda: slow_fetch(directory / "calls")
+    )
+    result.write_bytes(pickle.dumps(data))
+
+
+class TestSingleFlight:
+
+    def test_datetimes_survive_reuse(self, tmp_path: Path) -> None:
+        calls = tmp_path / "calls"
+        single_flight = SingleFlight(tmp_path / "fetch_all.pickle", max_age=60)
+        first = single_flight.get(lambda: slow_fetch(calls))
+        second = single_flight.get(lambda: slow_fetch(calls))
+        assert second == first
+        assert second["outdoor"]["current"]["valid_time"] == VALID_TIME
+        assert len(calls.read_text().splitlines()) == 1
+
+    def test_concurrent_processes_share_one_fetch(self, tmp_path: Path) -> None:
+        context = multiprocessing.get_context("fork")
+        barrier = context.Barrier(4)
+        results = [tmp_path / f"result-{index}" for index in range(4)]
+        processes = [
+            context.Process(target=fetch_in_process, args=(tmp_path, barrier, result))
+            for result in results
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(timeout=30)
+            assert process.exitcode == 0
+        assert len((tmp_path / "calls").read_text().splitlines()) == 1
+        for result in results:
+            data = pickle.loads(result.read_bytes())
+            assert data["outdoor"]["current"]["valid_time"] == VALID_TIME
+
+    def test_unreadable_result_is_fetched_again(self, tmp_path: Path) -> None:
+        path = tmp_path / "fetch_all.pickle"
+        path.write_text("{}")
+        data = SingleFlight(path, max_age=60).get(
+            lambda: slow_fetch(tmp_path / "calls")
+        )
+        assert data["outdoor"]["current"]["temperature"] == -3.0